@@ -0,0 +1,152 @@
+# Copyright 2013-2014 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Collapses redundant operations on the same document
+"""
+
+from mongo_connector.doc_managers import DocManagerBase
+from mongo_connector.errors import UpdateDoesNotApply
+
+# Only used for its apply_update method
+_updater = DocManagerBase()
+
+
+def _is_modifier(update_spec):
+    """Return True if update_spec modifies fields, rather than replacing the
+    whole document.
+    """
+    return any(key.startswith('$') for key in update_spec)
+
+
+def _merge_modifiers(spec, new_spec):
+    """Merge the $set and $unset modifiers of new_spec into spec.
+
+    Returns False, leaving spec untouched, if the specs can't be merged into
+    a single valid update: when they use other modifiers, or when new_spec
+    modifies a field inside one that spec already modifies.
+    """
+    if set(spec) - set(['$set', '$unset']):
+        return False
+    if set(new_spec) - set(['$set', '$unset']):
+        return False
+
+    new_paths = list(new_spec.get('$set', {})) + \
+        list(new_spec.get('$unset', {}))
+    old_paths = list(spec.get('$set', {})) + list(spec.get('$unset', {}))
+    for path in new_paths:
+        for old in old_paths:
+            if path.startswith(old + '.'):
+                return False
+
+    # Drop earlier changes to the same fields, or to fields inside them
+    for path in new_paths:
+        for modifier in ('$set', '$unset'):
+            fields = spec.get(modifier, {})
+            for old in list(fields):
+                if old == path or old.startswith(path + '.'):
+                    del fields[old]
+    for modifier in ('$set', '$unset'):
+        if new_spec.get(modifier):
+            spec.setdefault(modifier, {}).update(new_spec[modifier])
+        if modifier in spec and not spec[modifier]:
+            del spec[modifier]
+    return True
+
+
+def _merge(last, operation):
+    """Try to merge operation into last, the latest operation on the same
+    document.
+
+    Returns the merged operation, or None if the two can't be merged.
+    """
+    last_op, last_doc, last_spec = last
+    op, doc, update_spec = operation
+
+    # An upsert replaces the document and a removal discards it, so
+    # whatever happened to the document before doesn't matter. An insert
+    # followed by a removal still needs the removal: the document might
+    # have reached the target before this window started, e.g. through a
+    # collection dump, or before a restart from an older checkpoint.
+    if op in ('i', 'd'):
+        return operation
+
+    # op is an update
+    try:
+        if last_op == 'i':
+            # The whole document is known: apply the update to it
+            updated = _updater.apply_update(last_doc, update_spec)
+            updated['_id'] = last_doc['_id']
+            updated['_ts'] = doc['_ts']
+            updated['ns'] = doc['ns']
+            return 'i', updated, None
+        if last_op == 'u':
+            if not _is_modifier(update_spec):
+                # The new document replaces the previous updates
+                return operation
+            if not _is_modifier(last_spec):
+                # Apply the update to the replacement document
+                spec = _updater.apply_update(dict(last_spec), update_spec)
+                return 'u', doc, spec
+            spec = dict((k, dict(v)) for k, v in last_spec.items())
+            if _merge_modifiers(spec, update_spec):
+                return 'u', doc, spec
+    except UpdateDoesNotApply:
+        pass
+    return None
+
+
+def coalesce(operations):
+    """Collapse a sequence of operations into their net effect on each
+    document.
+
+    Operations are (op, doc, update_spec) tuples, as accepted by
+    DocManager.bulk_apply. The operations on each document are merged
+    where possible:
+
+      - updates to a document inserted earlier are applied to it, yielding
+        a single upsert
+      - an update replacing the whole document supersedes earlier updates
+      - consecutive $set and $unset updates are merged into one
+      - an insert or removal supersedes every earlier operation
+
+    Merged operations carry the timestamp of the last operation in them.
+    Operations that can't be merged are kept as they are, in order. The
+    operations on different documents are independent, so the result lists
+    documents in the order they were first seen.
+    """
+    keys = []
+    by_key = {}
+    for operation in operations:
+        doc = operation[1]
+        try:
+            key = (doc['ns'], doc['_id'])
+            hash(key)
+        except TypeError:
+            # _id may be a document
+            key = (doc['ns'], repr(doc['_id']))
+        pending = by_key.get(key)
+        if pending is None:
+            keys.append(key)
+            by_key[key] = [operation]
+            continue
+        merged = _merge(pending[-1], operation)
+        if merged is None:
+            pending.append(operation)
+        else:
+            pending[-1] = merged
+
+    result = []
+    for key in keys:
+        result.extend(by_key[key])
+    return result
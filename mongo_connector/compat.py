@@ -11,3 +11,8 @@ else:
     exec("""def reraise(exctype, value, trace=None):
     raise exctype, str(value), trace
 """)
+
+if PY3:
+    string_types = (str,)
+else:
+    string_types = (basestring,)
@@ -26,9 +26,15 @@ import sys
 import threading
 import time
 import imp
+from bson import json_util
 from mongo_connector import constants, errors, util
 from mongo_connector.locking_dict import LockingDict
-from mongo_connector.oplog_manager import OplogThread
+from mongo_connector.metrics import registry
+from mongo_connector.namespaces import is_pattern
+from mongo_connector.export import Exporter
+from mongo_connector.journal import Journal
+from mongo_connector.oplog_manager import DUMP_CHUNK_SIZE, OplogThread
+from mongo_connector.throttle import Throttle
 from mongo_connector.doc_managers import doc_manager_simulator as simulator
 
 from pymongo import MongoClient
@@ -41,7 +47,30 @@ class Connector(threading.Thread):
                  u_key, auth_key, doc_manager=None, auth_username=None,
                  collection_dump=True, batch_size=constants.DEFAULT_BATCH_SIZE,
                  fields=None, dest_mapping={},
-                 auto_commit_interval=constants.DEFAULT_COMMIT_INTERVAL):
+                 auto_commit_interval=constants.DEFAULT_COMMIT_INTERVAL,
+                 apply_batch_size=constants.DEFAULT_APPLY_BATCH_SIZE,
+                 apply_batch_bytes=constants.DEFAULT_APPLY_BATCH_BYTES,
+                 apply_batch_wait=constants.DEFAULT_APPLY_BATCH_WAIT,
+                 apply_queue_size=constants.DEFAULT_APPLY_QUEUE_SIZE,
+                 apply_workers=constants.DEFAULT_APPLY_WORKERS,
+                 coalesce_window=constants.DEFAULT_COALESCE_WINDOW,
+                 max_await_time=constants.DEFAULT_MAX_AWAIT_TIME,
+                 ex_ns_set=None,
+                 dump_workers=constants.DEFAULT_DUMP_WORKERS,
+                 dump_split_size=constants.DEFAULT_DUMP_SPLIT_SIZE,
+                 concurrent_dump=False, dump_read_preference=None,
+                 dump_tag_sets=None,
+                 dump_batch_size=constants.DEFAULT_DUMP_BATCH_SIZE,
+                 dump_max_docs_per_sec=None, dump_max_mb_per_sec=None,
+                 tail_max_docs_per_sec=None, tail_max_mb_per_sec=None,
+                 export_dir=None,
+                 export_chunk_size=constants.DEFAULT_EXPORT_CHUNK_SIZE,
+                 rollback_workers=constants.DEFAULT_ROLLBACK_WORKERS,
+                 journal_path=None,
+                 journal_max_age=constants.DEFAULT_JOURNAL_MAX_AGE,
+                 journal_max_size=constants.DEFAULT_JOURNAL_MAX_SIZE,
+                 majority_tailing=False, tail_read_preference=None,
+                 tail_tag_sets=None):
 
         if target_url and not doc_manager:
             raise errors.ConnectorError("Cannot create a Connector with a "
@@ -94,8 +123,10 @@ class Connector(threading.Thread):
         else:
             self.target_urls = None
 
-        #The set of relevant namespaces to consider
+        #The set of relevant namespaces to consider, and the set of
+        #namespaces to leave out. Both may contain wildcards.
         self.ns_set = ns_set
+        self.ex_ns_set = ex_ns_set
 
         #The dict of source namespace to destination namespace
         self.dest_mapping = dest_mapping
@@ -117,18 +148,100 @@ class Connector(threading.Thread):
         # is present in the config file
         self.collection_dump = collection_dump
 
+        #Boolean chooses whether to tail the oplog while dumping collections
+        self.concurrent_dump = concurrent_dump
+
+        #Num threads dumping collections concurrently
+        self.dump_workers = dump_workers
+
+        #Num documents in each batch read from collections during dumps
+        self.dump_batch_size = dump_batch_size
+
+        #Directory that collections are exported to as bulk files, instead
+        #of being sent to the target systems, if any. The connector stops
+        #once they are exported.
+        self.export_dir = export_dir
+
+        #Num documents upserted at once during dumps. When exporting, each
+        #chunk makes one file.
+        if export_dir is not None:
+            self.dump_chunk_size = export_chunk_size
+        else:
+            self.dump_chunk_size = DUMP_CHUNK_SIZE
+
+        #Limits on the rate of documents dumped and of operations read from
+        #the oplog, shared by every OplogThread. Call set_rates on them to
+        #change the limits while running.
+        self.dump_throttle = Throttle('dump', dump_max_docs_per_sec,
+                                      dump_max_mb_per_sec)
+        self.tail_throttle = Throttle('tail', tail_max_docs_per_sec,
+                                      tail_max_mb_per_sec)
+
+        #Size in MB of the _id ranges large collections are dumped in
+        self.dump_split_size = dump_split_size
+
+        #Read preference mode name and tag sets for dump and rollback reads
+        self.dump_read_preference = dump_read_preference
+        self.dump_tag_sets = dump_tag_sets
+
         #Num entries to process before updating config file with current pos
         self.batch_size = batch_size
 
+        #Limits on the batches of oplog entries handed to the doc managers
+        self.apply_batch_size = apply_batch_size
+        self.apply_batch_bytes = apply_batch_bytes
+        self.apply_batch_wait = apply_batch_wait
+
+        #Num batches of oplog entries read ahead of the ones being applied
+        self.apply_queue_size = apply_queue_size
+
+        #Num threads applying oplog entries to each target concurrently
+        self.apply_workers = apply_workers
+
+        #Num threads reconciling documents with each target during
+        #rollbacks, either a number for every target or a list of numbers
+        #for each target in turn
+        self.rollback_workers = rollback_workers
+
+        #Local journal of the operations handed to the targets, which
+        #rollbacks look up instead of searching the targets, if any
+        self.journal = None
+        if journal_path is not None:
+            self.journal = Journal(journal_path, journal_max_age,
+                                   journal_max_size)
+
+        #Boolean chooses whether to hold back oplog entries until a majority
+        #of the replica set has them, so that no rollback is ever needed
+        self.majority_tailing = majority_tailing
+
+        #Read preference mode name and tag sets for tailing the oplog
+        self.tail_read_preference = tail_read_preference
+        self.tail_tag_sets = tail_tag_sets
+
+        #Num seconds to collect oplog entries before collapsing the
+        #operations on each document, if any
+        self.coalesce_window = coalesce_window
+
+        #Max num seconds to block waiting for new oplog entries
+        self.max_await_time = max_await_time
+
         #Dict of OplogThread/timestamp pairs to record progress
         self.oplog_progress = LockingDict()
 
+        #Dict of OplogThread/dump progress pairs, for dumps in progress
+        self.dump_progress = LockingDict()
+
         # List of fields to export
         self.fields = fields
 
         try:
+            # Doc managers can only make use of a list of namespaces
+            if ns_set and not any(is_pattern(ns) for ns in ns_set):
+                docman_ns_set = ns_set
+            else:
+                docman_ns_set = None
             docman_kwargs = {"unique_key": u_key,
-                             "namespace_set": ns_set,
+                             "namespace_set": docman_ns_set,
                              "auto_commit_interval": auto_commit_interval}
 
             # No doc managers specified, using simulator
@@ -163,6 +276,17 @@ class Connector(threading.Thread):
             self.can_run = False
             return
 
+        if export_dir is not None:
+            # Each target gets its own directory when there are several
+            if len(self.doc_managers) == 1:
+                export_dirs = [export_dir]
+            else:
+                export_dirs = [os.path.join(export_dir, str(i))
+                               for i in range(len(self.doc_managers))]
+            self.doc_managers = [
+                Exporter(dm, directory, export_chunk_size)
+                for dm, directory in zip(self.doc_managers, export_dirs)]
+
         if self.oplog_checkpoint is not None:
             if not os.path.exists(self.oplog_checkpoint):
                 info_str = ("MongoConnector: Can't find %s, "
@@ -203,26 +327,85 @@ class Connector(threading.Thread):
         backup_file = self.oplog_checkpoint + '.backup'
         os.rename(self.oplog_checkpoint, backup_file)
 
-        # for each of the threads write to file
-        with open(self.oplog_checkpoint, 'w') as dest:
-            with self.oplog_progress as oplog_prog:
+        # for each of the threads write to file, as a single list of
+        # oplog/timestamp pairs followed by oplog/dump progress pairs
+        data = []
+        with self.oplog_progress as oplog_prog:
+            oplog_dict = oplog_prog.get_dict()
+            for oplog, time_stamp in oplog_dict.items():
+                oplog_str = str(oplog)
+                timestamp = util.bson_ts_to_long(time_stamp)
+                data.extend([oplog_str, timestamp])
+        with self.dump_progress as dump_prog:
+            dump_dict = dump_prog.get_dict()
+            for oplog, progress in dump_dict.items():
+                # The progress holds _id values of any BSON type
+                data.extend([str(oplog), progress])
+            json_str = json.dumps(data, default=json_util.default)
 
-                oplog_dict = oplog_prog.get_dict()
-                for oplog, time_stamp in oplog_dict.items():
-                    oplog_str = str(oplog)
-                    timestamp = util.bson_ts_to_long(time_stamp)
-                    json_str = json.dumps([oplog_str, timestamp])
-                    try:
-                        dest.write(json_str)
-                    except IOError:
-                        # Basically wipe the file, copy from backup
-                        dest.truncate()
-                        with open(backup_file, 'r') as backup:
-                            shutil.copyfile(backup, dest)
-                        break
+        with open(self.oplog_checkpoint, 'w') as dest:
+            try:
+                dest.write(json_str)
+            except IOError:
+                # Basically wipe the file, copy from backup
+                dest.truncate()
+                with open(backup_file, 'r') as backup:
+                    shutil.copyfile(backup, dest)
 
         os.remove(self.oplog_checkpoint + '.backup')
 
+    def write_export_manifest(self):
+        """Record the timestamp of the oplog entry that each oplog should
+        be tailed from once the exported files are loaded, in export.json
+        in the export directory.
+        """
+        with self.oplog_progress as oplog_prog:
+            timestamps = dict(
+                (str(oplog), util.bson_ts_to_long(time_stamp))
+                for oplog, time_stamp in oplog_prog.get_dict().items())
+        path = os.path.join(self.export_dir, 'export.json')
+        with open(path, 'w') as manifest:
+            json.dump({'oplog_timestamps': timestamps}, manifest)
+        logging.info("MongoConnector: Exported collections to %s"
+                     % self.export_dir)
+
+    def target_progress(self):
+        """Return the progress of replication to each target system.
+
+        The result is a list with an entry for each doc manager, in the same
+        order as self.doc_managers. Each entry maps the oplogs being tailed
+        to the timestamp of the last entry applied to that target.
+        """
+        progress = [{} for _ in self.doc_managers]
+        for thread in list(self.shard_set.values()):
+            for i, ts in enumerate(thread.target_checkpoints()):
+                progress[i][str(thread.oplog)] = ts
+        return progress
+
+    def metrics(self):
+        """Return the counters and timing histograms recorded so far.
+
+        See mongo_connector.metrics.Registry.snapshot for the format.
+        Metrics include:
+
+          - oplog.operations: operations read, by (op type, namespace)
+          - oplog.batch_size: sizes of the batches handed to the targets
+          - oplog.backpressure: time spent waiting for a full target queue
+          - oplog.majority_wait: time spent waiting for a majority of the
+            replica set to replicate entries, with majority tailing
+          - docmanager.<method>: latency of each DocManager call, by module
+          - apply.retries, apply.failures: operations retried one at a time
+            after a failed bulk_apply, and operations that failed anyway
+          - dump.documents: documents dumped, by namespace
+          - rollback.*: documents removed, reinserted or failed during
+            rollbacks, by namespace, and the duration of each rollback
+          - throttle.waits, throttle.wait_time: how often and how long the
+            dump and tail throttles made readers wait
+          - export.files, export.documents: files and documents written
+            when exporting collections, by namespace
+        """
+        return registry.snapshot()
+
     def read_oplog_progress(self):
         """Reads oplog progress from file provided by user.
         This method is only called once before any threads are spanwed.
@@ -241,7 +424,7 @@ class Connector(threading.Thread):
 
         source = open(self.oplog_checkpoint, 'r')
         try:
-            data = json.load(source)
+            data = json.load(source, object_hook=json_util.object_hook)
         except ValueError:       # empty file
             reason = "It may be empty or corrupt."
             logging.info("MongoConnector: Can't read oplog progress file. %s" %
@@ -253,11 +436,16 @@ class Connector(threading.Thread):
 
         count = 0
         oplog_dict = self.oplog_progress.get_dict()
+        dump_dict = self.dump_progress.get_dict()
         for count in range(0, len(data), 2):
             oplog_str = data[count]
-            time_stamp = data[count + 1]
-            oplog_dict[oplog_str] = util.long_to_bson_ts(time_stamp)
-            #stored as bson_ts
+            value = data[count + 1]
+            if isinstance(value, dict):
+                #progress of an interrupted collection dump
+                dump_dict[oplog_str] = value
+            else:
+                oplog_dict[oplog_str] = util.long_to_bson_ts(value)
+                #stored as bson_ts
 
     def run(self):
         """Discovers the mongo cluster and creates a thread for each primary.
@@ -292,6 +480,11 @@ class Connector(threading.Thread):
 
             #non sharded configuration
             oplog_coll = main_conn['local']['oplog.rs']
+            tail_conn = None
+            if self.tail_read_preference is not None:
+                tail_conn = util.replica_set_client(
+                    self.address, is_master['setName'],
+                    self.tail_read_preference)
 
             oplog = OplogThread(
                 primary_conn=main_conn,
@@ -307,7 +500,32 @@ class Connector(threading.Thread):
                 collection_dump=self.collection_dump,
                 batch_size=self.batch_size,
                 fields=self.fields,
-                dest_mapping=self.dest_mapping
+                dest_mapping=self.dest_mapping,
+                apply_batch_size=self.apply_batch_size,
+                apply_batch_bytes=self.apply_batch_bytes,
+                apply_batch_wait=self.apply_batch_wait,
+                apply_queue_size=self.apply_queue_size,
+                apply_workers=self.apply_workers,
+                coalesce_window=self.coalesce_window,
+                max_await_time=self.max_await_time,
+                ex_namespace_set=self.ex_ns_set,
+                dump_workers=self.dump_workers,
+                dump_split_size=self.dump_split_size,
+                dump_progress_dict=self.dump_progress,
+                concurrent_dump=self.concurrent_dump,
+                dump_read_preference=self.dump_read_preference,
+                dump_tag_sets=self.dump_tag_sets,
+                dump_batch_size=self.dump_batch_size,
+                dump_throttle=self.dump_throttle,
+                tail_throttle=self.tail_throttle,
+                dump_chunk_size=self.dump_chunk_size,
+                dump_only=self.export_dir is not None,
+                rollback_workers=self.rollback_workers,
+                journal=self.journal,
+                majority_tailing=self.majority_tailing,
+                tail_read_preference=self.tail_read_preference,
+                tail_tag_sets=self.tail_tag_sets,
+                tail_conn=tail_conn
             )
             self.shard_set[0] = oplog
             logging.info('MongoConnector: Starting connection thread %s' %
@@ -316,6 +534,8 @@ class Connector(threading.Thread):
 
             while self.can_run:
                 if not self.shard_set[0].running:
+                    if self.shard_set[0].dump_finished:
+                        break
                     logging.error("MongoConnector: OplogThread"
                                   " %s unexpectedly stopped! Shutting down" %
                                   (str(self.shard_set[0])))
@@ -333,6 +553,8 @@ class Connector(threading.Thread):
                 for shard_doc in main_conn['config']['shards'].find():
                     shard_id = shard_doc['_id']
                     if shard_id in self.shard_set:
+                        if self.shard_set[shard_id].dump_finished:
+                            continue
                         if not self.shard_set[shard_id].running:
                             logging.error("MongoConnector: OplogThread "
                                           "%s unexpectedly stopped! Shutting "
@@ -358,6 +580,10 @@ class Connector(threading.Thread):
 
                     shard_conn = MongoClient(hosts, replicaSet=repl_set)
                     oplog_coll = shard_conn['local']['oplog.rs']
+                    tail_conn = None
+                    if self.tail_read_preference is not None:
+                        tail_conn = util.replica_set_client(
+                            hosts, repl_set, self.tail_read_preference)
 
                     oplog = OplogThread(
                         primary_conn=shard_conn,
@@ -372,15 +598,51 @@ class Connector(threading.Thread):
                         collection_dump=self.collection_dump,
                         batch_size=self.batch_size,
                         fields=self.fields,
-                        dest_mapping=self.dest_mapping
+                        dest_mapping=self.dest_mapping,
+                        apply_batch_size=self.apply_batch_size,
+                        apply_batch_bytes=self.apply_batch_bytes,
+                        apply_batch_wait=self.apply_batch_wait,
+                        apply_queue_size=self.apply_queue_size,
+                        apply_workers=self.apply_workers,
+                        coalesce_window=self.coalesce_window,
+                        max_await_time=self.max_await_time,
+                        ex_namespace_set=self.ex_ns_set,
+                        dump_workers=self.dump_workers,
+                        dump_split_size=self.dump_split_size,
+                        dump_progress_dict=self.dump_progress,
+                        concurrent_dump=self.concurrent_dump,
+                        dump_read_preference=self.dump_read_preference,
+                        dump_tag_sets=self.dump_tag_sets,
+                        dump_batch_size=self.dump_batch_size,
+                        dump_throttle=self.dump_throttle,
+                        tail_throttle=self.tail_throttle,
+                        dump_chunk_size=self.dump_chunk_size,
+                        dump_only=self.export_dir is not None,
+                        rollback_workers=self.rollback_workers,
+                        journal=self.journal,
+                        majority_tailing=self.majority_tailing,
+                        tail_read_preference=self.tail_read_preference,
+                        tail_tag_sets=self.tail_tag_sets,
+                        tail_conn=tail_conn
                     )
                     self.shard_set[shard_id] = oplog
                     msg = "Starting connection thread"
                     logging.info("MongoConnector: %s %s" % (msg, shard_conn))
                     oplog.start()
 
+                if self.shard_set and all(
+                        thread.dump_finished
+                        for thread in self.shard_set.values()):
+                    break
+
         self.oplog_thread_join()
         self.write_oplog_progress()
+        if self.journal is not None:
+            self.journal.close()
+        if self.export_dir is not None:
+            self.write_export_manifest()
+            for dm in self.doc_managers:
+                dm.stop()
 
     def oplog_thread_join(self):
         """Stops all the OplogThreads
@@ -432,6 +694,193 @@ def main():
                       "mongo_connector won't read the entire contents of a "
                       "namespace iff --oplog-ts points to an empty file.")
 
+    #--concurrent-dump specifies whether to tail the oplog while dumping
+    #collections, rather than after
+    parser.add_option("--concurrent-dump", action="store_true",
+                      default=False, help=
+                      "If specified, changes are read from the oplog while "
+                      "collections are dumped, instead of once the dump is "
+                      "over. Changes to a collection are held back, in "
+                      "memory or in a temporary file, until the collection "
+                      "is dumped, then applied. Changes to other "
+                      "collections are applied right away.")
+
+    #--majority-tailing specifies whether to apply oplog entries only once
+    #a majority of the replica set has them
+    parser.add_option("--majority-tailing", action="store_true",
+                      default=False, help=
+                      "If specified, oplog entries are only applied to the "
+                      "target systems once a majority of the replica set "
+                      "has replicated them, so that writes rolled back "
+                      "after a failover on MongoDB never reach the target "
+                      "systems and no rollback is needed. Changes reach the "
+                      "target systems later, by about the replication lag "
+                      "of the replica set.")
+
+    #--rollback-workers specifies how many threads reconcile documents with
+    #each target system during rollbacks
+    parser.add_option("--rollback-workers", action="store", type="string",
+                      default=str(constants.DEFAULT_ROLLBACK_WORKERS),
+                      help="Specify the number of threads reconciling "
+                      "documents with each target system during a rollback, "
+                      "after a failover on MongoDB. Every target system is "
+                      "reconciled at the same time. Give a comma-separated "
+                      "list to set a different number for each target "
+                      "system, in the order of --target-url; the last "
+                      "number applies to any further targets. The default "
+                      "is %d." % constants.DEFAULT_ROLLBACK_WORKERS)
+
+    #--rollback-journal specifies a file to record recent operations in, so
+    #that rollbacks don't have to search the target systems
+    parser.add_option("--rollback-journal", action="store", type="string",
+                      default=None, help=
+                      "If specified, the _id, namespace, timestamp and type "
+                      "of every operation read from the oplog are recorded "
+                      "in this local SQLite file before being applied. "
+                      "Rollbacks then look up the documents to fix in it, "
+                      "instead of searching every target system, as long as "
+                      "it goes back far enough. Otherwise they search the "
+                      "target systems as usual.")
+    parser.add_option("--rollback-journal-max-age", action="store",
+                      type="int", default=constants.DEFAULT_JOURNAL_MAX_AGE,
+                      help="Specify the number of seconds of oplog the "
+                      "rollback journal keeps. 0 keeps everything. The "
+                      "default is %d." % constants.DEFAULT_JOURNAL_MAX_AGE)
+    parser.add_option("--rollback-journal-max-size", action="store",
+                      type="int", default=constants.DEFAULT_JOURNAL_MAX_SIZE,
+                      help="Specify the maximum number of operations the "
+                      "rollback journal keeps for each oplog. 0 keeps "
+                      "everything. The default is %d."
+                      % constants.DEFAULT_JOURNAL_MAX_SIZE)
+
+    #--export-dir specifies a directory to export collections to as bulk
+    #files, rather than dumping them into the target systems
+    parser.add_option("--export-dir", action="store", type="string",
+                      default=None, help=
+                      "If specified, collections are written to gzipped "
+                      "files in this directory, in the bulk format of each "
+                      "target system, instead of being sent to the target "
+                      "systems: Elasticsearch _bulk requests, or Solr JSON "
+                      "updates. The documents are transformed as they would "
+                      "be when sent. The connector stops once the export is "
+                      "done, after recording the oplog timestamp the export "
+                      "was taken at in --oplog-ts and in export.json in the "
+                      "directory. Once the files are loaded, run the "
+                      "connector again with the same --oplog-ts to tail the "
+                      "oplog from there. The target systems must still be "
+                      "given with -t and -d. With several targets, each one "
+                      "gets a numbered subdirectory.")
+
+    #--export-chunk-size specifies the max num documents in exported files
+    parser.add_option("--export-chunk-size", action="store",
+                      default=constants.DEFAULT_EXPORT_CHUNK_SIZE,
+                      type="int", help=
+                      "Specify the maximum number of documents in each file "
+                      "written with --export-dir. The default is %d."
+                      % constants.DEFAULT_EXPORT_CHUNK_SIZE)
+
+    #--dump-workers specifies how many collections to dump concurrently
+    parser.add_option("--dump-workers", action="store",
+                      default=constants.DEFAULT_DUMP_WORKERS, type="int",
+                      help="Specify the number of threads dumping "
+                      "collections into the target systems concurrently. "
+                      "Each thread reads one collection, or one part of a "
+                      "large collection, at a time and hands it to every "
+                      "target system, starting with the largest "
+                      "collections. The default is %d."
+                      % constants.DEFAULT_DUMP_WORKERS)
+
+    #--dump-split-size specifies the size of the _id ranges collections are
+    #split into, so that several threads can dump the same collection
+    parser.add_option("--dump-split-size", action="store",
+                      default=constants.DEFAULT_DUMP_SPLIT_SIZE, type="int",
+                      help="Specify the size in megabytes of the _id ranges "
+                      "that collections larger than this are split into, "
+                      "so that several --dump-workers can dump them "
+                      "concurrently. 0 disables splitting. The default is "
+                      "%d." % constants.DEFAULT_DUMP_SPLIT_SIZE)
+
+    #--dump-batch-size specifies the batch size of the cursors reading
+    #collections during dumps
+    parser.add_option("--dump-batch-size", action="store", type="int",
+                      default=constants.DEFAULT_DUMP_BATCH_SIZE,
+                      help="Specify the number of documents in each batch "
+                      "read from a collection while dumping it. Larger "
+                      "batches mean fewer round trips to MongoDB. By "
+                      "default the server decides.")
+
+    #--dump-max-docs-per-sec and --dump-max-mb-per-sec limit the rate of
+    #collection dumps
+    parser.add_option("--dump-max-docs-per-sec", action="store",
+                      type="float", default=None,
+                      help="Specify the maximum number of documents dumped "
+                      "per second, across all collections, to limit the "
+                      "load on MongoDB and the target systems. There is no "
+                      "limit by default.")
+    parser.add_option("--dump-max-mb-per-sec", action="store",
+                      type="float", default=None,
+                      help="Specify the maximum number of megabytes of "
+                      "documents dumped per second, across all collections. "
+                      "There is no limit by default.")
+
+    #--tail-max-docs-per-sec and --tail-max-mb-per-sec limit the rate of
+    #operations read from the oplog
+    parser.add_option("--tail-max-docs-per-sec", action="store",
+                      type="float", default=None,
+                      help="Specify the maximum number of operations read "
+                      "from the oplog and applied per second. There is no "
+                      "limit by default.")
+    parser.add_option("--tail-max-mb-per-sec", action="store",
+                      type="float", default=None,
+                      help="Specify the maximum number of megabytes of "
+                      "operations read from the oplog and applied per "
+                      "second. There is no limit by default.")
+
+    #--dump-read-preference specifies where collections are read from
+    parser.add_option("--dump-read-preference", action="store",
+                      type="choice", default=None,
+                      choices=sorted(util.READ_PREFERENCE_MODES),
+                      help="Specify the read preference used to read "
+                      "collections while dumping them and during rollbacks, "
+                      "e.g. 'secondary' to keep these scans off the "
+                      "primary. One of %s. By default they are read from "
+                      "the primary, or through mongos, like the oplog. "
+                      "Hidden members can't be selected: tag a priority 0 "
+                      "member instead, and use --dump-tag-sets."
+                      % ", ".join(sorted(util.READ_PREFERENCE_MODES)))
+
+    #--dump-tag-sets specifies the tags of the members collections are read
+    #from
+    parser.add_option("--dump-tag-sets", action="store", type="string",
+                      default=None,
+                      help="Specify the tag sets used with "
+                      "--dump-read-preference, as a JSON list of "
+                      "documents, e.g. '[{\"use\": \"analytics\"}]'. Each "
+                      "tag set is tried in turn until a member matches.")
+
+    #--tail-read-preference specifies where the oplog is tailed from
+    parser.add_option("--tail-read-preference", action="store",
+                      type="choice", default=None,
+                      choices=sorted(util.READ_PREFERENCE_MODES),
+                      help="Specify the read preference used to tail the "
+                      "oplog, e.g. 'secondary' to keep the load of tailing "
+                      "off the primary. One of %s. By default the oplog is "
+                      "tailed from the primary of each replica set. If the "
+                      "member tailed fails, another matching member is "
+                      "selected when the cursor is reopened. Checkpoints and "
+                      "rollbacks still go by the oplog of the primary."
+                      % ", ".join(sorted(util.READ_PREFERENCE_MODES)))
+
+    #--tail-tag-sets specifies the tags of the members the oplog is tailed
+    #from
+    parser.add_option("--tail-tag-sets", action="store", type="string",
+                      default=None,
+                      help="Specify the tag sets used with "
+                      "--tail-read-preference, as a JSON list of "
+                      "documents, e.g. '[{\"use\": \"connector\"}, {}]'. "
+                      "Each tag set is tried in turn until a member "
+                      "matches. Tag a member to tail it in particular.")
+
     #--batch-size specifies num docs to read from oplog before updating the
     #--oplog-ts config file with current oplog position
     parser.add_option("--batch-size", action="store",
@@ -443,6 +892,84 @@ def main():
                       "You may want more frequent updates if you are at risk "
                       "of falling behind the earliest timestamp in the oplog")
 
+    #--apply-batch-size specifies the max num of oplog entries to send to
+    #the doc managers at once
+    parser.add_option("--apply-batch-size", action="store",
+                      default=constants.DEFAULT_APPLY_BATCH_SIZE, type="int",
+                      help="Specify the maximum number of oplog entries "
+                      "that are applied to the target systems together in "
+                      "one bulk request. The default is %d."
+                      % constants.DEFAULT_APPLY_BATCH_SIZE)
+
+    #--apply-batch-bytes specifies the max size of a batch of oplog entries
+    parser.add_option("--apply-batch-bytes", action="store",
+                      default=constants.DEFAULT_APPLY_BATCH_BYTES, type="int",
+                      help="Specify the maximum total size in bytes of the "
+                      "oplog entries that are applied to the target systems "
+                      "together in one bulk request. By default, batches "
+                      "are not limited by size.")
+
+    #--apply-batch-wait specifies how long an oplog entry may be held back
+    #waiting for a batch to fill up
+    parser.add_option("--apply-batch-wait", action="store",
+                      default=constants.DEFAULT_APPLY_BATCH_WAIT,
+                      type="float",
+                      help="Specify the maximum number of seconds an oplog "
+                      "entry may wait for more entries to be batched with "
+                      "it before being applied to the target systems. "
+                      "The default is %s." % constants.DEFAULT_APPLY_BATCH_WAIT)
+
+    #--apply-queue-size specifies how many batches of oplog entries may be
+    #read ahead of the ones being applied
+    parser.add_option("--apply-queue-size", action="store",
+                      default=constants.DEFAULT_APPLY_QUEUE_SIZE, type="int",
+                      help="Specify the maximum number of batches of oplog "
+                      "entries that may be read from MongoDB while earlier "
+                      "batches are still being applied to the target "
+                      "systems. The default is %d."
+                      % constants.DEFAULT_APPLY_QUEUE_SIZE)
+
+    #--apply-workers specifies how many threads apply oplog entries to
+    #each target system
+    parser.add_option("--apply-workers", action="store",
+                      default=constants.DEFAULT_APPLY_WORKERS, type="int",
+                      help="Specify the number of threads that apply oplog "
+                      "entries to each target system concurrently. Entries "
+                      "are partitioned between the threads by namespace "
+                      "and _id, so that the operations on any one document "
+                      "are still applied in order. The default is %d."
+                      % constants.DEFAULT_APPLY_WORKERS)
+
+    #--coalesce-window specifies how long to collect oplog entries before
+    #collapsing the operations on each document into their net effect
+    parser.add_option("--coalesce-window", action="store",
+                      default=constants.DEFAULT_COALESCE_WINDOW,
+                      type="float",
+                      help="Specify a number of seconds during which to "
+                      "collect oplog entries before applying them, merging "
+                      "the operations on each document into one. For "
+                      "example, an insert followed by updates becomes a "
+                      "single upsert, and successive $set updates are "
+                      "merged. Entries are still applied as soon as "
+                      "--apply-batch-size or --apply-batch-bytes is "
+                      "reached. The default is not to coalesce entries.")
+
+    #--max-await-time specifies how long to wait for new oplog entries
+    #before asking again
+    parser.add_option("--max-await-time", action="store",
+                      default=constants.DEFAULT_MAX_AWAIT_TIME,
+                      type="float",
+                      help="Specify the maximum number of seconds to wait "
+                      "for new oplog entries in a single request while "
+                      "tailing the oplog. New entries are returned as soon "
+                      "as they are written; this only bounds how long an "
+                      "idle request blocks, and how quickly mongo-connector "
+                      "notices it should stop. Bounding requests requires "
+                      "PyMongo 3.2 or later. This is also how often an "
+                      "empty oplog is checked for entries. The default is "
+                      "%s."
+                      % constants.DEFAULT_MAX_AWAIT_TIME)
+
     #-t is to specify the URL to the target system being used.
     parser.add_option("-t", "--target-url", "--target-urls", action="store",
                       type="string", dest="urls", default=None, help=
@@ -472,7 +999,21 @@ def main():
                       """The default is to consider all the namespaces, """
                       """excluding the system and config databases, and """
                       """also ignoring the "system.indexes" collection in """
-                      """any database.""")
+                      """any database. Namespaces may contain '*' """
+                      """wildcards, which match any sequence of """
+                      """characters: `-n tenant_*.events` considers the """
+                      """events collection of every tenant_ database, """
+                      """including the ones created later on.""")
+
+    #-x is to specify the namespaces we want to leave out
+    parser.add_option("-x", "--exclude-namespace-set", action="store",
+                      type="string", dest="ex_ns_set", default=None, help=
+                      """Used to specify the namespaces we want to leave """
+                      """out, as a comma-separated list that may contain """
+                      """'*' wildcards like --namespace-set. For example, """
+                      """`-n tenant_*.* -x tenant_*.tmp_*` considers every """
+                      """collection in the tenant_ databases, except the """
+                      """ones whose name starts with tmp_.""")
 
     #-u is to specify the mongoDB field that will serve as the unique key
     #for the target system,
@@ -643,10 +1184,19 @@ def main():
     else:
         ns_set = options.ns_set.split(',')
 
+    if options.ex_ns_set is None:
+        ex_ns_set = []
+    else:
+        ex_ns_set = options.ex_ns_set.split(',')
+
     if options.dest_ns_set is None:
         dest_ns_set = ns_set
     else:
         dest_ns_set = options.dest_ns_set.split(',')
+        if any(is_pattern(ns) for ns in ns_set + dest_ns_set):
+            logger.error("Destination namespaces can't be used with "
+                         "wildcard namespaces!")
+            sys.exit(1)
 
     if len(dest_ns_set) != len(ns_set):
         logger.error("Destination namespace must be the same length as the "
@@ -683,6 +1233,74 @@ def main():
     if options.commit_interval is not None and options.commit_interval < 0:
         raise ValueError("--auto-commit-interval must be non-negative")
 
+    if options.dump_workers < 1:
+        raise ValueError("--dump-workers must be positive")
+
+    if options.dump_split_size < 0:
+        raise ValueError("--dump-split-size must be non-negative")
+
+    if options.dump_batch_size is not None and options.dump_batch_size < 0:
+        raise ValueError("--dump-batch-size must be non-negative")
+
+    for option in ("dump_max_docs_per_sec", "dump_max_mb_per_sec",
+                   "tail_max_docs_per_sec", "tail_max_mb_per_sec"):
+        value = getattr(options, option)
+        if value is not None and value <= 0:
+            raise ValueError("--%s must be positive"
+                             % option.replace("_", "-"))
+
+    try:
+        rollback_workers = [int(n) for n in
+                            options.rollback_workers.split(",")]
+    except ValueError:
+        rollback_workers = [0]
+    if min(rollback_workers) < 1:
+        raise ValueError("--rollback-workers must be a positive number or "
+                         "a comma-separated list of them")
+
+    if (options.rollback_journal_max_age < 0 or
+            options.rollback_journal_max_size < 0):
+        raise ValueError("--rollback-journal-max-age and "
+                         "--rollback-journal-max-size must be non-negative")
+
+    if options.export_chunk_size < 1:
+        raise ValueError("--export-chunk-size must be positive")
+
+    if options.export_dir is not None and (options.no_dump or
+                                           options.concurrent_dump):
+        raise ValueError("--export-dir cannot be used with --no-dump or "
+                         "--concurrent-dump")
+
+    if options.apply_batch_size < 1:
+        raise ValueError("--apply-batch-size must be positive")
+
+    if options.apply_queue_size < 1:
+        raise ValueError("--apply-queue-size must be positive")
+
+    if options.apply_workers < 1:
+        raise ValueError("--apply-workers must be positive")
+
+    if options.coalesce_window is not None and options.coalesce_window < 0:
+        raise ValueError("--coalesce-window must be non-negative")
+
+    if options.max_await_time <= 0:
+        raise ValueError("--max-await-time must be positive")
+
+    tag_sets = {}
+    for reads in ("dump", "tail"):
+        option = getattr(options, reads + "_tag_sets")
+        if option is None:
+            tag_sets[reads] = None
+            continue
+        if getattr(options, reads + "_read_preference") in (None, "primary"):
+            raise ValueError("--%s-tag-sets requires a non-primary "
+                             "--%s-read-preference" % (reads, reads))
+        tag_sets[reads] = json.loads(option)
+        if (not isinstance(tag_sets[reads], list) or
+                not all(isinstance(tags, dict) for tags in tag_sets[reads])):
+            raise ValueError("--%s-tag-sets must be a JSON list of "
+                             "documents" % reads)
+
     connector = Connector(
         address=options.main_addr,
         oplog_checkpoint=options.oplog_config,
@@ -696,7 +1314,34 @@ def main():
         batch_size=options.batch_size,
         fields=fields,
         dest_mapping=dest_mapping,
-        auto_commit_interval=options.commit_interval
+        auto_commit_interval=options.commit_interval,
+        apply_batch_size=options.apply_batch_size,
+        apply_batch_bytes=options.apply_batch_bytes,
+        apply_batch_wait=options.apply_batch_wait,
+        apply_queue_size=options.apply_queue_size,
+        apply_workers=options.apply_workers,
+        coalesce_window=options.coalesce_window,
+        max_await_time=options.max_await_time,
+        ex_ns_set=ex_ns_set,
+        dump_workers=options.dump_workers,
+        dump_split_size=options.dump_split_size,
+        concurrent_dump=options.concurrent_dump,
+        dump_read_preference=options.dump_read_preference,
+        dump_tag_sets=tag_sets["dump"],
+        dump_batch_size=options.dump_batch_size,
+        dump_max_docs_per_sec=options.dump_max_docs_per_sec,
+        dump_max_mb_per_sec=options.dump_max_mb_per_sec,
+        tail_max_docs_per_sec=options.tail_max_docs_per_sec,
+        tail_max_mb_per_sec=options.tail_max_mb_per_sec,
+        export_dir=options.export_dir,
+        export_chunk_size=options.export_chunk_size,
+        rollback_workers=rollback_workers,
+        journal_path=options.rollback_journal,
+        journal_max_age=options.rollback_journal_max_age,
+        journal_max_size=options.rollback_journal_max_size,
+        majority_tailing=options.majority_tailing,
+        tail_read_preference=options.tail_read_preference,
+        tail_tag_sets=tag_sets["tail"]
     )
     connector.start()
 
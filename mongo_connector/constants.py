@@ -22,3 +22,58 @@ DEFAULT_COMMIT_INTERVAL = None
 # DocManager. This only affects DocManagers that cannot stream their
 # requests.
 DEFAULT_MAX_BULK = 500
+# Maximum # of oplog entries to hand to a DocManager in a single call to
+# bulk_apply while tailing the oplog
+DEFAULT_APPLY_BATCH_SIZE = 500
+# Maximum size in bytes of the oplog entries in a single bulk_apply batch
+# default = None (no maximum)
+DEFAULT_APPLY_BATCH_BYTES = None
+# Maximum number of seconds to hold an oplog entry in a batch before
+# handing the batch to the DocManagers
+DEFAULT_APPLY_BATCH_WAIT = 1.0
+# Maximum # of batches of oplog entries read ahead of the ones being
+# applied to the target systems
+DEFAULT_APPLY_QUEUE_SIZE = 8
+# Number of threads applying oplog entries to each target system
+# concurrently. Entries for the same document always go to the same thread.
+DEFAULT_APPLY_WORKERS = 1
+# Number of seconds to collect oplog entries before collapsing the
+# operations on each document into their net effect
+# default = None (don't coalesce)
+DEFAULT_COALESCE_WINDOW = None
+# Maximum number of seconds a getMore on the oplog blocks waiting for new
+# entries, where supported by the driver
+DEFAULT_MAX_AWAIT_TIME = 1.0
+# Initial and maximum number of seconds to wait before retrying after an
+# error while tailing the oplog. The wait doubles after every failure.
+DEFAULT_RETRY_BACKOFF = 0.1
+DEFAULT_RETRY_BACKOFF_MAX = 10.0
+# Number of threads dumping collections concurrently, each one reading a
+# single collection, or part of one, at a time
+DEFAULT_DUMP_WORKERS = 1
+# Size in megabytes of the _id ranges that collections are split into, so
+# that several threads can dump the same collection. Only used with more
+# than one dump worker.
+DEFAULT_DUMP_SPLIT_SIZE = 256
+# Num documents to ask for in each batch of the cursors reading collections
+# during a dump
+# default = None (let the server decide)
+DEFAULT_DUMP_BATCH_SIZE = None
+# Maximum # of documents read during a collection dump but not yet taken by
+# a target system, for each target when there are several
+DEFAULT_DUMP_BUFFER_SIZE = 10000
+# Maximum # of operations held back in memory for each collection while it
+# is dumped concurrently with tailing the oplog, beyond which they are
+# spilled to a temporary file
+DEFAULT_SPILL_THRESHOLD = 100000
+# Maximum # of documents written to each file when exporting collections
+# to bulk files
+DEFAULT_EXPORT_CHUNK_SIZE = 10000
+# Number of threads reconciling documents with each target system during a
+# rollback, each one handling a chunk of documents from one namespace at a
+# time
+DEFAULT_ROLLBACK_WORKERS = 1
+# Number of seconds of oplog time, and number of operations, that the
+# rollback journal keeps for each oplog
+DEFAULT_JOURNAL_MAX_AGE = 24 * 60 * 60
+DEFAULT_JOURNAL_MAX_SIZE = 10000000
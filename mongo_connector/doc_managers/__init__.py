@@ -35,6 +35,9 @@ def exception_wrapper(mapping):
 class DocManagerBase(object):
     """Base class for all DocManager implementations."""
 
+    # File extension of the bulk files made by bulk_export, if supported
+    export_format = None
+
     def apply_update(self, doc, update_spec):
         """Apply an update operation to a document."""
 
@@ -108,6 +111,34 @@ class DocManagerBase(object):
         for doc in docs:
             self.upsert(doc)
 
+    def bulk_apply(self, operations):
+        """Apply a sequence of oplog operations, in order.
+
+        Each operation is an ``(op, doc, update_spec)`` tuple. ``op`` is
+        ``'i'`` to upsert ``doc``, ``'u'`` to apply ``update_spec`` to the
+        document whose ``_id`` matches that of ``doc``, or ``'d'`` to remove
+        ``doc``. ``doc`` always carries the ``_id``, ``ns`` and ``_ts``
+        fields, and ``update_spec`` is ``None`` unless ``op`` is ``'u'``.
+
+        This method may be overridden to apply many operations at once.
+        """
+        for op, doc, update_spec in operations:
+            if op == 'i':
+                self.upsert(doc)
+            elif op == 'u':
+                self.update(doc, update_spec)
+            elif op == 'd':
+                self.remove(doc)
+
+    def bulk_export(self, docs):
+        """Return a set of documents formatted as a bulk file that the
+        target system's own tools can load, transformed as they would be by
+        upsert.
+
+        Doc managers supporting this also set export_format.
+        """
+        raise NotImplementedError
+
     def update(self, doc, update_spec):
         raise NotImplementedError
 
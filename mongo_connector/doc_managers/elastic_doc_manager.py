@@ -52,6 +52,8 @@ class DocManager(DocManagerBase):
         them as fields in the document, due to compatibility issues.
         """
 
+    export_format = 'ndjson'
+
     def __init__(self, url, auto_commit_interval=DEFAULT_COMMIT_INTERVAL,
                  unique_key='_id', chunk_size=DEFAULT_MAX_BULK, **kwargs):
         """ Establish a connection to Elastic
@@ -141,6 +143,77 @@ class DocManager(DocManagerBase):
             # config file, but nothing to dump
             pass
 
+    def bulk_export(self, docs):
+        """Format documents as the body of a _bulk request, which indexes
+        each one like bulk_upsert does.
+        """
+        lines = []
+        for doc in docs:
+            doc[self.unique_key] = str(doc[self.unique_key])
+            action = {"index": {"_index": doc["ns"],
+                                "_type": self.doc_type,
+                                "_id": doc[self.unique_key]}}
+            lines.append(bsjson.dumps(action))
+            lines.append(bsjson.dumps(doc))
+        # The _bulk API requires a final newline
+        return "".join(line + "\n" for line in lines)
+
+    @wrap_exceptions
+    def bulk_apply(self, operations):
+        """Apply a sequence of oplog operations to Elastic
+
+        The operations are folded into the final state of every document
+        they touch, which is then sent as index and delete actions through
+        the bulk API.
+        """
+        # (index, id) -> document source, or None if the document was removed
+        pending = {}
+        for op, doc, update_spec in operations:
+            key = (doc['ns'], str(doc['_id']))
+            if op == 'i':
+                doc[self.unique_key] = str(doc["_id"])
+                pending[key] = doc
+            elif op == 'u':
+                if key in pending:
+                    current = pending[key]
+                    if current is None:
+                        # Removed earlier in this batch
+                        continue
+                else:
+                    current = self.elastic.get(index=key[0],
+                                               id=key[1])['_source']
+                updated = self.apply_update(current, update_spec)
+                updated[self.unique_key] = key[1]
+                pending[key] = updated
+            elif op == 'd':
+                pending[key] = None
+
+        def actions():
+            for (index, doc_id), source in pending.items():
+                action = {"_index": index,
+                          "_type": self.doc_type,
+                          "_id": doc_id}
+                if source is None:
+                    action["_op_type"] = "delete"
+                else:
+                    action["_source"] = source
+                yield action
+
+        kw = {}
+        if self.chunk_size > 0:
+            kw['chunk_size'] = self.chunk_size
+        responses = streaming_bulk(client=self.elastic,
+                                   actions=actions(),
+                                   raise_on_error=False,
+                                   **kw)
+        for ok, resp in responses:
+            if not ok:
+                logging.error(
+                    "Could not apply bulk operation "
+                    "in ElasticSearch: %r" % resp)
+        if self.auto_commit_interval == 0:
+            self.commit()
+
     @wrap_exceptions
     def remove(self, doc):
         """Removes documents from Elastic
@@ -24,7 +24,7 @@
 import logging
 import pymongo
 
-from mongo_connector import errors
+from mongo_connector import errors, util
 from mongo_connector.doc_managers import DocManagerBase, exception_wrapper
 
 
@@ -117,6 +117,101 @@ class DocManager(DocManagerBase):
         })
         self.mongo[database][coll].save(doc)
 
+    @wrap_exceptions
+    def bulk_upsert_raw(self, docs, namespace, timestamp):
+        """Update or insert documents dumped from a single namespace, as of
+        the oplog entry with the given timestamp.
+
+        The documents may be raw BSON, which is written to Mongo as is, and
+        are not modified.
+        """
+        docs = list(docs)
+        if not hasattr(pymongo, "ReplaceOne"):
+            # bulk_write requires PyMongo 3+
+            for doc in docs:
+                doc = dict(util.decode_raw(doc))
+                doc["ns"] = namespace
+                doc["_ts"] = timestamp
+                self.upsert(doc)
+            return
+        if not docs:
+            return
+
+        database, coll = namespace.split('.', 1)
+        meta = [pymongo.ReplaceOne(
+            {self.unique_key: doc[self.unique_key]},
+            {self.unique_key: doc[self.unique_key],
+             "_ts": timestamp,
+             "ns": namespace},
+            upsert=True) for doc in docs]
+        requests = [pymongo.ReplaceOne({"_id": doc["_id"]}, doc, upsert=True)
+                    for doc in docs]
+        try:
+            self.mongo["__mongo_connector"][namespace].bulk_write(
+                meta, ordered=False)
+            self.mongo[database][coll].bulk_write(requests, ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            raise errors.OperationFailed(
+                "Bulk write failed in MongoDB: %r" % e.details)
+
+    @wrap_exceptions
+    def bulk_apply(self, operations):
+        """Apply a sequence of oplog operations to Mongo
+
+        Operations are grouped into one ordered bulk write per target
+        collection, plus one per namespace for the timestamp metadata kept
+        in the __mongo_connector database. Operations on the same document
+        always land in the same bulk write, so their order is preserved.
+        """
+        if not hasattr(pymongo.collection.Collection,
+                       "initialize_ordered_bulk_op"):
+            # Bulk write API requires PyMongo 2.7+
+            return super(DocManager, self).bulk_apply(operations)
+
+        bulks = {}
+
+        def bulk_for(database, coll):
+            if (database, coll) not in bulks:
+                bulks[(database, coll)] = \
+                    self.mongo[database][coll].initialize_ordered_bulk_op()
+            return bulks[(database, coll)]
+
+        for op, doc, update_spec in operations:
+            database, coll = doc['ns'].split('.', 1)
+            if op == 'i':
+                # Other doc managers may be sharing this document
+                doc = dict(doc)
+                ts = doc.pop("_ts")
+                ns = doc.pop("ns")
+                bulk_for("__mongo_connector", ns).find(
+                    {self.unique_key: doc[self.unique_key]}
+                ).upsert().replace_one({
+                    self.unique_key: doc[self.unique_key],
+                    "_ts": ts,
+                    "ns": ns
+                })
+                bulk_for(database, coll).find(
+                    {"_id": doc["_id"]}).upsert().replace_one(doc)
+            elif op == 'u':
+                selector = bulk_for(database, coll).find(
+                    {self.unique_key: doc['_id']})
+                if any(key.startswith('$') for key in update_spec):
+                    selector.update_one(update_spec)
+                else:
+                    selector.replace_one(update_spec)
+            elif op == 'd':
+                bulk_for(database, coll).find(
+                    {self.unique_key: doc[self.unique_key]}).remove_one()
+                bulk_for("__mongo_connector", doc['ns']).find(
+                    {self.unique_key: doc[self.unique_key]}).remove_one()
+
+        try:
+            for bulk in bulks.values():
+                bulk.execute()
+        except pymongo.errors.BulkWriteError as e:
+            raise errors.OperationFailed(
+                "Bulk write failed in MongoDB: %r" % e.details)
+
     @wrap_exceptions
     def remove(self, doc):
         """Removes document from Mongo
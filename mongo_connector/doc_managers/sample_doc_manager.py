@@ -33,6 +33,29 @@ class DocManager():
     The reason for storing id/doc pairs as opposed to doc's is so that
     multiple updates to the same doc reflect the most up to date version as
     opposed to multiple, slightly different versions of a doc.
+
+    Some methods are optional. They are left out of this template, since
+    the connector uses them whenever a doc manager has them:
+
+    bulk_apply(operations) applies a sequence of oplog operations to
+    engine, in order. Each operation is an (op, doc, update_spec) tuple,
+    where op is 'i' for an upsert of doc, 'u' for an update of the document
+    whose _id matches that of doc using update_spec, or 'd' for a removal
+    of doc. Without it, the operations are passed one by one to upsert,
+    update and remove. Implement it when the engine offers a way to send
+    many writes in a single request, since it is called with every batch of
+    entries read from the oplog. It should raise OperationFailed or
+    ConnectionFailed if the batch can't be applied, so that the operations
+    are retried one at a time.
+
+    bulk_upsert_raw(docs, namespace, timestamp) updates or inserts
+    documents dumped from a collection into engine. The documents all come
+    from the namespace given, as of the oplog entry with the given
+    timestamp, and have no ns or _ts fields. They may be raw BSON documents
+    (bson.raw_bson.RawBSONDocument), which must not be modified. Without
+    it, the documents are decoded, given their ns and _ts fields, and
+    passed to bulk_upsert or upsert. Implement it when the engine can store
+    BSON as is, to save decoding every document.
     """
 
     def __init__(self, url=None, auto_commit_interval=DEFAULT_COMMIT_INTERVAL,
@@ -20,6 +20,7 @@ is that this file can be used as an example to add on different backends.
 To extend this to other systems, simply implement the exact same class and
 replace the method definitions with API calls for the desired backend.
 """
+import datetime
 import re
 import json
 
@@ -42,6 +43,14 @@ ADMIN_URL = 'admin/luke?show=schema&wt=json'
 decoder = json.JSONDecoder()
 
 
+def _export_value(value):
+    """Convert values json can't encode the way pysolr does in updates.
+    """
+    if isinstance(value, datetime.datetime):
+        return "%sZ" % value.isoformat()
+    return str(value)
+
+
 class DocManager(DocManagerBase):
     """The DocManager class creates a connection to the backend engine and
     adds/removes documents, and in the case of rollback, searches for them.
@@ -51,6 +60,8 @@ class DocManager(DocManagerBase):
     multiple, slightly different versions of a doc.
     """
 
+    export_format = 'json'
+
     def __init__(self, url, auto_commit_interval=DEFAULT_COMMIT_INTERVAL,
                  unique_key='_id', chunk_size=DEFAULT_MAX_BULK, **kwargs):
         """Verify Solr URL and establish a connection.
@@ -244,6 +255,68 @@ class DocManager(DocManagerBase):
         else:
             self.solr.add(cleaned, **add_kwargs)
 
+    def bulk_export(self, docs):
+        """Format documents as a JSON update adding each one, cleaned like
+        bulk_upsert does.
+        """
+        return json.dumps([self._clean_doc(d) for d in docs],
+                          default=_export_value)
+
+    @wrap_exceptions
+    def bulk_apply(self, operations):
+        """Apply a sequence of oplog operations to Solr.
+
+        The operations are folded into the final state of every document
+        they touch, so that all upserts and updates reach Solr through as few
+        add requests as chunk_size permits, followed by one delete per
+        removed document.
+        """
+        # id -> cleaned document, or None if the document was removed
+        pending = {}
+        for op, doc, update_spec in operations:
+            doc_id = str(doc['_id'])
+            if op == 'i':
+                pending[doc_id] = self._clean_doc(doc)
+            elif op == 'u':
+                if doc_id in pending:
+                    current = pending[doc_id]
+                    if current is None:
+                        # Removed earlier in this batch
+                        continue
+                else:
+                    query = "%s:%s" % (self.unique_key, doc_id)
+                    results = self.solr.search(query)
+                    if not len(results):
+                        # Document may not be retrievable yet
+                        self.commit()
+                        results = self.solr.search(query)
+                    if not len(results):
+                        continue
+                    current = results.docs[0]
+                updated = self.apply_update(current, update_spec)
+                # A _version_ of 0 will always apply the update
+                updated['_version_'] = 0
+                pending[doc_id] = self._clean_doc(updated)
+            elif op == 'd':
+                pending[doc_id] = None
+
+        if self.auto_commit_interval is not None:
+            add_kwargs = {
+                "commit": (self.auto_commit_interval == 0),
+                "commitWithin": str(self.auto_commit_interval)
+            }
+        else:
+            add_kwargs = {"commit": False}
+
+        to_add = [d for d in pending.values() if d is not None]
+        step = self.chunk_size if self.chunk_size > 0 else max(len(to_add), 1)
+        for i in range(0, len(to_add), step):
+            self.solr.add(to_add[i:i + step], **add_kwargs)
+        for doc_id, doc in pending.items():
+            if doc is None:
+                self.solr.delete(id=doc_id,
+                                 commit=(self.auto_commit_interval == 0))
+
     @wrap_exceptions
     def remove(self, doc):
         """Removes documents from Solr
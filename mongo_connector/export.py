@@ -0,0 +1,111 @@
+# Copyright 2013-2014 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Writes dumped documents to compressed bulk files instead of a target
+"""
+
+import gzip
+import itertools
+import os
+import threading
+
+from mongo_connector import errors
+from mongo_connector.constants import DEFAULT_EXPORT_CHUNK_SIZE
+from mongo_connector.doc_managers import DocManagerBase
+from mongo_connector.metrics import registry
+
+
+class Exporter(DocManagerBase):
+    """Stands in for the doc manager of a target system during a collection
+    dump, writing the documents upserted into it to files in directory,
+    in the format of the target's own bulk import tools, rather than
+    sending them.
+
+    Each batch of documents is formatted by the bulk_export method of the
+    doc manager, so the files hold the same documents upsert would send,
+    and written to files of at most chunk_size documents named
+    '<namespace>.<sequence>.<format>.gz'. Files are renamed into place
+    once complete, and sequence numbers continue after those of the files
+    already in the directory, so that a resumed dump adds to them.
+    """
+
+    def __init__(self, doc_manager, directory,
+                 chunk_size=DEFAULT_EXPORT_CHUNK_SIZE):
+        self.export_format = getattr(doc_manager, "export_format", None)
+        if self.export_format is None:
+            raise errors.ConnectorError(
+                "%s cannot export bulk files"
+                % doc_manager.__class__.__module__)
+        self.doc_manager = doc_manager
+        self.directory = directory
+        self.chunk_size = chunk_size
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._sequence = itertools.count(self._last_sequence() + 1)
+        self._lock = threading.Lock()
+
+    def _last_sequence(self):
+        """Return the highest sequence number of the files in the directory,
+        or 0 if there are none.
+        """
+        last = 0
+        suffix = ".%s.gz" % self.export_format
+        for name in os.listdir(self.directory):
+            if not name.endswith(suffix):
+                continue
+            sequence = name[:-len(suffix)].rsplit(".", 1)[-1]
+            if sequence.isdigit():
+                last = max(last, int(sequence))
+        return last
+
+    def upsert(self, doc):
+        """Write a single document to its own file.
+        """
+        self.bulk_upsert([doc])
+
+    def bulk_upsert(self, docs):
+        """Write documents, all from the same namespace, to as many files as
+        needed.
+        """
+        docs = list(docs)
+        for start in range(0, len(docs), self.chunk_size):
+            self._write(docs[start:start + self.chunk_size])
+
+    def _write(self, docs):
+        namespace = docs[0]["ns"]
+        body = self.doc_manager.bulk_export(docs)
+        with self._lock:
+            sequence = next(self._sequence)
+        path = os.path.join(self.directory, "%s.%06d.%s.gz"
+                            % (namespace, sequence, self.export_format))
+        with gzip.open(path + ".tmp", "wb") as out:
+            out.write(body.encode("utf-8"))
+        os.rename(path + ".tmp", path)
+        registry.incr('export.files', namespace)
+        registry.incr('export.documents', namespace, len(docs))
+
+    def commit(self):
+        """Files are complete once written, so there is nothing to commit.
+        """
+        pass
+
+    def get_last_doc(self):
+        """Nothing is ever read back from the files.
+        """
+        return None
+
+    def stop(self):
+        """Stop the doc manager of the target.
+        """
+        self.doc_manager.stop()
@@ -0,0 +1,199 @@
+# Copyright 2013-2014 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Keeps a local record of the operations handed to the target systems
+"""
+
+import sqlite3
+import threading
+
+import bson
+
+from mongo_connector.constants import (DEFAULT_JOURNAL_MAX_AGE,
+                                       DEFAULT_JOURNAL_MAX_SIZE)
+
+# Num calls to record between two trims of the journal of an oplog
+TRIM_INTERVAL = 100
+
+# Num records read at once when searching the journal
+SEARCH_BATCH_SIZE = 1000
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS records "
+    "(oplog TEXT, ts INTEGER, ns TEXT, doc_id BLOB, op TEXT)",
+    "CREATE INDEX IF NOT EXISTS records_ts ON records (oplog, ts)",
+    "CREATE TABLE IF NOT EXISTS coverage "
+    "(oplog TEXT PRIMARY KEY, since INTEGER, until INTEGER)"
+]
+
+
+def _encode_id(doc_id):
+    return sqlite3.Binary(bson.BSON.encode({"_id": doc_id}))
+
+
+def _decode_id(blob):
+    return bson.BSON(bytes(blob)).decode()["_id"]
+
+
+class Journal(object):
+    """An SQLite database of the (ts, ns, _id, op) of every operation read
+    from each oplog and handed to the target systems, so that rollbacks can
+    find the documents to reconcile without searching the targets.
+
+    Operations are recorded before any target applies them, so the journal
+    holds at least every document the targets may have written. For each
+    oplog, it also records the timestamp it is complete since, and that of
+    the last batch recorded. Records older than max_age seconds of oplog
+    time, or beyond the max_size most recent ones, are trimmed, which moves
+    the timestamp the journal is complete since.
+
+    Timestamps are BSON timestamps converted to longs.
+    """
+
+    def __init__(self, path, max_age=DEFAULT_JOURNAL_MAX_AGE,
+                 max_size=DEFAULT_JOURNAL_MAX_SIZE):
+        self.path = path
+        self.max_age = max_age
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # Searches read through their own connection while we write
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            for statement in SCHEMA:
+                self._conn.execute(statement)
+        # Num calls to record since the last trim, by oplog
+        self._untrimmed = {}
+
+    def start(self, oplog, ts):
+        """Note that operations are about to be recorded from the entry
+        after ts. The journal is complete since ts, unless it is already
+        complete since an earlier timestamp and recorded every operation up
+        to ts.
+
+        Returns True in the latter case. Otherwise the journal starts over,
+        and returns False: the targets may then have applied operations
+        after ts that it never recorded, so the last timestamp it recorded
+        isn't the last one the targets may have seen.
+        """
+        with self._lock:
+            with self._conn:
+                row = self._conn.execute(
+                    "SELECT until FROM coverage WHERE oplog = ?",
+                    (oplog,)).fetchone()
+                if row is None:
+                    self._conn.execute(
+                        "INSERT INTO coverage VALUES (?, ?, ?)",
+                        (oplog, ts, ts))
+                    return False
+                if row[0] < ts:
+                    # Operations may have been applied without us since
+                    self._conn.execute(
+                        "UPDATE coverage SET since = ?, until = ? "
+                        "WHERE oplog = ?", (ts, ts, oplog))
+                    return False
+                return True
+
+    def record(self, oplog, ts, operations):
+        """Record a batch of (op, doc, update_spec) operations, read up to
+        the oplog entry with timestamp ts.
+        """
+        rows = [(oplog, doc["_ts"], doc["ns"], _encode_id(doc["_id"]), op)
+                for op, doc, _ in operations]
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO records VALUES (?, ?, ?, ?, ?)", rows)
+                self._conn.execute(
+                    "UPDATE coverage SET until = ? WHERE oplog = ?",
+                    (ts, oplog))
+            untrimmed = self._untrimmed.get(oplog, 0) + 1
+            self._untrimmed[oplog] = untrimmed
+            if untrimmed >= TRIM_INTERVAL:
+                self._trim(oplog)
+                self._untrimmed[oplog] = 0
+
+    def _trim(self, oplog):
+        """Drop the records of an oplog beyond max_age or max_size.
+        """
+        bounds = []
+        until = self.last_ts(oplog, lock=False)
+        if self.max_age and until is not None:
+            bounds.append(max(0, (until >> 32) - self.max_age) << 32)
+        if self.max_size:
+            row = self._conn.execute(
+                "SELECT ts FROM records WHERE oplog = ? "
+                "ORDER BY ts DESC LIMIT 1 OFFSET ?",
+                (oplog, self.max_size)).fetchone()
+            if row is not None:
+                bounds.append(row[0] + 1)
+        if not bounds:
+            return
+        bound = max(bounds)
+        with self._conn:
+            self._conn.execute(
+                "DELETE FROM records WHERE oplog = ? AND ts < ?",
+                (oplog, bound))
+            self._conn.execute(
+                "UPDATE coverage SET since = ? "
+                "WHERE oplog = ? AND since < ?", (bound, oplog, bound))
+
+    def last_ts(self, oplog, lock=True):
+        """Return the timestamp of the last batch recorded from an oplog, or
+        None if there is none.
+        """
+        if lock:
+            with self._lock:
+                return self.last_ts(oplog, lock=False)
+        row = self._conn.execute(
+            "SELECT until FROM coverage WHERE oplog = ?",
+            (oplog,)).fetchone()
+        return None if row is None else row[0]
+
+    def covers(self, oplog, ts):
+        """Return True if every operation after the oplog entry with
+        timestamp ts is recorded.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT since FROM coverage WHERE oplog = ?",
+                (oplog,)).fetchone()
+        return row is not None and row[0] <= ts
+
+    def search(self, oplog, start_ts, end_ts):
+        """Yield a document with the '_id', 'ns' and '_ts' fields for every
+        document touched by an operation from an oplog with a timestamp
+        between start_ts and end_ts, like DocManager.search does. '_ts' is
+        the timestamp of the last operation on the document.
+        """
+        conn = sqlite3.connect(self.path)
+        try:
+            cursor = conn.execute(
+                "SELECT ns, doc_id, max(ts) FROM records "
+                "WHERE oplog = ? AND ts >= ? AND ts <= ? "
+                "GROUP BY ns, doc_id", (oplog, start_ts, end_ts))
+            while True:
+                rows = cursor.fetchmany(SEARCH_BATCH_SIZE)
+                if not rows:
+                    return
+                for ns, doc_id, ts in rows:
+                    yield {"_id": _decode_id(doc_id), "ns": ns, "_ts": ts}
+        finally:
+            conn.close()
+
+    def close(self):
+        """Close the database.
+        """
+        with self._lock:
+            self._conn.close()
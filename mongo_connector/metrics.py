@@ -0,0 +1,148 @@
+# Copyright 2013-2014 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process counters and timing histograms
+"""
+
+import bisect
+import threading
+import time
+
+# Upper bounds, in seconds, of the buckets of timing histograms. The last
+# bucket counts everything slower than the largest bound.
+TIMING_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                  1, 2.5, 5, 10)
+
+# Upper bounds of the buckets of size histograms
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000,
+                10000)
+
+
+class Histogram(object):
+    """Counts observed values into fixed buckets.
+    """
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def snapshot(self):
+        """Return the state of the histogram as a dictionary.
+
+        'buckets' lists (upper bound, count) pairs, where the upper bound of
+        the last bucket is None.
+        """
+        bounds = list(self.bounds) + [None]
+        return {'count': self.count,
+                'sum': self.total,
+                'buckets': list(zip(bounds, self.buckets))}
+
+
+class _Timer(object):
+    """Context manager recording the time spent in its block.
+    """
+
+    def __init__(self, registry, name, key):
+        self.registry = registry
+        self.name = name
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.registry.observe(self.name, time.time() - self.start,
+                              key=self.key, bounds=TIMING_BUCKETS)
+
+
+class Registry(object):
+    """A set of named counters and histograms.
+
+    Each metric is keyed by a name and an optional key, e.g. the operation
+    type and namespace of the oplog entries counted. Recording a value only
+    takes a lock and updates a dictionary, and nothing is formatted or
+    reported until snapshot() is called.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def incr(self, name, key=None, amount=1):
+        """Add amount to a counter.
+        """
+        with self._lock:
+            counter = self._counters.setdefault(name, {})
+            counter[key] = counter.get(key, 0) + amount
+
+    def incr_all(self, name, amounts):
+        """Add to several counters sharing a name at once, given a
+        dictionary of key: amount.
+        """
+        with self._lock:
+            counter = self._counters.setdefault(name, {})
+            for key, amount in amounts.items():
+                counter[key] = counter.get(key, 0) + amount
+
+    def observe(self, name, value, key=None, bounds=SIZE_BUCKETS):
+        """Record a value in a histogram. bounds are only used when the
+        histogram is first created.
+        """
+        with self._lock:
+            histograms = self._histograms.setdefault(name, {})
+            histogram = histograms.get(key)
+            if histogram is None:
+                histogram = histograms[key] = Histogram(bounds)
+            histogram.observe(value)
+
+    def timer(self, name, key=None):
+        """Return a context manager recording the time spent in its block
+        in a timing histogram.
+        """
+        return _Timer(self, name, key)
+
+    def snapshot(self):
+        """Return a copy of every metric, as a dictionary:
+
+            {'counters': {name: {key: value}},
+             'histograms': {name: {key: histogram snapshot}}}
+        """
+        with self._lock:
+            counters = dict((name, dict(counter))
+                            for name, counter in self._counters.items())
+            histograms = dict(
+                (name, dict((key, histogram.snapshot())
+                            for key, histogram in by_key.items()))
+                for name, by_key in self._histograms.items())
+        return {'counters': counters, 'histograms': histograms}
+
+    def reset(self):
+        """Discard every metric recorded so far.
+        """
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+
+
+# The registry shared by the whole process
+registry = Registry()
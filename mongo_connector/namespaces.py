@@ -0,0 +1,104 @@
+# Copyright 2013-2014 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Selects namespaces by name or wildcard pattern
+"""
+
+import re
+
+
+def is_pattern(namespace):
+    """Return True if namespace is a wildcard pattern rather than a name.
+    """
+    return '*' in namespace
+
+
+def _to_regex(pattern):
+    """Translate a wildcard pattern into a regular expression source, where
+    '*' matches any sequence of characters.
+    """
+    return '.*'.join(re.escape(part) for part in pattern.split('*'))
+
+
+def _compile(patterns):
+    """Compile a list of names and patterns into a single regular expression
+    matching any of them, or None if the list is empty.
+    """
+    if not patterns:
+        return None
+    return re.compile('^(?:%s)$' % '|'.join(_to_regex(p) for p in patterns))
+
+
+class NamespaceFilter(object):
+    """Selects the namespaces matching any of the include patterns, or every
+    namespace if there are none, except those matching an exclude pattern.
+
+    Patterns are either plain namespaces like 'test.test', or contain '*'
+    wildcards matching any sequence of characters, like 'tenant_*.events'.
+    Each list is compiled once into a regular expression, which is used to
+    match namespaces locally and sent as is to MongoDB to filter the oplog.
+    """
+
+    def __init__(self, include=None, exclude=None):
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+        self._include_regex = _compile(self.include)
+        self._exclude_regex = _compile(self.exclude)
+
+    def __bool__(self):
+        """True if this filter selects only some namespaces.
+        """
+        return bool(self.include or self.exclude)
+
+    __nonzero__ = __bool__
+
+    @property
+    def names(self):
+        """The list of namespaces selected, or None if they can't be known
+        without listing every namespace, because of wildcards or because
+        there is no include list.
+        """
+        if not self.include or any(is_pattern(ns) for ns in self.include):
+            return None
+        return [ns for ns in self.include if self.matches(ns)]
+
+    def matches(self, namespace):
+        """Return True if the namespace is selected.
+        """
+        if (self._include_regex is not None and
+                not self._include_regex.match(namespace)):
+            return False
+        return not (self._exclude_regex is not None and
+                    self._exclude_regex.match(namespace))
+
+    def query(self):
+        """Return a query condition on the 'ns' field of oplog entries
+        selecting the namespaces, or None to select every namespace.
+        """
+        condition = {}
+        if self.include:
+            condition['$in'] = self._terms(self.include)
+        if self.exclude:
+            condition['$nin'] = self._terms(self.exclude)
+        return condition or None
+
+    def _terms(self, patterns):
+        """Plain namespaces are matched exactly by the server, and patterns
+        through the compiled regular expression.
+        """
+        terms = [ns for ns in patterns if not is_pattern(ns)]
+        wildcards = [ns for ns in patterns if is_pattern(ns)]
+        if wildcards:
+            terms.append(_compile(wildcards))
+        return terms
@@ -0,0 +1,269 @@
+# Copyright 2013-2014 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Applies batches of oplog entries to the target systems
+"""
+
+import collections
+import logging
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+import threading
+
+from mongo_connector import errors
+from mongo_connector.constants import (DEFAULT_APPLY_QUEUE_SIZE,
+                                       DEFAULT_APPLY_WORKERS,
+                                       DEFAULT_BATCH_SIZE)
+from mongo_connector.metrics import registry
+
+
+class OplogApplier(threading.Thread):
+    """OplogApplier writes the operations read by an OplogThread to a
+    single target system.
+
+    Batches of operations are handed over through a bounded queue, so that
+    the OplogThread can keep reading the oplog while earlier batches are
+    being written, without getting arbitrarily far ahead of the target.
+    Each target has its own applier and checkpoint, so a slow target only
+    holds back the others once its queue is full.
+
+    With more than one worker, the operations in each batch are partitioned
+    by namespace and _id across that many threads, which apply them
+    concurrently. Operations on the same document always go to the same
+    worker, so they are still applied in order. The checkpoint is the
+    low-water mark of the workers: it only moves past a batch once every
+    operation in it and in the batches before it has been applied.
+    """
+    def __init__(self, doc_manager, queue_size=DEFAULT_APPLY_QUEUE_SIZE,
+                 batch_size=DEFAULT_BATCH_SIZE, on_applied=None,
+                 workers=DEFAULT_APPLY_WORKERS):
+        """Initialize the applier.
+
+        on_applied is called with this applier whenever its checkpoint
+        should be recorded: every batch_size operations if batch_size is
+        positive, and whenever it has caught up with the OplogThread.
+        """
+        super(OplogApplier, self).__init__()
+
+        #The target system this applier writes to
+        self.doc_manager = doc_manager
+
+        #Batches of (timestamp, operations) waiting to be applied
+        self.queue = queue.Queue(maxsize=queue_size)
+
+        #Num operations to apply before recording the checkpoint
+        self.batch_size = batch_size
+
+        #Callback to record the checkpoint
+        self.on_applied = on_applied
+
+        #Timestamp of the last oplog entry applied to the target
+        self.checkpoint = None
+
+        #False once the applier has stopped, possibly because of an error
+        self.running = True
+
+        #Number of operations applied so far, by operation type
+        self.counts = {'i': 0, 'u': 0, 'd': 0}
+
+        #Threads applying a partition of each batch, if more than one
+        self.workers = []
+        if workers > 1:
+            self.workers = [_PartitionWorker(self, queue_size)
+                            for _ in range(workers)]
+
+        #Batches handed to the workers but not completely applied yet,
+        #oldest first, as [timestamp, num partitions left, num operations]
+        self._in_flight = collections.deque()
+        self._in_flight_lock = threading.Lock()
+        self._since_checkpoint = 0
+
+    def run(self):
+        """Apply batches from the queue until stopped.
+        """
+        for worker in self.workers:
+            worker.start()
+        try:
+            while True:
+                ts, operations = self.queue.get()
+                if ts is None:
+                    self.queue.task_done()
+                    return
+                for op, _, _ in operations:
+                    self.counts[op] += 1
+                if self.workers:
+                    self._partition(ts, operations)
+                else:
+                    self._apply_batch(ts, operations)
+        finally:
+            for worker in self.workers:
+                worker.stop()
+
+    def _apply_batch(self, ts, operations):
+        """Apply a whole batch in this thread.
+        """
+        try:
+            # Keep draining the queue after a failure so that
+            # nobody blocks on it, but don't apply anything else
+            if self.running:
+                self.apply(operations)
+                self._applied(ts, len(operations))
+        except Exception:
+            logging.exception("OplogApplier: Unexpected error while "
+                              "applying oplog entries, stopping.")
+            self.running = False
+        finally:
+            self.queue.task_done()
+
+    def _partition(self, ts, operations):
+        """Split a batch between the workers by namespace and _id.
+        """
+        partitions = [[] for _ in self.workers]
+        for operation in operations:
+            doc = operation[1]
+            try:
+                key = hash((doc['ns'], doc['_id']))
+            except TypeError:
+                # _id may be a document
+                key = hash((doc['ns'], repr(doc['_id'])))
+            partitions[key % len(partitions)].append(operation)
+
+        batch = [ts, sum(1 for p in partitions if p), len(operations)]
+        with self._in_flight_lock:
+            self._in_flight.append(batch)
+        if batch[1] == 0:
+            # Nothing to apply, e.g. only no-op entries
+            self._partition_done(batch, None)
+        for worker, partition in zip(self.workers, partitions):
+            if partition:
+                worker.queue.put((batch, partition))
+
+    def _partition_done(self, batch, worker):
+        """Record that a worker is done with its partition of a batch, and
+        move the checkpoint past the batches that are completely applied.
+        """
+        with self._in_flight_lock:
+            if worker is not None:
+                batch[1] -= 1
+            while self._in_flight and self._in_flight[0][1] == 0:
+                ts, _, count = self._in_flight.popleft()
+                if self.running:
+                    self._applied(ts, count, caught_up=(
+                        not self._in_flight and self.queue.empty()))
+                self.queue.task_done()
+
+    def _applied(self, ts, count, caught_up=None):
+        """Move the checkpoint past a batch of count operations, and record
+        it if necessary.
+        """
+        self.checkpoint = ts
+        self._since_checkpoint += count
+        if caught_up is None:
+            caught_up = self.queue.empty()
+        if ((self.batch_size > 0 and
+                self._since_checkpoint >= self.batch_size) or caught_up):
+            self._since_checkpoint = 0
+            if self.on_applied is not None:
+                self.on_applied(self)
+
+    def put(self, ts, operations, block=True, timeout=None):
+        """Queue a batch of operations, read up to the oplog entry with
+        timestamp ts.
+
+        Blocks while the queue is full if block is True, raising Queue.Full
+        if that lasts longer than timeout seconds.
+        """
+        self.queue.put((ts, operations), block, timeout)
+
+    def wait(self):
+        """Block until every queued batch has been applied.
+        """
+        self.queue.join()
+
+    def stop(self):
+        """Stop the applier once the batches already queued are applied.
+        """
+        self.queue.put((None, None))
+        self.join()
+
+    def apply(self, operations):
+        """Apply a batch of operations to the target system.
+
+        The DocManager is given the whole batch through bulk_apply when it
+        supports it. If that fails, or if it doesn't, the operations are
+        applied one at a time so that a single bad document doesn't hold
+        back the rest of the batch.
+        """
+        docman = self.doc_manager
+        key = docman.__class__.__module__
+        if hasattr(docman, "bulk_apply"):
+            try:
+                with registry.timer('docmanager.bulk_apply', key):
+                    docman.bulk_apply(operations)
+                return
+            except (errors.OperationFailed, errors.ConnectionFailed):
+                logging.exception(
+                    "OplogApplier: Bulk apply failed, retrying %d "
+                    "operations one at a time" % len(operations))
+                registry.incr('apply.retries', key, len(operations))
+
+        methods = {'i': 'upsert', 'u': 'update', 'd': 'remove'}
+        for op, doc, update_spec in operations:
+            try:
+                with registry.timer('docmanager.' + methods[op], key):
+                    if op == 'i':
+                        docman.upsert(doc)
+                    elif op == 'u':
+                        docman.update(doc, update_spec)
+                    elif op == 'd':
+                        docman.remove(doc)
+            except errors.OperationFailed:
+                logging.exception(
+                    "Unable to process oplog document %r" % doc)
+                registry.incr('apply.failures', key)
+            except errors.ConnectionFailed:
+                logging.exception(
+                    "Connection failed while processing oplog "
+                    "document %r" % doc)
+                registry.incr('apply.failures', key)
+
+
+class _PartitionWorker(threading.Thread):
+    """Applies partitions of the batches split by an OplogApplier.
+    """
+    def __init__(self, applier, queue_size):
+        super(_PartitionWorker, self).__init__()
+        self.applier = applier
+        self.queue = queue.Queue(maxsize=queue_size)
+
+    def run(self):
+        while True:
+            batch, operations = self.queue.get()
+            if batch is None:
+                return
+            try:
+                if self.applier.running:
+                    self.applier.apply(operations)
+            except Exception:
+                logging.exception("OplogApplier: Unexpected error while "
+                                  "applying oplog entries, stopping.")
+                self.applier.running = False
+            finally:
+                self.applier._partition_done(batch, self)
+
+    def stop(self):
+        self.queue.put((None, None))
+        self.join()
@@ -16,23 +16,69 @@
 """
 
 import bson
+import copy
 import logging
+import math
+from functools import partial
 try:
     import Queue as queue
 except ImportError:
     import queue
+try:
+    from bson.codec_options import CodecOptions
+    from bson.raw_bson import RawBSONDocument
+except ImportError:
+    # Reading raw BSON requires PyMongo 3.2+
+    RawBSONDocument = None
 import pymongo
 import sys
 import time
 import threading
 import traceback
 from mongo_connector import errors, util
-from mongo_connector.constants import DEFAULT_BATCH_SIZE
+from mongo_connector.constants import (DEFAULT_APPLY_BATCH_BYTES,
+                                       DEFAULT_APPLY_BATCH_SIZE,
+                                       DEFAULT_APPLY_BATCH_WAIT,
+                                       DEFAULT_APPLY_QUEUE_SIZE,
+                                       DEFAULT_APPLY_WORKERS,
+                                       DEFAULT_BATCH_SIZE,
+                                       DEFAULT_COALESCE_WINDOW,
+                                       DEFAULT_DUMP_BATCH_SIZE,
+                                       DEFAULT_DUMP_BUFFER_SIZE,
+                                       DEFAULT_DUMP_SPLIT_SIZE,
+                                       DEFAULT_DUMP_WORKERS,
+                                       DEFAULT_MAX_AWAIT_TIME,
+                                       DEFAULT_ROLLBACK_WORKERS)
+from mongo_connector.coalesce import coalesce
+from mongo_connector.compat import string_types
+from mongo_connector.locking_dict import LockingDict
+from mongo_connector.metrics import TIMING_BUCKETS, registry
+from mongo_connector.namespaces import NamespaceFilter
+from mongo_connector.oplog_applier import OplogApplier
+from mongo_connector.spill import SpillBuffer
 from mongo_connector.util import retry_until_ok
 
 from pymongo import MongoClient
 
 
+# Num documents upserted at once into each target during a collection
+# dump. The dump progress is recorded after each chunk.
+DUMP_CHUNK_SIZE = 1000
+
+# Num documents from a namespace of a target reconciled at once during a
+# rollback: looked up in MongoDB with one query, then removed or
+# re-inserted with one call to bulk_apply
+ROLLBACK_CHUNK_SIZE = 1000
+
+# Num seconds between two checks of how far a majority of the replica set
+# has replicated the oplog, while holding back entries it hasn't
+MAJORITY_POLL_INTERVAL = 0.1
+
+# The fields of oplog entries read while tailing the oplog
+OPLOG_ENTRY_FIELDS = {'ts': 1, 'op': 1, 'ns': 1, 'o': 1, 'o2': 1,
+                      'fromMigrate': 1}
+
+
 class OplogThread(threading.Thread):
     """OplogThread gathers the updates for a single oplog.
     """
@@ -40,13 +86,58 @@ class OplogThread(threading.Thread):
                  doc_manager, oplog_progress_dict, namespace_set, auth_key,
                  auth_username, repl_set=None, collection_dump=True,
                  batch_size=DEFAULT_BATCH_SIZE, fields=None,
-                 dest_mapping={}):
+                 dest_mapping={},
+                 apply_batch_size=DEFAULT_APPLY_BATCH_SIZE,
+                 apply_batch_bytes=DEFAULT_APPLY_BATCH_BYTES,
+                 apply_batch_wait=DEFAULT_APPLY_BATCH_WAIT,
+                 apply_queue_size=DEFAULT_APPLY_QUEUE_SIZE,
+                 apply_workers=DEFAULT_APPLY_WORKERS,
+                 coalesce_window=DEFAULT_COALESCE_WINDOW,
+                 max_await_time=DEFAULT_MAX_AWAIT_TIME,
+                 ex_namespace_set=None,
+                 dump_workers=DEFAULT_DUMP_WORKERS,
+                 dump_split_size=DEFAULT_DUMP_SPLIT_SIZE,
+                 dump_progress_dict=None, concurrent_dump=False,
+                 dump_read_preference=None, dump_tag_sets=None,
+                 dump_batch_size=DEFAULT_DUMP_BATCH_SIZE,
+                 dump_throttle=None, tail_throttle=None,
+                 dump_chunk_size=DUMP_CHUNK_SIZE, dump_only=False,
+                 rollback_workers=DEFAULT_ROLLBACK_WORKERS, journal=None,
+                 majority_tailing=False, tail_read_preference=None,
+                 tail_tag_sets=None, tail_conn=None):
         """Initialize the oplog thread.
         """
         super(OplogThread, self).__init__()
 
         self.batch_size = batch_size
 
+        #Limits on the number of oplog entries, their size in bytes, and the
+        #time they may wait before being applied together to the targets
+        self.apply_batch_size = apply_batch_size
+        self.apply_batch_bytes = apply_batch_bytes
+        self.apply_batch_wait = apply_batch_wait
+
+        #Num batches that may wait to be applied while we read the oplog
+        self.apply_queue_size = apply_queue_size
+
+        #Num threads applying entries to each target system concurrently
+        self.apply_workers = apply_workers
+
+        #Num seconds to collect entries before collapsing the operations on
+        #each document into one, if any
+        self.coalesce_window = coalesce_window
+
+        #Max num seconds to block waiting for new oplog entries
+        self.max_await_time = max_await_time
+
+        #An applier for each target system, which applies the entries we
+        #read and keeps its own checkpoint.
+        #The value is set when the thread starts.
+        self.appliers = []
+
+        #Serializes checkpoint updates from the appliers
+        self._checkpoint_lock = threading.Lock()
+
         #The connection to the primary for this replicaSet.
         self.primary_connection = primary_conn
 
@@ -54,6 +145,72 @@ class OplogThread(threading.Thread):
         # is present in the config file
         self.collection_dump = collection_dump
 
+        #Boolean chooses whether to tail the oplog while dumping collections,
+        #rather than after
+        self.concurrent_dump = concurrent_dump
+
+        #The thread dumping collections while we tail the oplog, and the
+        #operations held back for each namespace until it is dumped.
+        #Namespaces are put in the _dumped queue once dumped.
+        self._dumper = None
+        self._dump_buffers = {}
+        self._dumped = None
+        self._dump_succeeded = False
+
+        #Timestamp of the last batch handed to the appliers
+        self._dispatched_ts = None
+
+        #Boolean chooses whether to hold back oplog entries until a
+        #majority of the replica set has them, so that the targets never
+        #see writes that get rolled back. _majority_ts is the last majority
+        #timestamp seen, and _stale_cursor is set when entries read from
+        #the cursor turn out to have been rolled back.
+        self.majority_tailing = majority_tailing
+        self._majority_ts = None
+        self._stale_cursor = False
+
+        #Num threads dumping collections concurrently
+        self.dump_workers = dump_workers
+
+        #Num documents upserted at once into each target during a dump
+        self.dump_chunk_size = dump_chunk_size
+
+        #Boolean chooses whether to stop once collections are dumped,
+        #leaving the oplog to be tailed later from the recorded checkpoint.
+        #dump_finished is set if the dump then completed.
+        self.dump_only = dump_only
+        self.dump_finished = False
+
+        #Num documents in each batch read from collections during dumps
+        self.dump_batch_size = dump_batch_size
+
+        #Throttles limiting the rate of documents dumped and of operations
+        #read from the oplog, if any. They may be shared between threads.
+        self.dump_throttle = dump_throttle
+        self.tail_throttle = tail_throttle
+
+        #Name of the read preference mode and tag sets used to read
+        #collections during dumps and rollbacks, e.g. to read them from a
+        #secondary. None reads them like the oplog.
+        self.dump_read_preference = dump_read_preference
+        self.dump_tag_sets = dump_tag_sets
+
+        #Size in MB of the _id ranges that large collections are split into,
+        #so that several threads can dump them
+        self.dump_split_size = dump_split_size
+
+        #Name of the read preference mode and tag sets used to tail the
+        #oplog, e.g. to tail it from a secondary. None tails the primary.
+        #Checkpoints, rollbacks and majority checks still go by the oplog
+        #of the primary.
+        self.tail_read_preference = tail_read_preference
+        self.tail_tag_sets = tail_tag_sets
+
+        #The connection the oplog is tailed through. Tailing other members
+        #than the primary needs a client from util.replica_set_client.
+        #Otherwise the same as primary_connection.
+        self.tail_connection = tail_conn or primary_conn
+
         #The mongos for sharded setups
         #Otherwise the same as primary_connection.
         #The value is set later on.
@@ -72,6 +229,25 @@ class OplogThread(threading.Thread):
         else:
             self.doc_managers = [doc_manager]
 
+        #The Journal recording the operations handed to the target systems,
+        #which rollbacks look up instead of searching the targets, if any.
+        #It may be shared between threads.
+        self.journal = journal
+
+        #Boolean set once the journal had to start over from our checkpoint
+        #during this run. The targets may hold later operations it never
+        #recorded, so rollbacks search the targets until the next run.
+        self._journal_restarted = False
+
+        #Num threads reconciling documents with each target system during
+        #rollbacks. Given as a single number for every target, or a list
+        #whose last number also applies to any further targets.
+        if not isinstance(rollback_workers, list):
+            rollback_workers = [rollback_workers]
+        self.rollback_workers = [
+            rollback_workers[min(i, len(rollback_workers) - 1)]
+            for i in range(len(self.doc_managers))]
+
         #Boolean describing whether or not the thread is running.
         self.running = True
 
@@ -82,8 +258,19 @@ class OplogThread(threading.Thread):
         #Represents the last checkpoint for a OplogThread.
         self.oplog_progress = oplog_progress_dict
 
-        #The set of namespaces to process from the mongo cluster.
-        self.namespace_set = namespace_set
+        #A dictionary that stores OplogThread/dump progress pairs while
+        #collections are being dumped, so that an interrupted dump resumes
+        #where it stopped.
+        if dump_progress_dict is None:
+            dump_progress_dict = LockingDict()
+        self.dump_progress = dump_progress_dict
+
+        #The set of namespaces to process from the mongo cluster, and the
+        #set of namespaces to leave out. Both may contain wildcards.
+        self._namespace_set = namespace_set
+        self._ex_namespace_set = ex_namespace_set
+        self._namespace_filter = NamespaceFilter(namespace_set,
+                                                 ex_namespace_set)
 
         #The dict of source namespaces to destination namespaces
         self.dest_mapping = dest_mapping
@@ -99,23 +286,42 @@ class OplogThread(threading.Thread):
 
         logging.info('OplogThread: Initializing oplog thread')
 
+        #The connection collections are read through during dumps and
+        #rollbacks. mongos follows the read preference chosen for them, but
+        #a replica set may need a client of its own.
+        self.source_connection = None
+
         if is_sharded:
             self.main_connection = MongoClient(main_address)
+            self.source_connection = self.main_connection
         else:
             self.main_connection = MongoClient(main_address,
                                                replicaSet=repl_set)
             self.oplog = self.main_connection['local']['oplog.rs']
+            if dump_read_preference in (None, 'primary'):
+                self.source_connection = self.main_connection
+            else:
+                self.source_connection = util.replica_set_client(
+                    main_address, repl_set, dump_read_preference)
 
         if auth_key is not None:
             #Authenticate for the whole system
-            self.primary_connection['admin'].authenticate(
-                auth_username, auth_key)
-            self.main_connection['admin'].authenticate(
-                auth_username, auth_key)
+            self.authenticate()
         if not self.oplog.find_one():
             err_msg = 'OplogThread: No oplog for thread:'
             logging.warning('%s %s' % (err_msg, self.primary_connection))
 
+    def authenticate(self):
+        """Authenticate every connection of this thread.
+        """
+        connections = [self.primary_connection, self.main_connection]
+        for connection in (self.source_connection, self.tail_connection):
+            if all(connection is not other for other in connections):
+                connections.append(connection)
+        for connection in connections:
+            connection['admin'].authenticate(self.auth_username,
+                                             self.auth_key)
+
     @property
     def fields(self):
         return self._fields
@@ -129,128 +335,138 @@ class OplogThread(threading.Thread):
         else:
             self._fields = None
 
+    @property
+    def namespace_set(self):
+        return self._namespace_set
+
+    @namespace_set.setter
+    def namespace_set(self, value):
+        self._namespace_set = value
+        self._namespace_filter = NamespaceFilter(value,
+                                                 self._ex_namespace_set)
+
+    @property
+    def ex_namespace_set(self):
+        return self._ex_namespace_set
+
+    @ex_namespace_set.setter
+    def ex_namespace_set(self, value):
+        self._ex_namespace_set = value
+        self._namespace_filter = NamespaceFilter(self._namespace_set, value)
+
     def run(self):
         """Start the oplog worker.
         """
         logging.debug("OplogThread: Run thread started")
+        self.appliers = [OplogApplier(dm,
+                                      queue_size=self.apply_queue_size,
+                                      batch_size=self.batch_size,
+                                      on_applied=self._acknowledge,
+                                      workers=self.apply_workers)
+                         for dm in self.doc_managers]
+        for applier in self.appliers:
+            applier.start()
+        #Spaces out reconnection attempts while errors persist
+        backoff = util.Backoff()
         while self.running is True:
             logging.debug("OplogThread: Getting cursor")
+            self._stale_cursor = False
             cursor = self.init_cursor()
             logging.debug("OplogThread: Got the cursor, go go go!")
 
+            if self.dump_only:
+                # The checkpoint is where tailing will start from later
+                self.dump_finished = self.running and cursor is not None
+                self.running = False
+                continue
+
             # we've fallen too far behind
-            if cursor is None and self.checkpoint is not None:
+            if (cursor is None and self.checkpoint is not None and
+                    self.running):
                 err_msg = "OplogThread: Last entry no longer in oplog"
                 effect = "cannot recover!"
                 logging.error('%s %s %s' % (err_msg, effect, self.oplog))
                 self.running = False
                 continue
 
-            #The only entry is the last one we processed
-            if cursor is None or util.retry_until_ok(cursor.count) == 1:
-                logging.debug("OplogThread: Last entry is the one we "
-                              "already processed.  Up to date.  Sleeping.")
-                time.sleep(1)
+            #Nothing to tail yet, e.g. the oplog is empty
+            if cursor is None:
+                logging.debug("OplogThread: No oplog entries to tail yet. "
+                              "Sleeping.")
+                time.sleep(self.max_await_time)
                 continue
 
-            last_ts = None
             err = False
-            remove_inc = 0
-            upsert_inc = 0
-            update_inc = 0
+            # Whether the cursor returned anything before closing
+            read_entries = False
+            # Operations waiting to be handed to the applier
+            batch = []
+            # Timestamp of the last entry read into the batch
+            batch_ts = None
+            batch_bytes = 0
+            batch_started = None
             try:
                 logging.debug("OplogThread: about to process new oplog "
                               "entries")
-                while cursor.alive and self.running:
-                    logging.debug("OplogThread: Cursor is still"
-                                  " alive and thread is still running.")
-                    for n, entry in enumerate(cursor):
-
-                        logging.debug("OplogThread: Iterating through cursor,"
-                                      " document number in this cursor is %d"
-                                      % n)
+                while (cursor.alive and self.running and
+                       not self._stale_cursor):
+                    if self._dumper is not None:
+                        self._replay_dumped()
+                    for entry in cursor:
                         # Break out if this thread should stop
                         if not self.running:
                             break
+                        read_entries = True
+                        if self._dumper is not None:
+                            self._replay_dumped()
 
-                        # Don't replicate entries resulting from chunk moves
+                        # Don't replicate entries resulting from chunk moves.
                         if entry.get("fromMigrate"):
+                            entry = None
+                        else:
+                            if self.apply_batch_bytes:
+                                entry_bytes = util.bson_size(entry)
+                            # Entries read as raw BSON are only decoded once
+                            # we know they touch a document. Take fields out
+                            # of the oplog entry that shouldn't be
+                            # replicated. This may nullify the document if
+                            # there's nothing to do.
+                            if entry['op'] in ('i', 'u', 'd'):
+                                entry = self.filter_oplog_entry(
+                                    util.decode_raw(entry))
+
+                        if entry is not None:
+                            if batch_ts is None:
+                                batch_started = time.time()
+                            if self.apply_batch_bytes:
+                                batch_bytes += entry_bytes
+                            operation = self.entry_to_operation(entry)
+                            if operation is not None:
+                                held = self._dump_buffers.get(entry['ns'])
+                                if held is not None:
+                                    # Wait until the namespace is dumped
+                                    held.append(operation)
+                                else:
+                                    batch.append(operation)
+                            batch_ts = entry['ts']
+
+                        if batch_ts is None or not self._batch_ready(
+                                batch, batch_bytes, batch_started, cursor):
                             continue
 
-                        # Take fields out of the oplog entry that
-                        # shouldn't be replicated. This may nullify
-                        # the document if there's nothing to do.
-                        if not self.filter_oplog_entry(entry):
-                            continue
+                        self.dispatch(batch_ts, batch)
+                        batch, batch_ts, batch_bytes = [], None, 0
+                        if self._stale_cursor:
+                            break
 
-                        #sync the current oplog operation
-                        operation = entry['op']
-                        ns = entry['ns']
-
-                        # use namespace mapping if one exists
-                        ns = self.dest_mapping.get(entry['ns'], ns)
-
-                        for docman in self.doc_managers:
-                            try:
-                                logging.debug("OplogThread: Operation for this "
-                                              "entry is %s" % str(operation))
-
-                                # Remove
-                                if operation == 'd':
-                                    entry['_id'] = entry['o']['_id']
-                                    docman.remove(entry)
-                                    remove_inc += 1
-                                # Insert
-                                elif operation == 'i':  # Insert
-                                    # Retrieve inserted document from
-                                    # 'o' field in oplog record
-                                    doc = entry.get('o')
-                                    # Extract timestamp and namespace
-                                    doc['_ts'] = util.bson_ts_to_long(
-                                        entry['ts'])
-                                    doc['ns'] = ns
-                                    docman.upsert(doc)
-                                    upsert_inc += 1
-                                # Update
-                                elif operation == 'u':
-                                    doc = {"_id": entry['o2']['_id'],
-                                           "_ts": util.bson_ts_to_long(
-                                               entry['ts']),
-                                           "ns": ns}
-                                    # 'o' field contains the update spec
-                                    docman.update(doc, entry.get('o', {}))
-                                    update_inc += 1
-                            except errors.OperationFailed:
-                                logging.exception(
-                                    "Unable to process oplog document %r"
-                                    % entry)
-                            except errors.ConnectionFailed:
-                                logging.exception(
-                                    "Connection failed while processing oplog "
-                                    "document %r" % entry)
-
-                        if (remove_inc + upsert_inc + update_inc) % 1000 == 0:
-                            logging.debug(
-                                "OplogThread: Documents removed: %d, "
-                                "inserted: %d, updated: %d so far" % (
-                                    remove_inc, upsert_inc, update_inc))
-
-                        logging.debug("OplogThread: Doc is processed.")
-
-                        last_ts = entry['ts']
-
-                        # update timestamp per batch size
-                        # n % -1 (default for self.batch_size) == 0 for all n
-                        if n % self.batch_size == 1 and last_ts is not None:
-                            self.checkpoint = last_ts
-                            self.update_checkpoint()
-
-                    # update timestamp after running through oplog
-                    if last_ts is not None:
-                        logging.debug("OplogThread: updating checkpoint after"
-                                      "processing new oplog entries")
-                        self.checkpoint = last_ts
-                        self.update_checkpoint()
+                    # hand over whatever is left once the cursor runs dry,
+                    # unless it's still collecting entries to coalesce
+                    if batch_ts is not None and not (
+                            self.coalesce_window and
+                            time.time() - batch_started <
+                            self.coalesce_window):
+                        self.dispatch(batch_ts, batch)
+                        batch, batch_ts, batch_bytes = [], None, 0
 
             except (pymongo.errors.AutoReconnect,
                     pymongo.errors.OperationFailure,
@@ -260,26 +476,306 @@ class OplogThread(threading.Thread):
                     "Will attempt to reconnect.")
                 err = True
 
+            # Reconnect right away if the cursor simply closed, but don't
+            # hammer MongoDB while it keeps failing
+            if err is True or not read_entries:
+                backoff.sleep()
+            else:
+                backoff.reset()
+
             if err is True and self.auth_key is not None:
-                self.primary_connection['admin'].authenticate(
-                    self.auth_username, self.auth_key)
-                self.main_connection['admin'].authenticate(
-                    self.auth_username, self.auth_key)
+                self.authenticate()
                 err = False
 
-            # update timestamp before attempting to reconnect to MongoDB,
-            # after being join()'ed, or if the cursor closes
-            if last_ts is not None:
-                logging.debug("OplogThread: updating checkpoint after an "
-                              "Exception, cursor closing, or join() on this"
-                              "thread.")
-                self.checkpoint = last_ts
-                self.update_checkpoint()
+            # hand over entries read before the cursor closed
+            if batch_ts is not None:
+                self.dispatch(batch_ts, batch)
+
+            # Wait for everything read so far to be applied before
+            # attempting to reconnect to MongoDB, after being join()'ed, or
+            # if the cursor closes. The applier records the checkpoint
+            # as it catches up.
+            logging.debug("OplogThread: waiting for oplog entries to be "
+                          "applied after an Exception, cursor closing, or "
+                          "join() on this thread.")
+            for applier in self.appliers:
+                applier.wait()
+
+            for applier in self.appliers:
+                logging.debug("OplogThread: Reconnecting. Documents removed: "
+                              "%d, upserted: %d, updated: %d in %s"
+                              % (applier.counts['d'], applier.counts['i'],
+                                 applier.counts['u'], applier.doc_manager))
+
+        if self._dumper is not None:
+            self._dumper.join()
+        for applier in self.appliers:
+            applier.stop()
+
+    def _batch_ready(self, batch, batch_bytes, batch_started, cursor):
+        """Decide whether a batch of operations should be applied now.
+        """
+        if len(batch) >= self.apply_batch_size:
+            return True
+        if self.apply_batch_bytes and batch_bytes >= self.apply_batch_bytes:
+            return True
+        if self.coalesce_window:
+            # Hold on to the batch for the whole window, so that more
+            # operations on the same documents can be collapsed
+            return time.time() - batch_started >= self.coalesce_window
+        if time.time() - batch_started >= self.apply_batch_wait:
+            return True
+        # Don't hold on to a batch while blocking on a getMore. Drivers that
+        # don't tell leave the batch to the wait time bound above.
+        return util.buffered_count(cursor) == 0
+
+    def entry_to_operation(self, entry):
+        """Convert an oplog entry into an (op, doc, update_spec) tuple, as
+        accepted by DocManager.bulk_apply.
+
+        Returns None for entries that don't touch a document.
+        """
+        operation = entry['op']
+        # use namespace mapping if one exists
+        ns = self.dest_mapping.get(entry['ns'], entry['ns'])
+        ts = util.bson_ts_to_long(entry['ts'])
+
+        # Remove
+        if operation == 'd':
+            return 'd', {"_id": entry['o']['_id'], "_ts": ts, "ns": ns}, None
+        # Insert
+        elif operation == 'i':
+            # Retrieve inserted document from 'o' field in oplog record
+            doc = entry['o']
+            # Extract timestamp and namespace
+            doc['_ts'] = ts
+            doc['ns'] = ns
+            return 'i', doc, None
+        # Update
+        elif operation == 'u':
+            doc = {"_id": entry['o2']['_id'], "_ts": ts, "ns": ns}
+            # 'o' field contains the update spec
+            return 'u', doc, entry.get('o', {})
+        return None
+
+    def dispatch(self, ts, operations):
+        """Hand a batch of operations, read up to the oplog entry with
+        timestamp ts, to the applier of every target system.
+
+        Blocks while the queue of any applier is full, once the others have
+        been given the batch. The batch is dropped if this thread is stopped
+        in the meantime; it will be read again from the oplog on the next
+        run, since no checkpoint moved past it.
+
+        If majority tailing is enabled, the batch first waits until a
+        majority of the replica set has the entry with timestamp ts. It is
+        dropped if that entry was rolled back in the meantime, and the
+        cursor is reopened from the checkpoint.
+
+        If coalescing is enabled, the operations on each document are first
+        collapsed into their net effect. The batch is then recorded in the
+        journal, if any, and waits for the tail throttle, if any.
+        """
+        if self.majority_tailing and not self._wait_for_majority(ts):
+            if self.running:
+                logging.warning("OplogThread: oplog entries read from %s "
+                                "were rolled back before a majority of the "
+                                "replica set had them, reading the oplog "
+                                "again." % self.oplog)
+                self._stale_cursor = True
+            return
+        if self.coalesce_window:
+            operations = coalesce(operations)
+        self._dispatched_ts = ts
+        if self.journal is not None:
+            # Before any target gets hold of the operations
+            self.journal.record(str(self.oplog), util.bson_ts_to_long(ts),
+                                operations)
+        self._throttle(self.tail_throttle, len(operations),
+                       (part for _, doc, spec in operations
+                        for part in (doc, spec) if part))
+
+        counts = {}
+        for op, doc, _ in operations:
+            key = (op, doc['ns'])
+            counts[key] = counts.get(key, 0) + 1
+        registry.incr_all('oplog.operations', counts)
+        registry.observe('oplog.batch_size', len(operations))
+
+        # Targets may modify the documents they are given, so each one
+        # beyond the first gets its own copy of the batch.
+        pending = [(self.appliers[0], operations)]
+        pending.extend((applier, copy.deepcopy(operations))
+                       for applier in self.appliers[1:])
+
+        full = []
+        for applier, batch in pending:
+            try:
+                applier.put(ts, batch, block=False)
+            except queue.Full:
+                full.append((applier, batch))
+
+        for applier, batch in full:
+            with registry.timer('oplog.backpressure'):
+                while self.running:
+                    if not applier.running:
+                        logging.error("OplogThread: applier for %s stopped, "
+                                      "cannot recover!" % applier.doc_manager)
+                        self.running = False
+                        return
+                    try:
+                        applier.put(ts, batch, timeout=1)
+                        break
+                    except queue.Full:
+                        continue
+
+        if not all(applier.running for applier in self.appliers):
+            logging.error("OplogThread: an applier for %s stopped, cannot "
+                          "recover!" % self.oplog)
+            self.running = False
+
+    def _wait_for_majority(self, ts):
+        """Wait until a majority of the replica set has the oplog entry with
+        timestamp ts.
+
+        Returns True once it does, or False if the entry was rolled back or
+        this thread is stopped first.
+        """
+        if self._majority_ts is None or self._majority_ts < ts:
+            with registry.timer('oplog.majority_wait'):
+                while self.running:
+                    majority_ts = retry_until_ok(self.get_majority_timestamp)
+                    if majority_ts is not None and majority_ts >= ts:
+                        self._majority_ts = majority_ts
+                        break
+                    time.sleep(MAJORITY_POLL_INTERVAL)
+                else:
+                    return False
+        # After a failover the majority may have moved on along another
+        # history than the one the entry was read from
+        return retry_until_ok(self.has_entry, ts)
+
+    def has_entry(self, ts):
+        """Return True if the oplog of the primary has the entry with
+        timestamp ts.
+        """
+        cursor = util.find(self.oplog, {'ts': {'$gte': ts}},
+                           fields={'ts': 1}).limit(1)
+        # OplogReplay finds the entry without scanning the oplog
+        cursor.add_option(8)
+        entry = next(cursor, None)
+        return entry is not None and entry['ts'] == ts
+
+    def get_majority_timestamp(self):
+        """Return the timestamp of the last oplog entry written by a
+        majority of the replica set, or None if it is unknown.
+        """
+        status = self.primary_connection['admin'].command('replSetGetStatus')
+        committed = status.get('optimes', {}).get('lastCommittedOpTime')
+        # A {ts, t} document under protocol version 1, a bare timestamp
+        # before that
+        if isinstance(committed, dict):
+            committed = committed.get('ts')
+        if committed is not None:
+            return committed
+        # Older servers don't report it, so find the latest optime reached
+        # by a majority of the members. Arbiters and unhealthy members
+        # count towards the majority but don't have any optime.
+        optimes = []
+        for member in status['members']:
+            optime = member.get('optime')
+            if isinstance(optime, dict):
+                optime = optime.get('ts')
+            if (optime is not None and member.get('health', 1) and
+                    member.get('state') in (1, 2)):
+                optimes.append(optime)
+        majority = len(status['members']) // 2 + 1
+        if len(optimes) < majority:
+            return None
+        return sorted(optimes, reverse=True)[majority - 1]
 
-            logging.debug("OplogThread: Sleeping. Documents removed: %d, "
-                          "upserted: %d, updated: %d"
-                          % (remove_inc, upsert_inc, update_inc))
-            time.sleep(2)
+    def _throttle(self, throttle, count, docs):
+        """Wait as long as throttle requires before handing on count
+        documents or operations. docs are the documents to count the size
+        of, only looked at if the throttle limits bytes.
+        """
+        if not throttle:
+            return
+        num_bytes = 0
+        if throttle.limits_bytes:
+            num_bytes = sum(util.bson_size(doc) for doc in docs)
+        throttle.consume(count, num_bytes)
+
+    def _acknowledge(self, applier):
+        """Advance the checkpoint past the entries that every applier has
+        applied.
+        """
+        with self._checkpoint_lock:
+            checkpoints = [a.checkpoint for a in self.appliers]
+            if None in checkpoints:
+                return
+            checkpoint = min(checkpoints)
+            if checkpoint != self.checkpoint:
+                self.checkpoint = checkpoint
+                # Until a concurrent dump is over, a restart must resume
+                # the dump and tail from where the dump started
+                if self._dumper is None:
+                    self.update_checkpoint()
+
+    def _replay_dumped(self):
+        """Hand the operations held back for each namespace dumped since the
+        last call to the appliers, and wrap up the concurrent dump once it
+        is over.
+        """
+        over = not self._dumper.is_alive()
+        while True:
+            try:
+                namespace = self._dumped.get_nowait()
+            except queue.Empty:
+                break
+            self._replay(self._dump_buffers.pop(namespace, None))
+        if not over:
+            return
+
+        self._dumper = None
+        for buffer in self._dump_buffers.values():
+            buffer.close()
+        self._dump_buffers = {}
+        if not self._dump_succeeded:
+            return
+        # Record the checkpoint once every operation held back is applied
+        for applier in self.appliers:
+            applier.wait()
+        with self._checkpoint_lock:
+            self.update_checkpoint()
+        self.update_dump_progress(None)
+        logging.info("OplogThread: Dumped collections into target system "
+                     "%s" % self.oplog)
+
+    def _replay(self, buffer):
+        """Hand the operations in a SpillBuffer to the appliers, in order.
+        """
+        if buffer is None:
+            return
+        logging.debug("OplogThread: replaying %d operations held back during "
+                      "the dump" % len(buffer))
+        # Applying them doesn't move the checkpoint past any entry read
+        ts = self._dispatched_ts or self.checkpoint
+        batch = []
+        for operation in buffer:
+            batch.append(operation)
+            if len(batch) >= self.apply_batch_size:
+                self.dispatch(ts, batch)
+                batch = []
+        if batch:
+            self.dispatch(ts, batch)
+        buffer.close()
+
+    def target_checkpoints(self):
+        """Return the timestamp of the last oplog entry applied to each
+        target system, in the order of self.doc_managers.
+        """
+        return [applier.checkpoint for applier in self.appliers]
 
     def join(self):
         """Stop this thread from managing the oplog.
@@ -316,6 +812,15 @@ class OplogThread(threading.Thread):
 
     def get_oplog_cursor(self, timestamp):
         """Move cursor to the proper place in the oplog.
+
+        The cursor is positioned just after the entry with the given
+        timestamp, which has already been processed. Only that first entry
+        is fetched to check where the cursor starts, so this doesn't depend
+        on the size of the oplog.
+
+        When tailing a member other than the primary, a member that hasn't
+        replicated the entry yet is waited for rather than rolled back
+        from, as long as the primary has the entry.
         """
 
         logging.debug("OplogThread: Getting the oplog cursor and moving it "
@@ -324,33 +829,46 @@ class OplogThread(threading.Thread):
         if timestamp is None:
             return None
 
-        cursor, cursor_len = None, 0
+        query = self.oplog_query(timestamp)
+
+        backoff = util.Backoff()
         while (True):
             try:
                 logging.debug("OplogThread: Getting the oplog cursor "
                               "in the while true loop for get_oplog_cursor")
-                if not self.namespace_set:
-                    cursor = self.oplog.find(
-                        {'ts': {'$gte': timestamp}},
-                        tailable=True, await_data=True
-                    )
-                else:
-                    cursor = self.oplog.find(
-                        {'ts': {'$gte': timestamp},
-                         'ns': {'$in': self.namespace_set}},
-                        tailable=True, await_data=True
-                    )
+                cursor = util.find(self.raw_oplog(), query,
+                                   fields=OPLOG_ENTRY_FIELDS,
+                                   tailable=True, await_data=True)
                 # Applying 8 as the mask to the cursor enables OplogReplay
                 cursor.add_option(8)
-                logging.debug("OplogThread: Cursor created, getting a count.")
-                cursor_len = cursor.count()
-                logging.debug("OplogThread: Count is %d" % cursor_len)
+                # Bound how long each getMore waits for new entries, if the
+                # driver lets us
+                if (self.max_await_time is not None and
+                        hasattr(cursor, "max_await_time_ms")):
+                    cursor.max_await_time_ms(int(self.max_await_time * 1000))
+                logging.debug("OplogThread: Cursor created, getting the "
+                              "first entry.")
+                first_oplog_entry = next(cursor)
+                break
+            except StopIteration:
+                first_oplog_entry = None
+                if (self.tail_read_preference is not None and
+                        retry_until_ok(self.has_entry, timestamp)):
+                    # The member tailed hasn't replicated the entry yet
+                    if not self.running:
+                        return None
+                    logging.debug("OplogThread: The member tailed is "
+                                  "behind the checkpoint, retrying.")
+                    backoff.sleep()
+                    continue
                 break
             except (pymongo.errors.AutoReconnect,
                     pymongo.errors.OperationFailure,
                     pymongo.errors.ConfigurationError):
-                pass
-        if cursor_len == 0:
+                logging.debug("OplogThread: Failed to get the oplog "
+                              "cursor, retrying.", exc_info=True)
+                backoff.sleep()
+        if first_oplog_entry is None:
             logging.debug("OplogThread: Initiating rollback from "
                           "get_oplog_cursor")
             #rollback, we are past the last element in the oplog
@@ -358,25 +876,72 @@ class OplogThread(threading.Thread):
 
             logging.info('Finished rollback')
             return self.get_oplog_cursor(timestamp)
-        first_oplog_entry = retry_until_ok(lambda: cursor[0])
         cursor_ts_long = util.bson_ts_to_long(first_oplog_entry.get("ts"))
         given_ts_long = util.bson_ts_to_long(timestamp)
         if cursor_ts_long > given_ts_long:
             # first entry in oplog is beyond timestamp, we've fallen behind!
             return None
-        elif cursor_len == 1:     # means we are the end of the oplog
-            self.checkpoint = timestamp
-            #to commit new TS after rollbacks
-
-            return cursor
-        elif cursor_len > 1:
-            doc = retry_until_ok(next, cursor)
-            if timestamp == doc['ts']:
-                return cursor
-            else:               # error condition
-                logging.error('OplogThread: %s Bad timestamp in config file'
-                              % self.oplog)
-                return None
+        elif cursor_ts_long < given_ts_long:
+            # error condition
+            logging.error('OplogThread: %s Bad timestamp in config file'
+                          % self.oplog)
+            return None
+        #to commit new TS after rollbacks
+        self.checkpoint = timestamp
+        return cursor
+
+    def oplog_query(self, timestamp):
+        """Return the query selecting the oplog entries to replicate, from
+        the entry with the given timestamp on.
+
+        Entries resulting from chunk migrations, entries for namespaces that
+        aren't selected and entries that don't touch a document are filtered
+        out by the server, so they never leave it. Since namespaces are
+        matched by the server, new collections matching a wildcard are
+        picked up as soon as they are written to. The entry with the given
+        timestamp always matches, since get_oplog_cursor checks that the
+        cursor starts from it.
+        """
+        wanted = {'op': {'$in': ['i', 'u', 'd']},
+                  'fromMigrate': {'$exists': False}}
+        ns_condition = self._namespace_filter.query()
+        if ns_condition is not None:
+            wanted['ns'] = ns_condition
+        return {'ts': {'$gte': timestamp},
+                '$or': [{'ts': timestamp}, wanted]}
+
+    def raw_oplog(self):
+        """Return the oplog collection to tail, set up to return entries as
+        raw BSON where the driver supports it.
+
+        Raw entries are only decoded as far as the fields looked at, so the
+        documents in entries that are skipped are never decoded.
+        """
+        return self._raw(self.tail_oplog())
+
+    def tail_oplog(self):
+        """Return the oplog collection to tail, with the read preference
+        chosen for tailing.
+
+        The driver selects a matching member each time the cursor is
+        opened, so another one takes over when the member tailed fails.
+        """
+        if self.tail_read_preference is None:
+            return self.oplog
+        database = util.get_database(self.tail_connection,
+                                     self.oplog.database.name,
+                                     self.tail_read_preference,
+                                     self.tail_tag_sets)
+        return database[self.oplog.name]
+
+    def _raw(self, collection):
+        """Return a collection set up to return documents as raw BSON where
+        the driver supports it.
+        """
+        if RawBSONDocument is None or not hasattr(collection, "with_options"):
+            return collection
+        return collection.with_options(
+            codec_options=CodecOptions(document_class=RawBSONDocument))
 
     def dump_collection(self):
         """Dumps collection into the target system.
@@ -384,12 +949,49 @@ class OplogThread(threading.Thread):
         This method is called when we're initializing the cursor and have no
         configs i.e. when we're starting for the first time.
         """
+        progress = self._plan_dump()
+        if progress is None or not self._run_dump(progress):
+            return None
+        return util.long_to_bson_ts(progress['ts'])
 
-        dump_set = self.namespace_set or []
-        logging.debug("OplogThread: Dumping set of collections %s " % dump_set)
+    def start_dump(self):
+        """Start dumping collections in the background, and return the
+        timestamp to tail the oplog from in the meantime.
+
+        The operations read from the oplog on each namespace are held back
+        until that namespace is dumped, then replayed by _replay_dumped.
+        Oplog entries are idempotent, so replaying changes the dump may
+        already have read is harmless.
+        """
+        progress = self._plan_dump()
+        if progress is None:
+            return None
+        self._dump_buffers = dict((r['ns'], SpillBuffer())
+                                  for r in progress['ranges']
+                                  if not r['done'])
+        self._dumped = queue.Queue()
+
+        def dump():
+            self._dump_succeeded = self._run_dump(progress,
+                                                  self._dumped.put)
+        self._dump_succeeded = False
+        self._dumper = threading.Thread(target=dump)
+        self._dumper.start()
+        logging.info("OplogThread: Dumping %d collections while tailing the "
+                     "oplog" % len(self._dump_buffers))
+        return util.long_to_bson_ts(progress['ts'])
+
+    def _plan_dump(self):
+        """Return the progress of the dump to run: that of an interrupted
+        dump of the same namespaces if any, or else the ranges of a new
+        dump as of the latest oplog entry, recorded in the dump progress
+        dictionary. Returns None if the oplog is empty.
+        """
+        dump_set = self._namespace_filter.names
 
-        #no namespaces specified
-        if not self.namespace_set:
+        #no namespaces specified, or wildcards: list every namespace
+        if dump_set is None:
+            dump_set = []
             db_list = retry_until_ok(self.main_connection.database_names)
             for database in db_list:
                 if database == "config" or database == "local":
@@ -400,101 +1002,99 @@ class OplogThread(threading.Thread):
                     if coll.startswith("system"):
                         continue
                     namespace = "%s.%s" % (database, coll)
-                    dump_set.append(namespace)
+                    if self._namespace_filter.matches(namespace):
+                        dump_set.append(namespace)
+        logging.debug("OplogThread: Dumping set of collections %s " % dump_set)
+
+        progress = self.read_dump_progress()
+        if progress is not None and progress['namespaces'] != sorted(dump_set):
+            logging.info("OplogThread: The namespaces to dump changed since "
+                         "the last dump was interrupted, starting over")
+            progress = None
+
+        if progress is not None:
+            logging.info("OplogThread: Resuming the dump interrupted at "
+                         "timestamp %s" % util.long_to_bson_ts(progress['ts']))
+            return progress
 
         timestamp = util.retry_until_ok(self.get_last_oplog_timestamp)
         if timestamp is None:
             return None
-        long_ts = util.bson_ts_to_long(timestamp)
-
-        def docs_to_dump():
-            for namespace in dump_set:
-                logging.info("OplogThread: dumping collection %s"
-                             % namespace)
-                database, coll = namespace.split('.', 1)
-                last_id = None
-                attempts = 0
-
-                # Loop to handle possible AutoReconnect
-                while attempts < 60:
-                    target_coll = self.main_connection[database][coll]
-                    if not last_id:
-                        cursor = util.retry_until_ok(
-                            target_coll.find,
-                            fields=self._fields,
-                            sort=[("_id", pymongo.ASCENDING)]
-                        )
-                    else:
-                        cursor = util.retry_until_ok(
-                            target_coll.find,
-                            {"_id": {"$gt": last_id}},
-                            fields=self._fields,
-                            sort=[("_id", pymongo.ASCENDING)]
-                        )
-                    try:
-                        for doc in cursor:
-                            if not self.running:
-                                raise StopIteration
-                            doc["ns"] = self.dest_mapping.get(
-                                namespace, namespace)
-                            doc["_ts"] = long_ts
-                            last_id = doc["_id"]
-                            yield doc
-                        break
-                    except pymongo.errors.AutoReconnect:
-                        attempts += 1
-                        time.sleep(1)
+        # Dump each namespace, largest namespaces first so that the dump
+        # doesn't end with a single worker busy with a huge collection
+        # while the others sit idle. Large collections are split into
+        # _id ranges that several workers can dump at once.
+        ranges = []
+        for namespace, size in self._by_size(dump_set):
+            split_points = []
+            if self.dump_workers > 1:
+                split_points = self._split_points(namespace, size)
+            bounds = [None] + split_points + [None]
+            for min_id, max_id in zip(bounds[:-1], bounds[1:]):
+                ranges.append({'ns': namespace, 'min_id': min_id,
+                               'max_id': max_id, 'last_id': None,
+                               'done': False})
+        progress = {'ts': util.bson_ts_to_long(timestamp),
+                    'namespaces': sorted(dump_set),
+                    'ranges': ranges}
+        self.update_dump_progress(progress)
+        return progress
+
+    def _run_dump(self, progress, on_dumped=None):
+        """Dump the ranges of a dump that aren't done yet, and return True
+        if the dump succeeded.
+
+        on_dumped is called with each namespace once it is fully dumped.
+        """
+        long_ts = progress['ts']
+        tasks = queue.Queue()
+        for index, dump_range in enumerate(progress['ranges']):
+            if not dump_range['done']:
+                tasks.put(index)
 
-        # Extra threads (if any) that assist with collection dumps
-        dumping_threads = []
-        # Did the dump succeed for all target systems?
-        dump_success = True
         # Holds any exceptions we can't recover from
         errors = queue.Queue()
-        try:
-            for dm in self.doc_managers:
-                # Bulk upsert if possible
-                if hasattr(dm, "bulk_upsert"):
-                    logging.debug("OplogThread: Using bulk upsert function for"
-                                  "collection dump")
-                    # Slight performance gain breaking dump into separate
-                    # threads, only if > 1 replication target
-                    if len(self.doc_managers) == 1:
-                        dm.bulk_upsert(docs_to_dump())
-                    else:
-                        def do_dump(error_queue):
-                            all_docs = docs_to_dump()
-                            try:
-                                dm.bulk_upsert(all_docs)
-                            except Exception:
-                                # Likely exceptions:
-                                # pymongo.errors.OperationFailure,
-                                # mongo_connector.errors.ConnectionFailed
-                                # mongo_connector.errors.OperationFailed
-                                error_queue.put(sys.exc_info())
-
-                        t = threading.Thread(target=do_dump, args=(errors,))
-                        dumping_threads.append(t)
-                        t.start()
-                else:
-                    logging.debug("OplogThread: DocManager %s has not"
-                                  "bulk_upsert method.  Upserting documents "
-                                  "serially for collection dump." % str(dm))
-                    num = 0
-                    for num, doc in enumerate(docs_to_dump()):
-                        if num % 10000 == 0:
-                            logging.debug("Upserted %d docs." % num)
-                        dm.upsert(doc)
-                    logging.debug("Upserted %d docs" % num)
-
-            # cleanup
-            for t in dumping_threads:
-                t.join()
-
-        except Exception:
-            # See "likely exceptions" comment above
-            errors.put(sys.exc_info())
 
+        def dump_worker():
+            while self.running and errors.empty():
+                try:
+                    index = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                dump_range = progress['ranges'][index]
+
+                def acknowledge(last_id):
+                    self.update_dump_range(index, last_id=last_id)
+                try:
+                    self.dump_namespace(dump_range['ns'], long_ts,
+                                        min_id=dump_range['min_id'],
+                                        max_id=dump_range['max_id'],
+                                        last_id=dump_range['last_id'],
+                                        acknowledge=acknowledge)
+                    if self.running:
+                        dumped = self.update_dump_range(index, done=True)
+                        if dumped and on_dumped is not None:
+                            on_dumped(dump_range['ns'])
+                except Exception:
+                    # Likely exceptions:
+                    # pymongo.errors.OperationFailure,
+                    # mongo_connector.errors.ConnectionFailed
+                    # mongo_connector.errors.OperationFailed
+                    errors.put(sys.exc_info())
+
+        num_workers = max(1, min(self.dump_workers, tasks.qsize()))
+        logging.debug("OplogThread: Dumping %d collections in %d parts with "
+                      "%d workers" % (len(progress['namespaces']),
+                                      tasks.qsize(), num_workers))
+        dumping_threads = [threading.Thread(target=dump_worker)
+                           for _ in range(num_workers)]
+        for t in dumping_threads:
+            t.start()
+        for t in dumping_threads:
+            t.join()
+
+        # Did the dump succeed for all target systems?
+        dump_success = True
         # Print caught exceptions
         try:
             while True:
@@ -509,28 +1109,346 @@ class OplogThread(threading.Thread):
             effect = "cannot recover!"
             logging.error('%s %s %s' % (err_msg, effect, self.oplog))
             self.running = False
-            return None
+            return False
+
+        return self.running
 
-        return timestamp
+    def read_dump_progress(self):
+        """Read the progress of an interrupted collection dump from the dump
+        progress dictionary, or None if there is none.
+
+        The progress is a dictionary holding the timestamp the dump started
+        at, the sorted list of namespaces being dumped, and the list of _id
+        ranges they were split into. Each range records the last _id
+        upserted into every target, and whether the range is done.
+        """
+        with self.dump_progress as dump_prog:
+            return dump_prog.get_dict().get(str(self.oplog))
+
+    def update_dump_progress(self, progress):
+        """Store the progress of the collection dump in the dump progress
+        dictionary, or forget it if progress is None.
+        """
+        with self.dump_progress as dump_prog:
+            dump_dict = dump_prog.get_dict()
+            if progress is None:
+                dump_dict.pop(str(self.oplog), None)
+            else:
+                dump_dict[str(self.oplog)] = progress
+
+    def update_dump_range(self, index, last_id=None, done=False):
+        """Record the progress of the collection dump within a range.
+
+        Returns True if every range of the namespace is done.
+        """
+        with self.dump_progress as dump_prog:
+            ranges = dump_prog.get_dict()[str(self.oplog)]['ranges']
+            dump_range = ranges[index]
+            if last_id is not None:
+                dump_range['last_id'] = last_id
+            if done:
+                dump_range['done'] = True
+            return all(r['done'] for r in ranges
+                       if r['ns'] == dump_range['ns'])
+
+    def _source_database(self, database):
+        """Return a database to read documents from during dumps and
+        rollbacks, with the read preference chosen for them.
+        """
+        return util.get_database(self.source_connection, database,
+                                 self.dump_read_preference,
+                                 self.dump_tag_sets)
+
+    def _by_size(self, namespaces):
+        """Return (namespace, size in bytes) pairs, largest first, according
+        to collection stats.
+        """
+        def size(namespace):
+            database, coll = namespace.split('.', 1)
+            db = self._source_database(database)
+            try:
+                # Commands don't follow the database's read preference
+                return db.command(
+                    "collstats", coll,
+                    read_preference=db.read_preference).get("size", 0)
+            except pymongo.errors.PyMongoError:
+                logging.warning("OplogThread: Unable to get the size of "
+                                "collection %s" % namespace)
+                return 0
+
+        sizes = [(namespace, size(namespace)) for namespace in namespaces]
+        return sorted(sizes, key=lambda pair: pair[1], reverse=True)
+
+    def _split_points(self, namespace, size):
+        """Return _id values splitting a collection into ranges of about
+        dump_split_size megabytes each, in increasing order.
+
+        The split points come from the splitVector command where possible.
+        It isn't available through mongos, so the _id values of a random
+        sample of documents are used instead.
+        """
+        max_bytes = (self.dump_split_size or 0) * 1024 * 1024
+        if not max_bytes or size <= max_bytes:
+            return []
+        database, coll = namespace.split('.', 1)
+        db = self._source_database(database)
+        try:
+            result = db.command("splitVector", namespace,
+                                keyPattern={"_id": 1},
+                                maxChunkSizeBytes=max_bytes,
+                                read_preference=db.read_preference)
+            return [key["_id"] for key in result["splitKeys"]]
+        except pymongo.errors.OperationFailure:
+            logging.debug("OplogThread: splitVector failed for %s, sampling "
+                          "split points instead" % namespace)
+
+        # Pick every n-th _id out of a sample n times the number of ranges
+        num_ranges = int(math.ceil(float(size) / max_bytes))
+        per_range = 10
+        try:
+            result = db[coll].aggregate([
+                {"$sample": {"size": num_ranges * per_range}},
+                {"$project": {"_id": 1}}])
+            if isinstance(result, dict):
+                result = result["result"]
+            sampled = sorted(set(doc["_id"] for doc in result))
+        except (pymongo.errors.OperationFailure, TypeError):
+            # No $sample before MongoDB 3.2, or _ids that can't be sorted
+            logging.warning("OplogThread: Unable to split collection %s, "
+                            "dumping it in one piece" % namespace)
+            return []
+        return sampled[per_range::per_range]
+
+    def dump_namespace(self, namespace, long_ts, min_id=None, max_id=None,
+                       last_id=None, acknowledge=None):
+        """Dump the documents in a namespace into every target system, as of
+        the oplog entry with timestamp long_ts.
+
+        Only the documents with min_id <= _id < max_id are dumped, where
+        either bound may be None, starting after last_id if given. The
+        documents are upserted in chunks, and acknowledge is called with
+        the last _id of each chunk once every target has upserted it.
+
+        The documents are read once. With several target systems, they are
+        handed to a thread per target through a bounded buffer, so that the
+        slowest target paces the read instead of each target reading the
+        collection again.
+        """
+        logging.info("OplogThread: dumping collection %s" % namespace)
+        docs = self._namespace_docs(namespace, min_id, max_id, last_id)
+
+        def chunks():
+            chunk = []
+            for doc in docs:
+                chunk.append(doc)
+                if len(chunk) >= self.dump_chunk_size:
+                    self._throttle(self.dump_throttle, len(chunk), chunk)
+                    yield chunk
+                    chunk = []
+            if chunk:
+                self._throttle(self.dump_throttle, len(chunk), chunk)
+                yield chunk
+
+        if len(self.doc_managers) == 1:
+            for chunk in chunks():
+                # The target may modify the documents
+                chunk_id = chunk[-1]["_id"]
+                self._upsert_all(self.doc_managers[0], chunk, namespace,
+                                 long_ts)
+                if acknowledge is not None:
+                    acknowledge(chunk_id)
+            return
+
+        buffer_size = max(1,
+                          DEFAULT_DUMP_BUFFER_SIZE // self.dump_chunk_size)
+        buffers = [queue.Queue(maxsize=buffer_size)
+                   for _ in self.doc_managers]
+        failures = queue.Queue()
+
+        # The last _id of each chunk not yet upserted into every target,
+        # and the number of chunks each target upserted
+        chunk_ids = {}
+        upserted = [0] * len(self.doc_managers)
+        upserted_lock = threading.Lock()
+
+        def consume(target, dm, buffer):
+            try:
+                while True:
+                    item = buffer.get()
+                    if item is None:
+                        return
+                    count, chunk = item
+                    self._upsert_all(dm, chunk, namespace, long_ts)
+                    with upserted_lock:
+                        upserted[target] = count
+                        if min(upserted) != count:
+                            continue
+                        chunk_id = chunk_ids.pop(count)
+                        for done in [c for c in chunk_ids if c < count]:
+                            del chunk_ids[done]
+                        if acknowledge is not None:
+                            acknowledge(chunk_id)
+            except Exception:
+                failures.put(sys.exc_info())
+
+        consumers = [threading.Thread(target=consume,
+                                      args=(target, dm, buffer))
+                     for target, (dm, buffer) in enumerate(
+                         zip(self.doc_managers, buffers))]
+        for consumer in consumers:
+            consumer.start()
+
+        def put(consumer, buffer, item):
+            # Block while the target catches up, unless it gave up
+            while consumer.is_alive():
+                try:
+                    buffer.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            for count, chunk in enumerate(chunks(), 1):
+                with upserted_lock:
+                    chunk_ids[count] = chunk[-1]["_id"]
+                # Targets may modify the documents they are given, unless
+                # they are read-only raw BSON, so copy them before any
+                # target gets hold of them
+                if hasattr(chunk[0], "raw"):
+                    copies = [chunk] * len(consumers)
+                else:
+                    copies = [chunk] + [copy.deepcopy(chunk)
+                                        for _ in consumers[1:]]
+                for consumer, buffer, docs in zip(consumers, buffers,
+                                                  copies):
+                    if not put(consumer, buffer, (count, docs)):
+                        # Report the error of the target itself
+                        raise failures.get()[1]
+        finally:
+            for consumer, buffer in zip(consumers, buffers):
+                put(consumer, buffer, None)
+            for consumer in consumers:
+                consumer.join()
+
+        if not failures.empty():
+            raise failures.get()[1]
+
+    def _upsert_all(self, dm, docs, namespace, long_ts):
+        """Upsert documents dumped from a namespace as of the oplog entry with
+        timestamp long_ts into a single target system.
+
+        Target systems with a bulk_upsert_raw method are handed the
+        documents as read, possibly as raw BSON, along with their namespace
+        and timestamp. Otherwise each document is decoded and given its
+        'ns' and '_ts' fields.
+        """
+        key = dm.__class__.__module__
+        ns = self.dest_mapping.get(namespace, namespace)
+        if hasattr(dm, "bulk_upsert_raw"):
+            with registry.timer('docmanager.bulk_upsert_raw', key):
+                dm.bulk_upsert_raw(docs, ns, long_ts)
+            return
+
+        def with_metadata():
+            for doc in docs:
+                doc = util.decode_raw(doc)
+                doc["ns"] = ns
+                doc["_ts"] = long_ts
+                yield doc
+        # Bulk upsert if possible
+        if hasattr(dm, "bulk_upsert"):
+            with registry.timer('docmanager.bulk_upsert', key):
+                dm.bulk_upsert(with_metadata())
+        else:
+            for doc in with_metadata():
+                with registry.timer('docmanager.upsert', key):
+                    dm.upsert(doc)
+
+    def _namespace_docs(self, namespace, min_id=None, max_id=None,
+                        last_id=None):
+        """Generate the documents in a namespace with min_id <= _id < max_id,
+        after last_id if given.
+
+        The bounds are applied to the _id index rather than as a query, so
+        that _ids of every type fall in exactly one range. Documents are
+        read as raw BSON where the driver supports it, through an exhaust
+        cursor where the driver and connection allow it, and are left
+        untouched: the namespace and timestamp are added for each target
+        system by _upsert_all.
+        """
+        database, coll = namespace.split('.', 1)
+        # The server then streams every batch without waiting for a getMore
+        exhaust = util.supports_exhaust(self.source_connection)
+        attempts = 0
+        dumped = 0
+        # The last document generated, whose _id is only looked at to
+        # resume after a lost connection
+        last_doc = None
+
+        # Loop to handle possible AutoReconnect
+        while attempts < 60:
+            if last_doc is not None:
+                last_id = last_doc["_id"]
+            target_coll = self._raw(self._source_database(database)[coll])
+            cursor = util.retry_until_ok(
+                util.find,
+                target_coll,
+                fields=self._fields,
+                exhaust=exhaust,
+                sort=[("_id", pymongo.ASCENDING)]
+            )
+            lower = min_id if last_id is None else last_id
+            if lower is not None or max_id is not None:
+                cursor.hint([("_id", pymongo.ASCENDING)])
+            if lower is not None:
+                cursor.min([("_id", lower)])
+            if max_id is not None:
+                cursor.max([("_id", max_id)])
+            if self.dump_batch_size:
+                cursor.batch_size(self.dump_batch_size)
+            # The lower bound is inclusive
+            skip_id = last_id
+            try:
+                for doc in cursor:
+                    if not self.running:
+                        return
+                    if skip_id is not None:
+                        first_id, skip_id = skip_id, None
+                        if doc["_id"] == first_id:
+                            continue
+                    last_doc = doc
+                    dumped += 1
+                    yield doc
+                break
+            except pymongo.errors.AutoReconnect:
+                attempts += 1
+                time.sleep(1)
+            finally:
+                registry.incr('dump.documents', namespace, dumped)
+                dumped = 0
 
     def get_last_oplog_timestamp(self):
         """Return the timestamp of the latest entry in the oplog.
         """
-        if not self.namespace_set:
+        ns_condition = self._namespace_filter.query()
+        if ns_condition is None:
             curr = self.oplog.find().sort(
                 '$natural', pymongo.DESCENDING
             ).limit(1)
         else:
             curr = self.oplog.find(
-                {'ns': {'$in': self.namespace_set}}
+                {'ns': ns_condition}
             ).sort('$natural', pymongo.DESCENDING).limit(1)
 
-        if curr.count(with_limit_and_skip=True) == 0:
+        try:
+            ts = next(curr)['ts']
+        except StopIteration:
             return None
 
         logging.debug("OplogThread: Last oplog entry has timestamp %d."
-                      % curr[0]['ts'].time)
-        return curr[0]['ts']
+                      % ts.time)
+        return ts
 
     def init_cursor(self):
         """Position the cursor appropriately.
@@ -541,7 +1459,13 @@ class OplogThread(threading.Thread):
         logging.debug("OplogThread: Initializing the oplog cursor.")
         timestamp = self.read_last_checkpoint()
 
-        if timestamp is None and self.collection_dump:
+        if self._dumper is not None:
+            # Keep tailing where we were while the dump goes on
+            timestamp = self.checkpoint
+        elif timestamp is None and self.collection_dump and \
+                self.concurrent_dump:
+            timestamp = self.start_dump()
+        elif timestamp is None and self.collection_dump:
             timestamp = self.dump_collection()
             if timestamp:
                 msg = "Dumped collection into target system"
@@ -552,9 +1476,15 @@ class OplogThread(threading.Thread):
             timestamp = retry_until_ok(self.get_last_oplog_timestamp)
 
         self.checkpoint = timestamp
+        if self.journal is not None and timestamp is not None:
+            if not self.journal.start(str(self.oplog),
+                                      util.bson_ts_to_long(timestamp)):
+                self._journal_restarted = True
         cursor = self.get_oplog_cursor(timestamp)
-        if cursor is not None:
+        if cursor is not None and self._dumper is None:
             self.update_checkpoint()
+            # The dump is over once tailing starts from its timestamp
+            self.update_dump_progress(None)
 
         return cursor
 
@@ -589,26 +1519,42 @@ class OplogThread(threading.Thread):
         the largest timestamp in the oplog less than the latest target system
         timestamp. This defines the rollback window and we just roll these
         back until the oplog and target system are in consistent states.
+
+        With a journal, the last timestamp handed to the target systems and
+        the documents touched during the window are looked up in the
+        journal instead, provided it covers the whole window. That isn't
+        done if the journal started over during this run, since the targets
+        may have applied operations it never recorded.
         """
-        # Find the most recently inserted document in each target system
         logging.debug("OplogThread: Initiating rollback sequence to bring "
                       "system into a consistent state.")
-        last_docs = []
+        rollback_started = time.time()
+        oplog_name = str(self.oplog)
         for dm in self.doc_managers:
             dm.commit()
-            last_docs.append(dm.get_last_doc())
-
-        # Of these documents, which is the most recent?
-        last_inserted_doc = max(last_docs,
-                                key=lambda x: x["_ts"] if x else float("-inf"))
 
-        # Nothing has been replicated. No need to rollback target systems
-        if last_inserted_doc is None:
-            return None
+        journal = None
+        if self.journal is not None and not self._journal_restarted:
+            journal = self.journal
+        end_ts = None
+        if journal is not None:
+            end_ts = journal.last_ts(oplog_name)
+        if end_ts is None:
+            # Find the most recently inserted document in each target system
+            last_docs = [dm.get_last_doc() for dm in self.doc_managers]
+
+            # Of these documents, which is the most recent?
+            last_inserted_doc = max(
+                last_docs, key=lambda x: x["_ts"] if x else float("-inf"))
+
+            # Nothing has been replicated. No need to rollback target systems
+            if last_inserted_doc is None:
+                return None
+            end_ts = last_inserted_doc['_ts']
 
         # Find the oplog entry that touched the most recent document.
         # We'll use this to figure where to pick up the oplog later.
-        target_ts = util.long_to_bson_ts(last_inserted_doc['_ts'])
+        target_ts = util.long_to_bson_ts(end_ts)
         last_oplog_entry = util.retry_until_ok(
             self.oplog.find_one,
             {'ts': {'$lte': target_ts}},
@@ -626,93 +1572,240 @@ class OplogThread(threading.Thread):
         # rollback_cutoff_ts happened *before* the rollback
         rollback_cutoff_ts = last_oplog_entry['ts']
         start_ts = util.bson_ts_to_long(rollback_cutoff_ts)
-        # timestamp of the most recent document on any target system
-        end_ts = last_inserted_doc['_ts']
 
-        for dm in self.doc_managers:
-            rollback_set = {}   # this is a dictionary of ns:list of docs
+        if journal is not None and journal.covers(oplog_name, start_ts):
+            logging.info("OplogThread: Rollback, looking up documents in "
+                         "the journal")
+            search = partial(journal.search, oplog_name)
+        else:
+            search = None
 
-            # group potentially conflicted documents by namespace
-            for doc in dm.search(start_ts, end_ts):
-                if doc['ns'] in rollback_set:
-                    rollback_set[doc['ns']].append(doc)
-                else:
-                    rollback_set[doc['ns']] = [doc]
-
-            # retrieve these documents from MongoDB, either updating
-            # or removing them in each target system
-            for namespace, doc_list in rollback_set.items():
-                # Get the original namespace
-                original_namespace = namespace
-                for source_name, dest_name in self.dest_mapping.items():
-                    if dest_name == namespace:
-                        original_namespace = source_name
-
-                database, coll = original_namespace.split('.', 1)
-                obj_id = bson.objectid.ObjectId
-                bson_obj_id_list = [obj_id(doc['_id']) for doc in doc_list]
-
-                to_update = util.retry_until_ok(
-                    self.main_connection[database][coll].find,
-                    {'_id': {'$in': bson_obj_id_list}},
-                    fields=self._fields
-                )
-                #doc list are docs in target system, to_update are
-                #docs in mongo
-                doc_hash = {}  # hash by _id
-                for doc in doc_list:
-                    doc_hash[bson.objectid.ObjectId(doc['_id'])] = doc
-
-                to_index = []
-
-                def collect_existing_docs():
-                    for doc in to_update:
-                        if doc['_id'] in doc_hash:
-                            del doc_hash[doc['_id']]
-                            to_index.append(doc)
-                retry_until_ok(collect_existing_docs)
-
-                #delete the inconsistent documents
-                logging.debug("OplogThread: Rollback, removing inconsistent "
-                              "docs.")
-                remov_inc = 0
-                for doc in doc_hash.values():
-                    try:
-                        dm.remove(doc)
-                        remov_inc += 1
-                        logging.debug("OplogThread: Rollback, removed %s " %
-                                      str(doc))
-                    except errors.OperationFailed:
-                        logging.warning(
-                            "Could not delete document during rollback: %s "
-                            "This can happen if this document was already "
-                            "removed by another rollback happening at the "
-                            "same time." % str(doc)
-                        )
-
-                logging.debug("OplogThread: Rollback, removed %d docs." %
-                              remov_inc)
-
-                #insert the ones from mongo
-                logging.debug("OplogThread: Rollback, inserting documents "
-                              "from mongo.")
-                insert_inc = 0
-                fail_insert_inc = 0
-                for doc in to_index:
-                    doc['_ts'] = util.bson_ts_to_long(rollback_cutoff_ts)
-                    doc['ns'] = self.dest_mapping.get(namespace, namespace)
-                    try:
-                        insert_inc += 1
-                        dm.upsert(doc)
-                    except errors.OperationFailed as e:
-                        fail_insert_inc += 1
-                        logging.error("OplogThread: Rollback, Unable to "
-                                      "insert %s with exception %s"
-                                      % (doc, str(e)))
+        # Reconcile every target at once, each in its own thread
+        counts = [(0, 0)] * len(self.doc_managers)
+        failures = queue.Queue()
+
+        def rollback_target(index):
+            try:
+                counts[index] = self._rollback_target(
+                    self.doc_managers[index], self.rollback_workers[index],
+                    start_ts, end_ts, rollback_cutoff_ts, search)
+            except Exception:
+                failures.put(sys.exc_info())
+
+        if len(self.doc_managers) == 1:
+            rollback_target(0)
+        else:
+            threads = [threading.Thread(target=rollback_target, args=(i,))
+                       for i in range(len(self.doc_managers))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        if not failures.empty():
+            raise failures.get()[1]
+        inserted = sum(count[0] for count in counts)
+        failed = sum(count[1] for count in counts)
 
         logging.debug("OplogThread: Rollback, Successfully inserted %d "
                       " documents and failed to insert %d"
                       " documents.  Returning a rollback cutoff time of %s "
-                      % (insert_inc, fail_insert_inc, str(rollback_cutoff_ts)))
+                      % (inserted, failed, str(rollback_cutoff_ts)))
+        registry.observe('rollback.duration', time.time() - rollback_started,
+                         bounds=TIMING_BUCKETS)
 
         return rollback_cutoff_ts
+
+    def _rollback_target(self, dm, workers, start_ts, end_ts,
+                         rollback_cutoff_ts, search=None):
+        """Bring the documents a single target system holds from the
+        rollback window, between start_ts and end_ts, back in line with
+        MongoDB. Returns the number of documents re-inserted and of those
+        that failed to be.
+
+        The documents are found with search(start_ts, end_ts), which
+        defaults to the search method of the target. They are grouped by
+        namespace as they stream in, and reconciled ROLLBACK_CHUNK_SIZE at
+        a time by up to workers threads.
+        """
+        key = dm.__class__.__module__
+        if search is None:
+            search = dm.search
+        counts = [0, 0]
+        counts_lock = threading.Lock()
+
+        def chunks():
+            pending = {}
+            with registry.timer('docmanager.search', key):
+                docs = iter(search(start_ts, end_ts))
+            for doc in docs:
+                # Documents last written at the cutoff are consistent, and
+                # include those re-inserted by this rollback
+                if doc['_ts'] <= start_ts:
+                    continue
+                doc_list = pending.setdefault(doc['ns'], [])
+                doc_list.append(doc)
+                if len(doc_list) >= ROLLBACK_CHUNK_SIZE:
+                    yield doc['ns'], pending.pop(doc['ns'])
+            for namespace, doc_list in pending.items():
+                yield namespace, doc_list
+
+        def reconcile(namespace, doc_list):
+            inserted, failed = self._rollback_chunk(dm, namespace, doc_list,
+                                                    rollback_cutoff_ts)
+            with counts_lock:
+                counts[0] += inserted
+                counts[1] += failed
+
+        if workers <= 1:
+            for namespace, doc_list in chunks():
+                reconcile(namespace, doc_list)
+            return tuple(counts)
+
+        # Chunks wait in a bounded queue, so that the search is read no
+        # faster than the workers reconcile it
+        tasks = queue.Queue(maxsize=workers)
+        failures = queue.Queue()
+
+        def rollback_worker():
+            while True:
+                task = tasks.get()
+                if task is None:
+                    return
+                # Drain the queue without doing anything once a chunk failed
+                if not failures.empty():
+                    continue
+                try:
+                    reconcile(*task)
+                except Exception:
+                    failures.put(sys.exc_info())
+
+        threads = [threading.Thread(target=rollback_worker)
+                   for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            for task in chunks():
+                if not failures.empty():
+                    break
+                tasks.put(task)
+        finally:
+            for _ in threads:
+                tasks.put(None)
+            for thread in threads:
+                thread.join()
+
+        if not failures.empty():
+            raise failures.get()[1]
+        return tuple(counts)
+
+    def _source_id(self, doc_id):
+        """Return the _id in MongoDB of a document from a target system.
+        Targets that only store strings hold ObjectIds in their string form.
+        """
+        if isinstance(doc_id, string_types):
+            return bson.objectid.ObjectId(doc_id)
+        return doc_id
+
+    def _rollback_chunk(self, dm, namespace, doc_list, rollback_cutoff_ts):
+        """Reconcile documents from a namespace of a target system with
+        MongoDB: documents that are gone from MongoDB are removed, and the
+        others are re-inserted as they are in MongoDB. Returns the number
+        of documents re-inserted and of those that failed to be.
+
+        The documents are looked up with a single query, then removed and
+        re-inserted with one call to bulk_apply, if the target supports it.
+        Should that fail, or if it doesn't, they are handled one at a time,
+        to find out which ones fail.
+        """
+        key = dm.__class__.__module__
+
+        # Get the original namespace
+        original_namespace = namespace
+        for source_name, dest_name in self.dest_mapping.items():
+            if dest_name == namespace:
+                original_namespace = source_name
+
+        database, coll = original_namespace.split('.', 1)
+        bson_obj_id_list = [self._source_id(doc['_id']) for doc in doc_list]
+
+        to_update = util.retry_until_ok(
+            util.find,
+            self._source_database(database)[coll],
+            {'_id': {'$in': bson_obj_id_list}},
+            fields=self._fields
+        )
+        #doc list are docs in target system, to_update are
+        #docs in mongo
+        doc_hash = {}  # hash by _id
+        for doc, doc_id in zip(doc_list, bson_obj_id_list):
+            doc_hash[doc_id] = doc
+
+        to_index = []
+
+        def collect_existing_docs():
+            for doc in to_update:
+                if doc['_id'] in doc_hash:
+                    del doc_hash[doc['_id']]
+                    to_index.append(doc)
+        retry_until_ok(collect_existing_docs)
+
+        for doc in to_index:
+            doc['_ts'] = util.bson_ts_to_long(rollback_cutoff_ts)
+            doc['ns'] = self.dest_mapping.get(namespace, namespace)
+
+        logging.debug("OplogThread: Rollback, removing %d inconsistent docs "
+                      "and inserting %d documents from mongo."
+                      % (len(doc_hash), len(to_index)))
+        operations = [('d', doc, None) for doc in doc_hash.values()]
+        operations.extend(('i', doc, None) for doc in to_index)
+        if not operations:
+            return 0, 0
+        if hasattr(dm, "bulk_apply"):
+            try:
+                with registry.timer('docmanager.bulk_apply', key):
+                    dm.bulk_apply(operations)
+            except (errors.OperationFailed, errors.ConnectionFailed):
+                logging.warning("OplogThread: Rollback, could not apply %d "
+                                "operations at once, applying them one at "
+                                "a time." % len(operations))
+            else:
+                registry.incr('rollback.removed', namespace, len(doc_hash))
+                registry.incr('rollback.reinserted', namespace,
+                              len(to_index))
+                return len(to_index), 0
+
+        #delete the inconsistent documents
+        remov_inc = 0
+        for doc in doc_hash.values():
+            try:
+                with registry.timer('docmanager.remove', key):
+                    dm.remove(doc)
+                remov_inc += 1
+            except errors.OperationFailed:
+                logging.warning(
+                    "Could not delete document during rollback: %s "
+                    "This can happen if this document was already "
+                    "removed by another rollback happening at the "
+                    "same time." % str(doc)
+                )
+
+        logging.debug("OplogThread: Rollback, removed %d docs." %
+                      remov_inc)
+        registry.incr('rollback.removed', namespace, remov_inc)
+
+        #insert the ones from mongo
+        insert_inc = 0
+        fail_insert_inc = 0
+        for doc in to_index:
+            try:
+                with registry.timer('docmanager.upsert', key):
+                    dm.upsert(doc)
+                insert_inc += 1
+                registry.incr('rollback.reinserted', namespace)
+            except errors.OperationFailed as e:
+                fail_insert_inc += 1
+                registry.incr('rollback.failed', namespace)
+                logging.error("OplogThread: Rollback, Unable to "
+                              "insert %s with exception %s"
+                              % (doc, str(e)))
+        return insert_inc, fail_insert_inc
@@ -0,0 +1,74 @@
+# Copyright 2013-2014 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Holds operations in memory, spilling them to disk past a limit
+"""
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import tempfile
+
+from mongo_connector.constants import DEFAULT_SPILL_THRESHOLD
+
+
+class SpillBuffer(object):
+    """An append-only sequence of operations.
+
+    The first max_memory operations are kept in memory. Further operations
+    are pickled into a temporary file, which is deleted once the buffer is
+    closed. Iterating over the buffer yields every operation in the order
+    they were appended.
+    """
+
+    def __init__(self, max_memory=DEFAULT_SPILL_THRESHOLD):
+        self.max_memory = max_memory
+        self._memory = []
+        self._file = None
+        self._spilled = 0
+
+    def __len__(self):
+        return len(self._memory) + self._spilled
+
+    def append(self, operation):
+        """Add an operation at the end of the buffer.
+        """
+        if len(self._memory) < self.max_memory:
+            self._memory.append(operation)
+            return
+        if self._file is None:
+            self._file = tempfile.TemporaryFile()
+        pickle.dump(operation, self._file, pickle.HIGHEST_PROTOCOL)
+        self._spilled += 1
+
+    def __iter__(self):
+        for operation in self._memory:
+            yield operation
+        if self._file is None:
+            return
+        self._file.flush()
+        self._file.seek(0)
+        for _ in range(self._spilled):
+            yield pickle.load(self._file)
+        self._file.seek(0, 2)
+
+    def close(self):
+        """Discard every operation, and delete the temporary file if any.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._memory = []
+        self._spilled = 0
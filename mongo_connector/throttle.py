@@ -0,0 +1,108 @@
+# Copyright 2013-2014 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Limits the rate documents are read and written at
+"""
+
+import threading
+import time
+
+from mongo_connector.metrics import TIMING_BUCKETS, registry
+
+
+class TokenBucket(object):
+    """Hands out up to rate tokens per second, with bursts of up to one
+    second's worth.
+
+    Taking more tokens than are available puts the bucket in debt, which
+    later callers wait for as well, so the average rate holds even when
+    tokens are taken in large amounts.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.time()
+
+    def take(self, amount):
+        """Take amount tokens, and return how many seconds to wait for them
+        to be available.
+        """
+        now = time.time()
+        self.tokens = min(self.rate,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+
+class Throttle(object):
+    """Limits a flow of documents to a number of documents per second and a
+    number of megabytes per second, either of which may be None for no
+    limit.
+
+    The limits may be changed at any time with set_rates, and apply to all
+    the threads sharing the throttle. Every time a caller has to wait, the
+    'throttle.waits' counter and the 'throttle.wait_time' histogram are
+    updated in the metrics registry, keyed by the name of the throttle.
+    """
+
+    def __init__(self, name, docs_per_sec=None, mb_per_sec=None):
+        self.name = name
+        self._lock = threading.Lock()
+        self.set_rates(docs_per_sec, mb_per_sec)
+
+    def set_rates(self, docs_per_sec=None, mb_per_sec=None):
+        """Change the limits, dropping any debt accumulated so far.
+        """
+        with self._lock:
+            self.docs_per_sec = docs_per_sec
+            self.mb_per_sec = mb_per_sec
+            self._docs = self._bytes = None
+            if docs_per_sec:
+                self._docs = TokenBucket(float(docs_per_sec))
+            if mb_per_sec:
+                self._bytes = TokenBucket(mb_per_sec * 1024.0 * 1024.0)
+
+    def __bool__(self):
+        """True if there is any limit.
+        """
+        return self._docs is not None or self._bytes is not None
+
+    __nonzero__ = __bool__
+
+    @property
+    def limits_bytes(self):
+        """True if there is a limit on megabytes per second, so callers need
+        to work out the size of the documents.
+        """
+        return self._bytes is not None
+
+    def consume(self, docs, num_bytes=0):
+        """Account for docs documents taking num_bytes bytes, blocking as
+        long as necessary to stay within the limits.
+        """
+        with self._lock:
+            wait = 0
+            if self._docs is not None:
+                wait = self._docs.take(docs)
+            if self._bytes is not None:
+                wait = max(wait, self._bytes.take(num_bytes))
+        if wait > 0:
+            registry.incr('throttle.waits', self.name)
+            registry.observe('throttle.wait_time', wait, key=self.name,
+                             bounds=TIMING_BUCKETS)
+            time.sleep(wait)
@@ -18,8 +18,13 @@
 import time
 import logging
 
+import bson
+import pymongo
 from bson.timestamp import Timestamp
 
+from mongo_connector.constants import (DEFAULT_RETRY_BACKOFF,
+                                       DEFAULT_RETRY_BACKOFF_MAX)
+
 
 def bson_ts_to_long(timestamp):
     """Convert BSON timestamp into integer.
@@ -38,6 +43,128 @@ def long_to_bson_ts(val):
 
     return Timestamp(seconds, increment)
 
+# The read preference modes, by name, and the names of the matching
+# PyMongo 2 ReadPreference constants
+READ_PREFERENCE_MODES = {
+    'primary': 'PRIMARY',
+    'primaryPreferred': 'PRIMARY_PREFERRED',
+    'secondary': 'SECONDARY',
+    'secondaryPreferred': 'SECONDARY_PREFERRED',
+    'nearest': 'NEAREST'
+}
+
+
+def bson_size(doc):
+    """Return the size in bytes of a document encoded as BSON.
+    """
+    raw = getattr(doc, "raw", None)
+    if raw is not None:
+        return len(raw)
+    return len(bson.BSON.encode(doc))
+
+
+def decode_raw(doc):
+    """Fully decode a document read as raw BSON into a dict. Documents
+    that were already decoded are returned as they are.
+    """
+    raw = getattr(doc, "raw", None)
+    if raw is None:
+        return doc
+    return bson.BSON(raw).decode()
+
+
+def buffered_count(cursor):
+    """Return the number of documents a cursor has received from the server
+    and not returned yet, or None if the driver doesn't let us know.
+
+    Once it is 0, the next document read waits for a getMore.
+    """
+    # PyMongo has no public way to tell. Its Cursor keeps the current batch
+    # in a private deque, Cursor.__data, as checked against PyMongo 2.8 and
+    # 3.12. Should another release rename it, we get None rather than a
+    # wrong count.
+    buffered = getattr(cursor, '_Cursor__data', None)
+    if buffered is None:
+        return None
+    return len(buffered)
+
+
+def find(collection, spec=None, fields=None, tailable=False,
+         await_data=False, exhaust=False, **kwargs):
+    """Call collection.find with the arguments PyMongo 2 takes, translated
+    for PyMongo 3, which renamed fields to projection and replaced the
+    tailable, await_data and exhaust flags with a cursor type.
+
+    exhaust must only be set if supports_exhaust allows it.
+    """
+    if pymongo.version_tuple[0] < 3:
+        if exhaust:
+            kwargs['exhaust'] = True
+        return collection.find(spec, fields=fields, tailable=tailable,
+                               await_data=await_data, **kwargs)
+    from pymongo.cursor import CursorType
+    if tailable and await_data:
+        kwargs['cursor_type'] = CursorType.TAILABLE_AWAIT
+    elif tailable:
+        kwargs['cursor_type'] = CursorType.TAILABLE
+    elif exhaust:
+        kwargs['cursor_type'] = CursorType.EXHAUST
+    return collection.find(spec, projection=fields, **kwargs)
+
+
+def supports_exhaust(client):
+    """Return True if exhaust cursors can be read through client.
+
+    PyMongo handles them from version 2.7, but not through mongos, and
+    PyMongo 2 not through a MongoReplicaSetClient either.
+    """
+    if pymongo.version_tuple[:2] < (2, 7):
+        return False
+    if (pymongo.version_tuple[0] < 3 and
+            isinstance(client, pymongo.MongoReplicaSetClient)):
+        return False
+    return not client.is_mongos
+
+
+def replica_set_client(host, replica_set, read_preference=None):
+    """Return a client connected to a replica set, able to read from the
+    members selected by the read preference mode called read_preference, if
+    given, rather than only from the primary.
+
+    PyMongo 2 only honors read preferences through a MongoReplicaSetClient,
+    so that is the client it gets if reads may go to other members.
+    """
+    if (read_preference in (None, 'primary') or
+            pymongo.version_tuple[0] >= 3):
+        return pymongo.MongoClient(host, replicaSet=replica_set)
+    return pymongo.MongoReplicaSetClient(host, replicaSet=replica_set)
+
+
+def get_database(client, name, read_preference=None, tag_sets=None):
+    """Return the database called name, read from with the read preference
+    mode called read_preference, e.g. 'secondaryPreferred', and the given
+    tag sets. The client's own read preference is used if read_preference
+    is None.
+
+    With PyMongo 2, the read preference only has an effect if client is
+    connected to mongos, or is a client from replica_set_client.
+    """
+    if read_preference is None:
+        return client[name]
+    if pymongo.version_tuple[0] >= 3:
+        from pymongo.read_preferences import (make_read_preference,
+                                              read_pref_mode_from_name)
+        mode = read_pref_mode_from_name(read_preference)
+        return client.get_database(
+            name, read_preference=make_read_preference(mode, tag_sets))
+    from pymongo.read_preferences import ReadPreference
+    database = client[name]
+    database.read_preference = getattr(
+        ReadPreference, READ_PREFERENCE_MODES[read_preference])
+    if tag_sets:
+        database.tag_sets = tag_sets
+    return database
+
 
 def retry_until_ok(func, *args, **kwargs):
     """Retry code block until it succeeds.
@@ -58,3 +185,26 @@ def retry_until_ok(func, *args, **kwargs):
                               'retry_until_ok', func)
                 raise
             time.sleep(1)
+
+
+class Backoff(object):
+    """Waits an exponentially growing, bounded time between attempts at
+    something that keeps failing.
+    """
+
+    def __init__(self, initial=DEFAULT_RETRY_BACKOFF,
+                 maximum=DEFAULT_RETRY_BACKOFF_MAX):
+        self.initial = initial
+        self.maximum = maximum
+        self.delay = initial
+
+    def sleep(self):
+        """Wait before the next attempt, and double the next wait.
+        """
+        time.sleep(self.delay)
+        self.delay = min(self.delay * 2, self.maximum)
+
+    def reset(self):
+        """Go back to the initial wait after a successful attempt.
+        """
+        self.delay = self.initial
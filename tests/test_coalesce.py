@@ -0,0 +1,128 @@
+# Copyright 2013-2014 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests methods in coalesce.py
+"""
+
+import sys
+
+sys.path[0:0] = [""]
+
+if sys.version_info[:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+from mongo_connector.coalesce import coalesce
+
+
+def doc(_id, ts, ns='test.test', **fields):
+    fields.update({'_id': _id, '_ts': ts, 'ns': ns})
+    return fields
+
+
+class CoalesceTester(unittest.TestCase):
+    """Tests collapsing operations on the same document
+    """
+
+    def test_insert_and_updates(self):
+        """Updates to an inserted document collapse into one upsert
+        """
+        result = coalesce([
+            ('i', doc(1, 1, a=1, b={'c': 1}), None),
+            ('u', doc(1, 2), {'$set': {'a': 2, 'b.c': 2}}),
+            ('u', doc(1, 3), {'$unset': {'a': True}})
+        ])
+        self.assertEqual(result, [('i', doc(1, 3, b={'c': 2}), None)])
+
+    def test_insert_and_remove(self):
+        """A removal supersedes everything that came before it
+        """
+        result = coalesce([
+            ('i', doc(1, 1, a=1), None),
+            ('u', doc(1, 2), {'$set': {'a': 2}}),
+            ('d', doc(1, 3), None)
+        ])
+        self.assertEqual(result, [('d', doc(1, 3), None)])
+
+    def test_remove_and_insert(self):
+        result = coalesce([
+            ('d', doc(1, 1), None),
+            ('i', doc(1, 2, a=1), None)
+        ])
+        self.assertEqual(result, [('i', doc(1, 2, a=1), None)])
+
+    def test_merge_sets(self):
+        """Repeated $set and $unset updates are merged
+        """
+        result = coalesce([
+            ('u', doc(1, 1), {'$set': {'a': 1, 'b.c': 1}}),
+            ('u', doc(1, 2), {'$set': {'a': 2}, '$unset': {'d': True}}),
+            ('u', doc(1, 3), {'$set': {'b': {'c': 3}, 'd': 3}})
+        ])
+        self.assertEqual(result, [
+            ('u', doc(1, 3), {'$set': {'a': 2, 'b': {'c': 3}, 'd': 3}})
+        ])
+
+    def test_conflicting_sets(self):
+        """Updates to a field inside one updated earlier are not merged
+        """
+        operations = [
+            ('u', doc(1, 1), {'$set': {'b': {'c': 1}}}),
+            ('u', doc(1, 2), {'$set': {'b.c': 2}})
+        ]
+        self.assertEqual(coalesce(operations), operations)
+
+    def test_replacement(self):
+        """A whole-document update supersedes earlier updates, and absorbs
+        later ones
+        """
+        result = coalesce([
+            ('u', doc(1, 1), {'$set': {'a': 1}}),
+            ('u', doc(1, 2), {'_id': 1, 'b': 2}),
+            ('u', doc(1, 3), {'$set': {'c': 3}})
+        ])
+        self.assertEqual(result, [
+            ('u', doc(1, 3), {'_id': 1, 'b': 2, 'c': 3})
+        ])
+
+    def test_documents_independent(self):
+        """Operations on different documents are kept apart, in the order
+        the documents were first seen
+        """
+        result = coalesce([
+            ('i', doc(1, 1), None),
+            ('i', doc(2, 2), None),
+            ('i', doc(1, 3, ns='test.other'), None),
+            ('u', doc(1, 4), {'$set': {'a': 4}}),
+            ('d', doc(2, 5), None)
+        ])
+        self.assertEqual(result, [
+            ('i', doc(1, 4, a=4), None),
+            ('d', doc(2, 5), None),
+            ('i', doc(1, 3, ns='test.other'), None)
+        ])
+
+    def test_update_after_remove(self):
+        """Updates to a removed document are kept as they are
+        """
+        operations = [
+            ('d', doc(1, 1), None),
+            ('u', doc(1, 2), {'$set': {'a': 2}})
+        ]
+        self.assertEqual(coalesce(operations), operations)
+
+
+if __name__ == '__main__':
+    unittest.main()
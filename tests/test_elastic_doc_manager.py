@@ -15,6 +15,7 @@
 """Tests each of the functions in elastic_doc_manager
 """
 
+import json
 import time
 import sys
 if sys.version_info[:2] == (2, 6):
@@ -100,6 +101,30 @@ class ElasticDocManagerTester(ElasticsearchTestCase):
         for i, r in enumerate(returned_ids):
             self.assertEqual(r, 2*i)
 
+    def test_bulk_export(self):
+        """Ensure exported documents are _bulk requests that index them
+        like bulk_upsert does.
+        """
+        docs = [{"_id": i, "ns": "test.test", "a": i} for i in range(3)]
+        body = self.elastic_doc.bulk_export(docs)
+        self.assertTrue(body.endswith("\n"))
+        lines = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(len(lines), 6)
+        for i in range(3):
+            self.assertEqual(lines[2 * i], {"index": {
+                "_index": "test.test", "_type": self.elastic_doc.doc_type,
+                "_id": str(i)}})
+            self.assertEqual(lines[2 * i + 1],
+                             {"_id": str(i), "ns": "test.test", "a": i})
+
+        self.elastic_conn.bulk(body=body, refresh=True)
+        res = self.elastic_conn.search(
+            index="test.test",
+            body={"query": {"match_all": {}}}
+        )["hits"]["hits"]
+        self.assertEqual(sorted(doc["_source"]["a"] for doc in res),
+                         [0, 1, 2])
+
     def test_remove(self):
         """Ensure we can properly delete from ElasticSearch via DocManager.
         """
@@ -0,0 +1,96 @@
+# Copyright 2013-2014 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests methods in export.py
+"""
+
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path[0:0] = [""]
+
+if sys.version_info[:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+from mongo_connector import errors
+from mongo_connector.doc_managers.doc_manager_simulator import DocManager
+from mongo_connector.export import Exporter
+
+
+class JSONDocManager(DocManager):
+    """Exports documents as a JSON list of their _id
+    """
+
+    export_format = 'json'
+
+    def bulk_export(self, docs):
+        return json.dumps([doc["_id"] for doc in docs])
+
+
+class ExporterTester(unittest.TestCase):
+    """Tests writing documents to bulk files
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, name):
+        with gzip.open(os.path.join(self.directory, name)) as export:
+            return json.loads(export.read().decode("utf-8"))
+
+    def test_unsupported(self):
+        """Targets without a bulk format can't be exported to
+        """
+        self.assertRaises(errors.ConnectorError,
+                          Exporter, DocManager(), self.directory)
+
+    def test_chunks(self):
+        """Documents are split into files of at most chunk_size documents
+        """
+        exporter = Exporter(JSONDocManager(), self.directory, chunk_size=2)
+        exporter.bulk_upsert({"_id": i, "ns": "test.test"} for i in range(5))
+        exporter.upsert({"_id": 5, "ns": "test.other"})
+        self.assertEqual(sorted(os.listdir(self.directory)), [
+            "test.other.000004.json.gz",
+            "test.test.000001.json.gz",
+            "test.test.000002.json.gz",
+            "test.test.000003.json.gz"])
+        self.assertEqual(self.read("test.test.000001.json.gz"), [0, 1])
+        self.assertEqual(self.read("test.test.000003.json.gz"), [4])
+        self.assertEqual(self.read("test.other.000004.json.gz"), [5])
+
+    def test_resume(self):
+        """A new exporter numbers its files after the existing ones
+        """
+        exporter = Exporter(JSONDocManager(), self.directory)
+        exporter.bulk_upsert([{"_id": 0, "ns": "test.test"}])
+        exporter = Exporter(JSONDocManager(), self.directory)
+        exporter.bulk_upsert([{"_id": 1, "ns": "test.test"}])
+        self.assertEqual(sorted(os.listdir(self.directory)), [
+            "test.test.000001.json.gz",
+            "test.test.000002.json.gz"])
+        self.assertEqual(self.read("test.test.000002.json.gz"), [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+# Copyright 2013-2014 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests methods in journal.py
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path[0:0] = [""]
+
+if sys.version_info[:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+from bson.objectid import ObjectId
+
+from mongo_connector import journal
+from mongo_connector.journal import Journal
+
+
+def ts(seconds, inc=0):
+    return (seconds << 32) + inc
+
+
+def operation(op, doc_id, seconds, ns="test.test"):
+    return op, {"_id": doc_id, "ns": ns, "_ts": ts(seconds)}, None
+
+
+class JournalTester(unittest.TestCase):
+    """Tests recording operations and looking them up
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.journal = Journal(os.path.join(self.directory, "journal.db"))
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.directory)
+
+    def test_search(self):
+        """Search returns each document touched in the window once, with
+        the timestamp of its last operation
+        """
+        oid = ObjectId()
+        self.journal.start("oplog", ts(1))
+        self.journal.record("oplog", ts(3), [
+            operation("i", oid, 2), operation("i", 1, 2),
+            operation("u", oid, 3)])
+        self.journal.record("oplog", ts(5), [
+            operation("d", "a", 4, ns="test.other"),
+            operation("u", 1, 5)])
+        self.journal.record("other", ts(5), [operation("i", 2, 4)])
+
+        docs = sorted(self.journal.search("oplog", ts(3), ts(4)),
+                      key=lambda doc: doc["_ts"])
+        self.assertEqual(docs, [
+            {"_id": oid, "ns": "test.test", "_ts": ts(3)},
+            {"_id": "a", "ns": "test.other", "_ts": ts(4)}])
+        self.assertEqual(self.journal.last_ts("oplog"), ts(5))
+        self.assertEqual(self.journal.last_ts("unknown"), None)
+
+    def test_coverage(self):
+        """The journal covers the operations after the timestamp it started
+        at, unless operations may have been missed since
+        """
+        self.assertFalse(self.journal.covers("oplog", ts(5)))
+        self.assertFalse(self.journal.start("oplog", ts(2)))
+        self.assertTrue(self.journal.covers("oplog", ts(2)))
+        self.assertFalse(self.journal.covers("oplog", ts(1)))
+        self.journal.record("oplog", ts(4), [operation("i", 1, 4)])
+
+        # Restarting from a recorded timestamp keeps the coverage
+        self.assertTrue(self.journal.start("oplog", ts(3)))
+        self.assertTrue(self.journal.covers("oplog", ts(2)))
+        # Restarting after the last recorded timestamp resets it
+        self.assertFalse(self.journal.start("oplog", ts(6)))
+        self.assertFalse(self.journal.covers("oplog", ts(5)))
+        self.assertTrue(self.journal.covers("oplog", ts(6)))
+
+    def test_trim(self):
+        """Records beyond the age and size limits are dropped
+        """
+        self.journal.close()
+        self.journal = Journal(os.path.join(self.directory, "trim.db"),
+                               max_age=50, max_size=80)
+        self.journal.start("oplog", ts(0))
+        for seconds in range(1, journal.TRIM_INTERVAL + 1):
+            self.journal.record("oplog", ts(seconds),
+                                [operation("i", seconds, seconds)])
+        docs = list(self.journal.search("oplog", 0, ts(1000)))
+        self.assertEqual(len(docs), 51)
+        self.assertTrue(self.journal.covers("oplog", ts(50)))
+        self.assertFalse(self.journal.covers("oplog", ts(49)))
+
+        self.journal.max_age = 0
+        for seconds in range(101, journal.TRIM_INTERVAL + 101):
+            self.journal.record("oplog", ts(seconds),
+                                [operation("i", seconds, seconds)])
+        docs = list(self.journal.search("oplog", 0, ts(1000)))
+        self.assertEqual(len(docs), 80)
+        self.assertEqual(min(doc["_id"] for doc in docs), 121)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+# Copyright 2013-2014 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests methods in metrics.py
+"""
+
+import sys
+
+sys.path[0:0] = [""]
+
+if sys.version_info[:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+from mongo_connector.metrics import Registry
+
+
+class RegistryTester(unittest.TestCase):
+    """Tests the metrics registry
+    """
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counters(self):
+        """Test incr and incr_all
+        """
+        self.registry.incr('ops', ('i', 'test.test'))
+        self.registry.incr('ops', ('i', 'test.test'), 2)
+        self.registry.incr_all('ops', {('i', 'test.test'): 1,
+                                       ('d', 'test.test'): 4})
+        self.registry.incr('retries')
+        counters = self.registry.snapshot()['counters']
+        self.assertEqual(counters, {
+            'ops': {('i', 'test.test'): 4, ('d', 'test.test'): 4},
+            'retries': {None: 1}
+        })
+
+    def test_histograms(self):
+        """Test observe and timer
+        """
+        for value in (1, 3, 3, 100):
+            self.registry.observe('size', value, bounds=(1, 10))
+        with self.registry.timer('latency', 'docman'):
+            pass
+
+        histograms = self.registry.snapshot()['histograms']
+        self.assertEqual(histograms['size'][None], {
+            'count': 4,
+            'sum': 107,
+            'buckets': [(1, 1), (10, 2), (None, 1)]
+        })
+        self.assertEqual(histograms['latency']['docman']['count'], 1)
+
+    def test_snapshot_is_a_copy(self):
+        self.registry.incr('ops')
+        snapshot = self.registry.snapshot()
+        self.registry.incr('ops')
+        self.assertEqual(snapshot['counters']['ops'][None], 1)
+        self.registry.reset()
+        self.assertEqual(self.registry.snapshot(),
+                         {'counters': {}, 'histograms': {}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -31,6 +31,7 @@ import json
 from mongo_connector.connector import Connector
 from tests import mongo_host
 from tests.setup_cluster import start_replica_set, kill_replica_set
+from bson.objectid import ObjectId
 from bson.timestamp import Timestamp
 from mongo_connector import errors
 from mongo_connector.doc_managers import (
@@ -172,6 +173,19 @@ class TestMongoConnector(unittest.TestCase):
         conn.read_oplog_progress()
         self.assertTrue(oplog_dict['oplog1'], Timestamp(55, 11))
 
+        #the progress of an interrupted dump is read back along with it
+        dump_dict = conn.dump_progress.get_dict()
+        progress = {'ts': 123, 'namespaces': ['test.test'],
+                    'ranges': [{'ns': 'test.test', 'min_id': None,
+                                'max_id': None, 'last_id': ObjectId(),
+                                'done': False}]}
+        dump_dict['oplog2'] = progress
+        conn.write_oplog_progress()
+        del dump_dict['oplog2']
+        conn.read_oplog_progress()
+        self.assertEqual(dump_dict['oplog2'], progress)
+        self.assertFalse('oplog2' in oplog_dict.keys())
+
         os.unlink("temp_config.txt")
 
     def test_many_targets(self):
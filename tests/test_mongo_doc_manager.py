@@ -24,6 +24,11 @@ else:
 
 sys.path[0:0] = [""]
 
+from bson import BSON
+try:
+    from bson.raw_bson import RawBSONDocument
+except ImportError:
+    RawBSONDocument = None
 from mongo_connector.doc_managers.mongo_doc_manager import DocManager
 from pymongo import MongoClient
 
@@ -117,6 +122,44 @@ class MongoDocManagerTester(unittest.TestCase):
         for doc in res:
             self.assertTrue(doc['_id'] == '1' and doc['name'] == 'Paul')
 
+    def test_bulk_upsert_raw(self):
+        """Ensure documents read as raw BSON are upserted into Mongo as is.
+        """
+        docs = [{'_id': i, 'name': 'John'} for i in range(10)]
+        if RawBSONDocument is not None:
+            docs = [RawBSONDocument(BSON.encode(doc)) for doc in docs]
+        self.MongoDoc.bulk_upsert_raw(docs, 'test.test', 5767301236327972865)
+        self.assertEqual(self.mongo.find().count(), 10)
+        for doc in self.mongo.find():
+            self.assertEqual(doc['name'], 'John')
+            self.assertFalse('ns' in doc or '_ts' in doc)
+        results = list(self.MongoDoc.search(5767301236327972865,
+                                            5767301236327972865))
+        self.assertEqual(sorted(doc['_id'] for doc in results),
+                         list(range(10)))
+
+    def test_bulk_apply(self):
+        """Ensure a batch of operations is applied to Mongo in order.
+        """
+
+        ts = 5767301236327972865
+        operations = [
+            ('i', {'_id': '1', 'name': 'John', 'ns': 'test.test', '_ts': ts},
+             None),
+            ('i', {'_id': '2', 'name': 'Paul', 'ns': 'test.test', '_ts': ts},
+             None),
+            ('u', {'_id': '1', 'ns': 'test.test', '_ts': ts + 1},
+             {'$set': {'name': 'Ringo'}}),
+            ('d', {'_id': '2', 'ns': 'test.test', '_ts': ts + 2}, None),
+            ('u', {'_id': '1', 'ns': 'test.test', '_ts': ts + 3},
+             {'_id': '1', 'name': 'George'})
+        ]
+        self.MongoDoc.bulk_apply(operations)
+        res = list(self.mongo.find())
+        self.assertEqual(res, [{'_id': '1', 'name': 'George'}])
+        meta = list(self.mongo_conn['__mongo_connector']['test.test'].find())
+        self.assertEqual([m['_id'] for m in meta], ['1'])
+
     def test_remove(self):
         """Ensure we can properly delete from Mongo via DocManager.
         """
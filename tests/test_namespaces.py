@@ -0,0 +1,84 @@
+# Copyright 2013-2014 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests methods in namespaces.py
+"""
+
+import sys
+
+sys.path[0:0] = [""]
+
+if sys.version_info[:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+from mongo_connector.namespaces import NamespaceFilter
+
+
+class NamespaceFilterTester(unittest.TestCase):
+    """Tests selecting namespaces
+    """
+
+    def test_everything(self):
+        ns_filter = NamespaceFilter()
+        self.assertFalse(ns_filter)
+        self.assertTrue(ns_filter.matches("test.test"))
+        self.assertEqual(ns_filter.names, None)
+        self.assertEqual(ns_filter.query(), None)
+
+    def test_names(self):
+        """Test plain namespaces
+        """
+        ns_filter = NamespaceFilter(["test.test", "test.a+b"], ["test.a+b"])
+        self.assertTrue(ns_filter)
+        self.assertTrue(ns_filter.matches("test.test"))
+        self.assertFalse(ns_filter.matches("test.a+b"))
+        self.assertFalse(ns_filter.matches("test.aab"))
+        self.assertFalse(ns_filter.matches("test.test2"))
+        self.assertEqual(ns_filter.names, ["test.test"])
+        self.assertEqual(ns_filter.query(), {"$in": ["test.test", "test.a+b"],
+                                             "$nin": ["test.a+b"]})
+
+    def test_wildcards(self):
+        """Test namespaces with wildcards
+        """
+        ns_filter = NamespaceFilter(["tenant_*.events", "test.test"],
+                                    ["tenant_old*.*"])
+        self.assertTrue(ns_filter.matches("tenant_1.events"))
+        self.assertTrue(ns_filter.matches("tenant_.events"))
+        self.assertTrue(ns_filter.matches("test.test"))
+        self.assertFalse(ns_filter.matches("tenant_1.events2"))
+        self.assertFalse(ns_filter.matches("tenant_1xevents"))
+        self.assertFalse(ns_filter.matches("tenant_old1.events"))
+        self.assertFalse(ns_filter.matches("other.events"))
+        self.assertEqual(ns_filter.names, None)
+
+        query = ns_filter.query()
+        self.assertEqual(query["$in"][0], "test.test")
+        self.assertTrue(query["$in"][1].match("tenant_2.events"))
+        self.assertFalse(query["$in"][1].match("test.test"))
+        self.assertTrue(query["$nin"][0].match("tenant_old2.events"))
+
+    def test_exclude_only(self):
+        ns_filter = NamespaceFilter(exclude=["test.*"])
+        self.assertTrue(ns_filter)
+        self.assertTrue(ns_filter.matches("other.test"))
+        self.assertFalse(ns_filter.matches("test.test"))
+        self.assertEqual(ns_filter.names, None)
+        self.assertEqual(list(ns_filter.query()), ["$nin"])
+
+
+if __name__ == '__main__':
+    unittest.main()
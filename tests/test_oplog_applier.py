@@ -0,0 +1,166 @@
+# Copyright 2013-2014 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test oplog applier methods
+"""
+
+import sys
+import threading
+import time
+if sys.version_info[:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+sys.path[0:0] = [""]
+
+from mongo_connector.doc_managers.doc_manager_simulator import DocManager
+from mongo_connector.oplog_applier import OplogApplier
+
+
+def insert(_id, ts):
+    return ('i', {'_id': _id, 'ns': 'test.test', '_ts': ts}, None)
+
+
+class TestOplogApplier(unittest.TestCase):
+    """Tests the OplogApplier, using the DocManager simulator as a target
+    """
+
+    def setUp(self):
+        self.acknowledged = []
+        self.docman = DocManager()
+        self.applier = OplogApplier(
+            self.docman, queue_size=2,
+            on_applied=lambda a: self.acknowledged.append(a.checkpoint))
+        self.applier.start()
+
+    def tearDown(self):
+        self.applier.stop()
+
+    def test_apply(self):
+        """Test that queued batches are applied in order, and that the
+        checkpoint only moves past batches that have been applied
+        """
+        release = threading.Event()
+        original_bulk_apply = self.docman.bulk_apply
+
+        def slow_bulk_apply(operations):
+            release.wait()
+            original_bulk_apply(operations)
+
+        self.docman.bulk_apply = slow_bulk_apply
+
+        self.applier.put(1, [insert(1, 1), insert(2, 1)])
+        self.applier.put(2, [insert(1, 2)])
+        self.assertEqual(self.applier.checkpoint, None)
+        self.assertEqual(self.acknowledged, [])
+
+        release.set()
+        self.applier.wait()
+        self.assertEqual(self.applier.checkpoint, 2)
+        self.assertEqual(self.acknowledged[-1], 2)
+        self.assertEqual(len(self.docman._search()), 2)
+        self.assertEqual(self.docman.doc_dict[1]['_ts'], 2)
+        self.assertEqual(self.applier.counts['i'], 3)
+
+    def test_failed_operation(self):
+        """Test that an operation that fails does not hold back the others
+        """
+        self.applier.put(1, [('d', {'_id': 5, 'ns': 'test.test', '_ts': 1},
+                              None),
+                             insert(1, 1)])
+        self.applier.wait()
+        self.assertTrue(self.applier.running)
+        self.assertEqual(self.applier.checkpoint, 1)
+        self.assertEqual(len(self.docman._search()), 1)
+
+    def test_unexpected_error(self):
+        """Test that the applier stops on unexpected errors without
+        advancing its checkpoint
+        """
+        def broken_bulk_apply(operations):
+            raise ValueError
+
+        self.docman.bulk_apply = broken_bulk_apply
+        self.applier.put(1, [insert(1, 1)])
+        self.applier.put(2, [insert(2, 2)])
+        self.applier.wait()
+        self.assertFalse(self.applier.running)
+        self.assertEqual(self.applier.checkpoint, None)
+        self.assertEqual(self.acknowledged, [])
+
+
+class TestPartitionedOplogApplier(unittest.TestCase):
+    """Tests the OplogApplier with several workers
+    """
+
+    def setUp(self):
+        self.acknowledged = []
+        self.docman = DocManager()
+        self.applier = OplogApplier(
+            self.docman, queue_size=2, workers=4,
+            on_applied=lambda a: self.acknowledged.append(a.checkpoint))
+        self.applier.start()
+
+    def tearDown(self):
+        self.applier.stop()
+
+    def test_ordering(self):
+        """Test that operations on the same document stay in order
+        """
+        for ts in range(1, 51):
+            self.applier.put(ts, [insert(i, ts) for i in range(20)] +
+                             [('u', {'_id': 0, 'ns': 'test.test', '_ts': ts},
+                               {'_id': 0, 'v': ts})])
+        self.applier.wait()
+        self.assertEqual(self.applier.checkpoint, 50)
+        self.assertEqual(self.acknowledged[-1], 50)
+        self.assertEqual(len(self.docman._search()), 20)
+        for doc in self.docman._search():
+            self.assertEqual(doc['_ts'], 50)
+        self.assertEqual(self.docman.doc_dict[0]['v'], 50)
+
+    def test_low_water_mark(self):
+        """Test that the checkpoint waits for the slowest partition
+        """
+        release = threading.Event()
+        original_upsert = self.docman.upsert
+        # The partition that the blocked document ends up in
+        blocked = {'_id': 'blocked', 'ns': 'test.test', '_ts': 1}
+
+        def bulk_apply(operations):
+            for op, doc, update_spec in operations:
+                if doc is blocked:
+                    release.wait()
+                original_upsert(doc)
+
+        self.docman.bulk_apply = bulk_apply
+        self.applier.put(1, [('i', blocked, None)])
+        self.applier.put(2, [insert(i, 2) for i in range(20)])
+        self.applier.put(3, [])
+
+        # Give the other partitions time to get ahead
+        time.sleep(0.5)
+        self.assertEqual(self.applier.checkpoint, None)
+        self.assertEqual(self.acknowledged, [])
+
+        release.set()
+        self.applier.wait()
+        self.assertEqual(self.applier.checkpoint, 3)
+        self.assertEqual(self.acknowledged[-1], 3)
+        self.assertEqual(len(self.docman._search()), 21)
+
+
+if __name__ == '__main__':
+    unittest.main()
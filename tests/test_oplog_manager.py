@@ -15,8 +15,12 @@
 """Test oplog manager methods
 """
 
+import os
+import shutil
+import tempfile
 import time
 import sys
+import threading
 if sys.version_info[:2] == (2, 6):
     import unittest2 as unittest
 else:
@@ -24,16 +28,31 @@ else:
 
 import bson
 import pymongo
+try:
+    from bson.raw_bson import RawBSONDocument
+except ImportError:
+    RawBSONDocument = None
 
 from mongo_connector.doc_managers.doc_manager_simulator import DocManager
+from mongo_connector.errors import OperationFailed
+from mongo_connector.journal import Journal
 from mongo_connector.locking_dict import LockingDict
 from mongo_connector.oplog_manager import OplogThread
+from mongo_connector.util import (bson_ts_to_long, decode_raw,
+                                  replica_set_client)
 from tests import mongo_host
 from tests.setup_cluster import (start_replica_set,
                                  kill_replica_set)
 from tests.util import assert_soon
 
 
+def cursor_address(cursor):
+    """Return the (host, port) of the member a cursor reads from.
+    """
+    # PyMongo 2 only tells it as the connection id
+    return getattr(cursor, "address", None) or cursor.conn_id
+
+
 class TestOplogManager(unittest.TestCase):
     """Defines all the testing methods, as well as a method that sets up the
         cluster
@@ -43,7 +62,13 @@ class TestOplogManager(unittest.TestCase):
         _, _, self.primary_p = start_replica_set('test-oplog-manager')
         self.primary_conn = pymongo.MongoClient(mongo_host, self.primary_p)
         self.oplog_coll = self.primary_conn.local['oplog.rs']
-        self.opman = OplogThread(
+        self.opman = self.oplog_thread()
+
+    def oplog_thread(self, **kwargs):
+        """Return an OplogThread for the replica set, with the given extra
+        arguments
+        """
+        return OplogThread(
             primary_conn=self.primary_conn,
             main_address='%s:%d' % (mongo_host, self.primary_p),
             oplog_coll=self.oplog_coll,
@@ -53,7 +78,8 @@ class TestOplogManager(unittest.TestCase):
             namespace_set=None,
             auth_key=None,
             auth_username=None,
-            repl_set='test-oplog-manager'
+            repl_set='test-oplog-manager',
+            **kwargs
         )
 
     def tearDown(self):
@@ -81,23 +107,27 @@ class TestOplogManager(unittest.TestCase):
         cursor = self.opman.get_oplog_cursor(latest_timestamp)
         self.assertNotEqual(cursor, None)
         self.assertEqual(cursor.count(), 1)
+        # the cursor waits for the entries after the given timestamp
+        self.assertTrue(cursor.alive)
+        doc2 = {"i": 2}
+        self.primary_conn["test"]["test"].insert(doc2)
         next_entry_id = next(cursor)['o']['_id']
         retrieved = self.primary_conn.test.test.find_one(next_entry_id)
-        self.assertEqual(retrieved, doc)
+        self.assertEqual(retrieved, doc2)
 
         # many entries before and after timestamp
         self.primary_conn["test"]["test"].insert(
-            {"i": i} for i in range(2, 1002))
+            {"i": i} for i in range(3, 1003))
         oplog_cursor = self.oplog_coll.find(
             sort=[("ts", pymongo.ASCENDING)]
         )
 
-        # startup + insert + 1000 inserts
-        self.assertEqual(oplog_cursor.count(), 2 + 1000)
+        # startup + 2 inserts + 1000 inserts
+        self.assertEqual(oplog_cursor.count(), 3 + 1000)
         pivot = oplog_cursor.skip(400).limit(1)[0]
 
         goc_cursor = self.opman.get_oplog_cursor(pivot["ts"])
-        self.assertEqual(goc_cursor.count(), 2 + 1000 - 400)
+        self.assertEqual(goc_cursor.count(), 3 + 1000 - 400)
 
         # get_oplog_cursor fast-forwards *one doc beyond* the given timestamp
         doc = self.primary_conn["test"]["test"].find_one(
@@ -105,6 +135,41 @@ class TestOplogManager(unittest.TestCase):
         retrieved = self.primary_conn.test.test.find_one(pivot['o']['_id'])
         self.assertEqual(doc["i"], retrieved["i"] + 1)
 
+    def test_oplog_query(self):
+        """Test that the oplog cursor only returns the entries to replicate
+        """
+        first_entry = self.oplog_coll.find_one(
+            sort=[("$natural", pymongo.ASCENDING)])
+        self.primary_conn["test"]["test"].insert({"i": 1})
+        self.primary_conn["test"]["test"].remove({"i": 1})
+
+        cursor = self.opman.get_oplog_cursor(first_entry["ts"])
+        self.assertEqual([entry["op"] for entry in cursor], ["i", "d"])
+
+        self.opman.namespace_set = ["test.other"]
+        cursor = self.opman.get_oplog_cursor(first_entry["ts"])
+        self.assertEqual(list(cursor), [])
+
+        self.opman.namespace_set = ["te*.t*"]
+        cursor = self.opman.get_oplog_cursor(first_entry["ts"])
+        self.assertEqual([entry["op"] for entry in cursor], ["i", "d"])
+
+        self.opman.ex_namespace_set = ["*.test"]
+        cursor = self.opman.get_oplog_cursor(first_entry["ts"])
+        self.assertEqual(list(cursor), [])
+
+    @unittest.skipIf(RawBSONDocument is None, "Requires PyMongo 3.2+")
+    def test_oplog_cursor_raw(self):
+        """Test that the oplog cursor returns entries as raw BSON
+        """
+        self.primary_conn["test"]["test"].insert({"i": 0})
+        cursor = self.opman.get_oplog_cursor(
+            self.opman.get_last_oplog_timestamp())
+        self.primary_conn["test"]["test"].insert({"i": 1})
+        entry = next(cursor)
+        self.assertIsInstance(entry, RawBSONDocument)
+        self.assertEqual(decode_raw(entry)["o"]["i"], 1)
+
     def test_get_last_oplog_timestamp(self):
         """Test the get_last_oplog_timestamp method"""
 
@@ -123,6 +188,51 @@ class TestOplogManager(unittest.TestCase):
         self.assertEqual(self.opman.get_last_oplog_timestamp(),
                          oplog["ts"])
 
+    def test_majority_tailing(self):
+        """Test that batches wait for a majority of the replica set, and are
+        dropped if their last entry is no longer in the oplog
+        """
+        self.opman.majority_tailing = True
+        self.primary_conn["test"]["test"].insert({"i": 1})
+        last_ts = self.opman.get_last_oplog_timestamp()
+        assert_soon(lambda: self.opman.get_majority_timestamp() >= last_ts)
+        self.assertTrue(self.opman._wait_for_majority(last_ts))
+
+        # An entry that isn't in the oplog was rolled back
+        self.assertFalse(self.opman._wait_for_majority(
+            bson.Timestamp(1, 0)))
+        self.opman.dispatch(bson.Timestamp(1, 0), [])
+        self.assertTrue(self.opman._stale_cursor)
+        self.assertEqual(self.opman._dispatched_ts, None)
+
+    def test_get_majority_timestamp(self):
+        """Test reading the majority timestamp in every form servers report
+        """
+        class StatusClient(object):
+            def __init__(self, status):
+                self.status = status
+
+            def __getitem__(self, name):
+                return self
+
+            def command(self, name):
+                return self.status
+
+        ts = bson.Timestamp(1000, 1)
+        for committed in (ts, {"ts": ts, "t": 1}):
+            self.opman.primary_connection = StatusClient(
+                {"optimes": {"lastCommittedOpTime": committed},
+                 "members": []})
+            self.assertEqual(self.opman.get_majority_timestamp(), ts)
+
+        # Older servers only report the optime of each member
+        older = bson.Timestamp(999, 1)
+        self.opman.primary_connection = StatusClient({"members": [
+            {"state": 1, "health": 1, "optime": ts},
+            {"state": 2, "health": 1, "optime": {"ts": older, "t": 1}},
+            {"state": 7, "health": 1}]})
+        self.assertEqual(self.opman.get_majority_timestamp(), older)
+
     def test_dump_collection(self):
         """Test the dump_collection method
 
@@ -147,6 +257,284 @@ class TestOplogManager(unittest.TestCase):
         self.assertEqual(last_ts, self.opman.dump_collection())
         self.assertEqual(len(self.opman.doc_managers[0]._search()), 1000)
 
+    def test_dump_workers(self):
+        """Test dumping several collections into several targets at once,
+        largest collections first
+        """
+        sizes = {"test.small": 10, "test.large": 300, "test.medium": 100}
+        for namespace, size in sizes.items():
+            database, coll = namespace.split(".", 1)
+            self.primary_conn[database][coll].insert(
+                {"i": i} for i in range(size))
+        self.assertEqual(
+            [ns for ns, _ in self.opman._by_size(list(sizes))],
+            ["test.large", "test.medium", "test.small"])
+
+        self.opman.doc_managers = [DocManager(), DocManager()]
+        self.opman.namespace_set = list(sizes)
+        self.opman.dump_workers = 3
+        last_ts = self.opman.get_last_oplog_timestamp()
+        self.assertEqual(last_ts, self.opman.dump_collection())
+        for docman in self.opman.doc_managers:
+            self.assertEqual(len(docman._search()), sum(sizes.values()))
+
+    def test_dump_failed_target(self):
+        """Test that a target failing during a dump stops the dump for every
+        target
+        """
+        class FailingDocManager(DocManager):
+            def upsert(self, doc):
+                raise OperationFailed("Failed to upsert")
+
+        self.primary_conn["test"]["test"].insert(
+            {"i": i} for i in range(1000))
+        self.opman.doc_managers = [DocManager(), FailingDocManager()]
+        self.assertEqual(None, self.opman.dump_collection())
+        self.assertFalse(self.opman.running)
+
+    def test_dump_resume(self):
+        """Test resuming an interrupted dump where it stopped
+        """
+        class FailingDocManager(DocManager):
+            def upsert(self, doc):
+                if doc["i"] == 2500:
+                    raise OperationFailed("Failed to upsert")
+                super(FailingDocManager, self).upsert(doc)
+
+        self.primary_conn["test"]["test"].insert(
+            {"i": i} for i in range(5000))
+        last_ts = self.opman.get_last_oplog_timestamp()
+        self.opman.doc_managers = [FailingDocManager()]
+        self.assertEqual(None, self.opman.dump_collection())
+
+        # Progress is recorded after each chunk of documents
+        progress = self.opman.read_dump_progress()
+        self.assertEqual(progress["ts"], bson_ts_to_long(last_ts))
+        self.assertEqual(progress["namespaces"], ["test.test"])
+        dump_range = progress["ranges"][0]
+        self.assertFalse(dump_range["done"])
+        resume_doc = self.primary_conn["test"]["test"].find_one(
+            {"_id": dump_range["last_id"]})
+        self.assertEqual(resume_doc["i"], 1999)
+
+        # Only the rest of the collection is dumped again
+        self.opman.running = True
+        self.opman.doc_managers = [DocManager()]
+        self.assertEqual(last_ts, self.opman.dump_collection())
+        docs = self.opman.doc_managers[0]._search()
+        self.assertEqual(sorted(doc["i"] for doc in docs),
+                         list(range(2000, 5000)))
+        self.assertTrue(self.opman.read_dump_progress()["ranges"][0]["done"])
+
+        # Tailing the oplog ends the dump
+        self.opman.init_cursor()
+        self.assertEqual(None, self.opman.read_dump_progress())
+
+    def test_rollback_chunks(self):
+        """Test that rollback reconciles documents in bounded chunks, with
+        the bulk operations of the target
+        """
+        class BulkDocManager(DocManager):
+            def __init__(self):
+                super(BulkDocManager, self).__init__()
+                self.batches = []
+
+            def bulk_apply(self, operations):
+                self.batches.append(len(operations))
+                super(BulkDocManager, self).bulk_apply(operations)
+
+        self.primary_conn["test"]["test"].insert(
+            {"i": i} for i in range(2500))
+        cutoff_ts = self.opman.get_last_oplog_timestamp()
+        later_ts = bson_ts_to_long(cutoff_ts) + 1
+        dm = BulkDocManager()
+        self.opman.doc_managers = [dm]
+        # The target holds updates and inserts that were rolled back
+        for doc in self.primary_conn["test"]["test"].find():
+            doc.update(ns="test.test", _ts=later_ts, i=-1)
+            dm.upsert(doc)
+        for i in range(500):
+            dm.upsert({"_id": bson.ObjectId(), "ns": "test.test",
+                       "_ts": later_ts, "i": -1})
+
+        self.assertEqual(cutoff_ts, self.opman.rollback())
+        self.assertEqual(dm.batches, [1000, 1000, 1000])
+        docs = dm._search()
+        self.assertEqual(sorted(doc["i"] for doc in docs), list(range(2500)))
+        self.assertTrue(all(doc["_ts"] == bson_ts_to_long(cutoff_ts)
+                            for doc in docs))
+
+    def test_rollback_without_bulk_apply(self):
+        """Test rolling back a target that doesn't implement bulk_apply
+        """
+        class PlainDocManager(object):
+            def __init__(self):
+                self.dm = DocManager()
+
+            def __getattr__(self, name):
+                if name == "bulk_apply":
+                    raise AttributeError(name)
+                return getattr(self.dm, name)
+
+        self.primary_conn["test"]["test"].insert(
+            {"i": i} for i in range(10))
+        cutoff_ts = self.opman.get_last_oplog_timestamp()
+        later_ts = bson_ts_to_long(cutoff_ts) + 1
+        dm = PlainDocManager()
+        self.opman.doc_managers = [dm]
+        for doc in self.primary_conn["test"]["test"].find():
+            doc.update(ns="test.test", _ts=later_ts, i=-1)
+            dm.upsert(doc)
+        dm.upsert({"_id": bson.ObjectId(), "ns": "test.test",
+                   "_ts": later_ts, "i": -1})
+
+        self.assertEqual(cutoff_ts, self.opman.rollback())
+        docs = dm._search()
+        self.assertEqual(sorted(doc["i"] for doc in docs), list(range(10)))
+
+    def test_rollback_workers(self):
+        """Test rolling back several targets and namespaces in parallel
+        """
+        for coll in ("test", "other"):
+            self.primary_conn["test"][coll].insert(
+                {"i": i} for i in range(1500))
+        cutoff_ts = self.opman.get_last_oplog_timestamp()
+        later_ts = bson_ts_to_long(cutoff_ts) + 1
+        self.opman.doc_managers = [DocManager(), DocManager()]
+        self.opman.rollback_workers = [4, 1]
+        for dm in self.opman.doc_managers:
+            for coll in ("test", "other"):
+                for doc in self.primary_conn["test"][coll].find():
+                    doc.update(ns="test." + coll, _ts=later_ts, i=-1)
+                    dm.upsert(doc)
+                dm.upsert({"_id": bson.ObjectId(), "ns": "test." + coll,
+                           "_ts": later_ts, "i": -1})
+
+        self.assertEqual(cutoff_ts, self.opman.rollback())
+        for dm in self.opman.doc_managers:
+            docs = dm._search()
+            self.assertEqual(sorted(doc["i"] for doc in docs),
+                             sorted(list(range(1500)) * 2))
+
+    def test_rollback_journal(self):
+        """Test that rollback looks up documents in the journal instead of
+        searching the targets
+        """
+        class UnsearchableDocManager(DocManager):
+            def search(self, start_ts, end_ts):
+                raise AssertionError("The target was searched")
+
+            def get_last_doc(self):
+                raise AssertionError("The target was searched")
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        journal = Journal(os.path.join(directory, "journal.db"))
+        self.addCleanup(journal.close)
+        self.opman.journal = journal
+        dm = UnsearchableDocManager()
+        self.opman.doc_managers = [dm]
+        oplog_name = str(self.opman.oplog)
+
+        self.primary_conn["test"]["test"].insert({"i": 0})
+        cutoff_ts = self.opman.get_last_oplog_timestamp()
+        journal.start(oplog_name, bson_ts_to_long(cutoff_ts))
+        # Operations handed to the target, then rolled back
+        later_ts = bson_ts_to_long(cutoff_ts) + 1
+        operations = [("i", {"_id": bson.ObjectId(), "ns": "test.test",
+                             "_ts": later_ts}, None) for _ in range(10)]
+        journal.record(oplog_name, later_ts, operations)
+        for _, doc, _ in operations:
+            dm.upsert(dict(doc, i=-1))
+        doc = self.primary_conn["test"]["test"].find_one()
+        doc.update(ns="test.test", _ts=later_ts, i=-1)
+        dm.upsert(doc)
+        journal.record(oplog_name, later_ts,
+                       [("u", {"_id": doc["_id"], "ns": "test.test",
+                               "_ts": later_ts}, {"i": -1})])
+
+        self.assertEqual(cutoff_ts, self.opman.rollback())
+        self.assertEqual([doc["i"] for doc in dm._search()], [0])
+
+    def test_rollback_journal_started(self):
+        """Test that rollback searches the targets when the journal started
+        at the checkpoint, which the targets may be ahead of
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        journal = Journal(os.path.join(directory, "journal.db"))
+        self.addCleanup(journal.close)
+        self.opman.journal = journal
+        dm = self.opman.doc_managers[0]
+
+        self.primary_conn["test"]["test"].insert({"i": 0})
+        cutoff_ts = self.opman.get_last_oplog_timestamp()
+        with self.opman.oplog_progress as prog:
+            prog.get_dict()[str(self.opman.oplog)] = cutoff_ts
+        # The target applied an update past the checkpoint before the
+        # journal was enabled, and the update was then rolled back
+        doc = self.primary_conn["test"]["test"].find_one()
+        doc.update(ns="test.test", _ts=bson_ts_to_long(cutoff_ts) + 1, i=-1)
+        dm.upsert(doc)
+
+        self.assertNotEqual(self.opman.init_cursor(), None)
+        self.assertEqual(cutoff_ts, self.opman.rollback())
+        self.assertEqual([doc["i"] for doc in dm._search()], [0])
+
+    def test_dump_read_preference(self):
+        """Test dumping collections from a secondary
+        """
+        self.primary_conn["test"]["test"].insert(
+            ({"i": i} for i in range(100)), w=2)
+        opman = self.oplog_thread(dump_read_preference="secondary")
+        cursor = opman._source_database("test")["test"].find()
+        next(cursor)
+        self.assertNotEqual(cursor_address(cursor)[1], self.primary_p)
+
+        last_ts = opman.get_last_oplog_timestamp()
+        self.assertEqual(last_ts, opman.dump_collection())
+        self.assertEqual(len(opman.doc_managers[0]._search()), 100)
+
+    def test_tail_read_preference(self):
+        """Test tailing the oplog from a secondary
+        """
+        self.primary_conn["test"]["test"].insert({"i": 0}, w=2)
+        tail_conn = replica_set_client(
+            '%s:%d' % (mongo_host, self.primary_p), 'test-oplog-manager',
+            'secondary')
+        self.addCleanup(tail_conn.close)
+        opman = self.oplog_thread(tail_read_preference="secondary",
+                                  tail_conn=tail_conn)
+        self.assertEqual(opman.tail_oplog().full_name, "local.oplog.rs")
+
+        last_ts = opman.get_last_oplog_timestamp()
+        self.assertTrue(opman.has_entry(last_ts))
+        cursor = opman.get_oplog_cursor(last_ts)
+        self.assertNotEqual(cursor, None)
+        self.assertNotEqual(cursor_address(cursor)[1], self.primary_p)
+        self.primary_conn["test"]["test"].insert({"i": 1}, w=2)
+        self.assertEqual(next(cursor)["o"]["i"], 1)
+
+    def test_dump_split_collection(self):
+        """Test dumping a large collection in several _id ranges at once
+        """
+        padding = "x" * 1024
+        self.primary_conn["test"]["test"].insert(
+            {"i": i, "padding": padding} for i in range(3000))
+        self.opman.namespace_set = ["test.test"]
+        self.opman.dump_workers = 3
+        self.opman.dump_split_size = 1
+
+        size = self.primary_conn["test"].command("collstats", "test")["size"]
+        split_points = self.opman._split_points("test.test", size)
+        self.assertGreaterEqual(len(split_points), 2)
+        self.assertEqual(split_points, sorted(split_points))
+
+        last_ts = self.opman.get_last_oplog_timestamp()
+        self.assertEqual(last_ts, self.opman.dump_collection())
+        docs = self.opman.doc_managers[0]._search()
+        self.assertEqual(sorted(doc["i"] for doc in docs), list(range(3000)))
+
     def test_init_cursor(self):
         """Test the init_cursor method
 
@@ -181,14 +569,14 @@ class TestOplogManager(unittest.TestCase):
         collection.remove({"i": 1})
         time.sleep(3)
         last_ts = self.opman.get_last_oplog_timestamp()
-        self.assertEqual(next(self.opman.init_cursor())["ts"], last_ts)
+        self.assertTrue(self.opman.init_cursor().alive)
         self.assertEqual(self.opman.checkpoint, last_ts)
         with self.opman.oplog_progress as prog:
             self.assertEqual(prog.get_dict()[str(self.opman.oplog)], last_ts)
 
         # No last checkpoint, non-empty collections, stuff in oplog
         self.opman.oplog_progress = LockingDict()
-        self.assertEqual(next(self.opman.init_cursor())["ts"], last_ts)
+        self.assertTrue(self.opman.init_cursor().alive)
         self.assertEqual(self.opman.checkpoint, last_ts)
         with self.opman.oplog_progress as prog:
             self.assertEqual(prog.get_dict()[str(self.opman.oplog)], last_ts)
@@ -345,6 +733,151 @@ class TestOplogManager(unittest.TestCase):
         for d in doc_managers:
             self.assertEqual(d._search()[0]["name"], "kermit")
 
+    def test_apply_batches(self):
+        """Test that oplog entries are applied in batches, and that every
+        entry in a batch reaches every target.
+        """
+        applied = []
+
+        class BatchRecordingDocManager(DocManager):
+            def bulk_apply(self, operations):
+                applied.append(len(operations))
+                super(BatchRecordingDocManager, self).bulk_apply(operations)
+
+        doc_managers = [BatchRecordingDocManager(), DocManager()]
+        self.opman.doc_managers = doc_managers
+        self.opman.apply_batch_size = 10
+        self.opman.apply_batch_wait = 60
+
+        self.opman.start()
+        self.primary_conn["test"]["test"].insert(
+            {"i": i} for i in range(100))
+        self.primary_conn["test"]["test"].update(
+            {"i": 0}, {"$set": {"j": 1}})
+        self.primary_conn["test"]["test"].remove({"i": 1})
+
+        for docman in doc_managers:
+            assert_soon(lambda: len(docman._search()) == 99)
+            assert_soon(lambda: any(d.get("j") == 1
+                                    for d in docman._search()))
+        self.assertTrue(all(size <= 10 for size in applied))
+        self.assertLess(len(applied), 102)
+
+    def test_concurrent_dump(self):
+        """Test tailing the oplog while collections are dumped, holding back
+        the changes to each collection until it is dumped
+        """
+        release = threading.Event()
+
+        class SlowDumpDocManager(DocManager):
+            def upsert(self, doc):
+                if doc["ns"] == "test.test":
+                    release.wait(10)
+                super(SlowDumpDocManager, self).upsert(doc)
+
+        docman = SlowDumpDocManager()
+        self.opman.doc_managers = [docman]
+        self.opman.concurrent_dump = True
+        self.primary_conn["test"]["test"].insert(
+            {"_id": i} for i in range(100))
+
+        self.opman.start()
+        assert_soon(lambda: self.opman.read_dump_progress() is not None)
+        self.primary_conn["test"]["test"].update(
+            {"_id": 0}, {"$set": {"j": 1}})
+        self.primary_conn["test"]["other"].insert({"_id": "other"})
+
+        # Other collections are replicated during the dump
+        assert_soon(lambda: any(d["_id"] == "other"
+                                for d in docman._search()))
+        self.assertEqual(
+            None, self.opman.read_last_checkpoint())
+
+        # Changes held back are applied once the collection is dumped
+        release.set()
+        assert_soon(lambda: any(d.get("j") == 1 for d in docman._search()))
+        assert_soon(lambda: self.opman.read_dump_progress() is None)
+        self.assertEqual(len(docman._search()), 101)
+        self.assertNotEqual(None, self.opman.read_last_checkpoint())
+
+    def test_coalesce(self):
+        """Test that the operations on each document are collapsed into
+        their net effect when coalescing is enabled.
+        """
+        applied = []
+
+        class RecordingDocManager(DocManager):
+            def bulk_apply(self, operations):
+                applied.extend(operations)
+                super(RecordingDocManager, self).bulk_apply(operations)
+
+        docman = RecordingDocManager()
+        self.opman.doc_managers = [docman]
+        self.opman.coalesce_window = 2
+
+        self.opman.start()
+        coll = self.primary_conn["test"]["test"]
+        coll.insert({"_id": 1, "count": 0})
+        for _ in range(20):
+            coll.update({"_id": 1}, {"$inc": {"count": 1}})
+
+        assert_soon(lambda: any(d.get("count") == 20
+                                for d in docman._search()))
+        self.assertLess(len(applied), 21)
+
+    def test_slow_target(self):
+        """Test that a slow target system doesn't hold back the others,
+        and that the checkpoint only moves past what every target applied.
+        """
+        release = threading.Event()
+        slow, fast = DocManager(), DocManager()
+        original_bulk_apply = slow.bulk_apply
+
+        def slow_bulk_apply(operations):
+            release.wait()
+            original_bulk_apply(operations)
+
+        slow.bulk_apply = slow_bulk_apply
+        self.opman.doc_managers = [slow, fast]
+        self.opman.start()
+
+        self.primary_conn["test"]["test"].insert({"name": "kermit"})
+        assert_soon(lambda: len(fast._search()) == 1)
+        self.assertEqual(len(slow._search()), 0)
+        slow_ts, fast_ts = self.opman.target_checkpoints()
+        self.assertIsNone(slow_ts)
+        self.assertIsNotNone(fast_ts)
+        self.assertNotEqual(self.opman.checkpoint, fast_ts)
+
+        release.set()
+        assert_soon(lambda: len(slow._search()) == 1)
+        assert_soon(lambda: self.opman.checkpoint == fast_ts)
+
+    def test_entry_to_operation(self):
+        ts = bson.Timestamp(1, 2)
+        long_ts = (1 << 32) + 2
+        self.opman.dest_mapping = {"test.test": "test.dest"}
+
+        op = self.opman.entry_to_operation(
+            {"op": "i", "ns": "test.test", "ts": ts, "o": {"_id": 1}})
+        self.assertEqual(
+            op, ("i", {"_id": 1, "ns": "test.dest", "_ts": long_ts}, None))
+
+        op = self.opman.entry_to_operation(
+            {"op": "u", "ns": "test.other", "ts": ts,
+             "o2": {"_id": 1}, "o": {"$set": {"a": 1}}})
+        self.assertEqual(
+            op, ("u", {"_id": 1, "ns": "test.other", "_ts": long_ts},
+                 {"$set": {"a": 1}}))
+
+        op = self.opman.entry_to_operation(
+            {"op": "d", "ns": "test.test", "ts": ts, "o": {"_id": 1}})
+        self.assertEqual(
+            op, ("d", {"_id": 1, "ns": "test.dest", "_ts": long_ts}, None))
+
+        self.assertIsNone(self.opman.entry_to_operation(
+            {"op": "n", "ns": "", "ts": ts, "o": {"msg": "hi"}}))
+
     def test_filter_oplog_entry(self):
         # Test oplog entries: these are callables, since
         # filter_oplog_entry modifies the oplog entry in-place
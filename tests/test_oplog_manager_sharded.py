@@ -207,9 +207,8 @@ class TestOplogManagerSharded(unittest.TestCase):
         cursor = self.opman1.get_oplog_cursor(latest_timestamp)
         self.assertNotEqual(cursor, None)
         self.assertEqual(cursor.count(), 1)
-        next_entry_id = cursor[0]['o']['_id']
-        retrieved = self.mongos_conn.test.mcsharded.find_one(next_entry_id)
-        self.assertEqual(retrieved, doc)
+        # the cursor waits for the entries after the given timestamp
+        self.assertTrue(cursor.alive)
 
         # many entries before and after timestamp
         for i in range(2, 2002):
@@ -347,13 +346,12 @@ class TestOplogManagerSharded(unittest.TestCase):
         collection.remove({"i": 1})
         time.sleep(3)
         last_ts1 = self.opman1.get_last_oplog_timestamp()
-        self.assertEqual(next(self.opman1.init_cursor())["ts"], last_ts1)
+        self.assertTrue(self.opman1.init_cursor().alive)
         self.assertEqual(self.opman1.checkpoint, last_ts1)
         with self.opman1.oplog_progress as prog:
             self.assertEqual(prog.get_dict()[str(self.opman1.oplog)], last_ts1)
         # init_cursor should point to startup message in shard2 oplog
-        cursor = self.opman2.init_cursor()
-        self.assertEqual(next(cursor)["ts"], oplog_startup_ts)
+        self.assertTrue(self.opman2.init_cursor().alive)
         self.assertEqual(self.opman2.checkpoint, oplog_startup_ts)
 
         # No last checkpoint, non-empty collections, stuff in oplog
@@ -361,11 +359,11 @@ class TestOplogManagerSharded(unittest.TestCase):
         self.opman1.oplog_progress = self.opman2.oplog_progress = progress
         collection.insert({"i": 1200})
         last_ts2 = self.opman2.get_last_oplog_timestamp()
-        self.assertEqual(next(self.opman1.init_cursor())["ts"], last_ts1)
+        self.assertTrue(self.opman1.init_cursor().alive)
         self.assertEqual(self.opman1.checkpoint, last_ts1)
         with self.opman1.oplog_progress as prog:
             self.assertEqual(prog.get_dict()[str(self.opman1.oplog)], last_ts1)
-        self.assertEqual(next(self.opman2.init_cursor())["ts"], last_ts2)
+        self.assertTrue(self.opman2.init_cursor().alive)
         self.assertEqual(self.opman2.checkpoint, last_ts2)
         with self.opman2.oplog_progress as prog:
             self.assertEqual(prog.get_dict()[str(self.opman2.oplog)], last_ts2)
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import time
 import sys
 if sys.version_info[:2] == (2, 6):
@@ -115,6 +116,22 @@ class SolrDocManagerTester(unittest.TestCase):
         for i, r in enumerate(res):
             self.assertEqual(r, 2*i)
 
+    def test_bulk_export(self):
+        """Ensure exported documents are JSON updates of the documents,
+        cleaned like bulk_upsert does.
+        """
+        docs = [{"_id": i, "ns": "test.test", "a": {"b": i}}
+                for i in range(3)]
+        body = self.SolrDoc.bulk_export(docs)
+        exported = sorted(json.loads(body), key=lambda doc: doc["_id"])
+        self.assertEqual([doc["_id"] for doc in exported], [0, 1, 2])
+        self.assertEqual([doc["a.b"] for doc in exported], [0, 1, 2])
+
+        self.solr._send_request(
+            'post', 'update/json?commit=true', body=body,
+            headers={'Content-type': 'application/json'})
+        self.assertEqual(len(self.solr.search("*:*")), 3)
+
     def test_remove(self):
         """Ensure we can properly delete from Solr via DocManager.
         """
@@ -0,0 +1,69 @@
+# Copyright 2013-2014 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests methods in spill.py
+"""
+
+import sys
+
+sys.path[0:0] = [""]
+
+if sys.version_info[:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+from bson.objectid import ObjectId
+
+from mongo_connector.spill import SpillBuffer
+
+
+class SpillBufferTester(unittest.TestCase):
+    """Tests holding operations in memory and on disk
+    """
+
+    def test_in_memory(self):
+        """Operations below the limit stay in memory
+        """
+        buf = SpillBuffer(max_memory=10)
+        for i in range(5):
+            buf.append(('i', {'_id': i}, None))
+        self.assertEqual(len(buf), 5)
+        self.assertEqual(buf._file, None)
+        self.assertEqual([doc['_id'] for _, doc, _ in buf], list(range(5)))
+
+    def test_spill(self):
+        """Operations past the limit are spilled and read back in order
+        """
+        buf = SpillBuffer(max_memory=3)
+        operations = [('u', {'_id': ObjectId(), 'ns': 'test.test'},
+                       {'$set': {'i': i}}) for i in range(10)]
+        for operation in operations[:6]:
+            buf.append(operation)
+        self.assertNotEqual(buf._file, None)
+        self.assertEqual(list(buf), operations[:6])
+
+        # Appending after reading the buffer
+        for operation in operations[6:]:
+            buf.append(operation)
+        self.assertEqual(len(buf), 10)
+        self.assertEqual(list(buf), operations)
+
+        buf.close()
+        self.assertEqual(len(buf), 0)
+        self.assertEqual(list(buf), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
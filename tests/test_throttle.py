@@ -0,0 +1,109 @@
+# Copyright 2013-2014 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests methods in throttle.py
+"""
+
+import sys
+
+sys.path[0:0] = [""]
+
+if sys.version_info[:2] == (2, 6):
+    import unittest2 as unittest
+else:
+    import unittest
+
+from mongo_connector import throttle
+from mongo_connector.metrics import registry
+from mongo_connector.throttle import Throttle, TokenBucket
+
+
+class ThrottleTester(unittest.TestCase):
+    """Tests limiting rates of documents and bytes
+    """
+
+    def setUp(self):
+        registry.reset()
+        self.waits = []
+        self._sleep = throttle.time.sleep
+        throttle.time.sleep = self.waits.append
+
+    def tearDown(self):
+        throttle.time.sleep = self._sleep
+        registry.reset()
+
+    def test_token_bucket(self):
+        """Tokens within the burst are free, and debt has to be waited for
+        """
+        bucket = TokenBucket(100.0)
+        self.assertEqual(bucket.take(100), 0)
+        self.assertAlmostEqual(bucket.take(50), 0.5, places=2)
+        self.assertAlmostEqual(bucket.take(50), 1.0, places=2)
+
+    def test_no_limit(self):
+        """Without limits, consume never waits
+        """
+        unlimited = Throttle('dump')
+        self.assertFalse(unlimited)
+        self.assertFalse(unlimited.limits_bytes)
+        unlimited.consume(10 ** 9, 10 ** 12)
+        self.assertEqual(self.waits, [])
+        self.assertEqual(registry.snapshot()['counters'], {})
+
+    def test_docs_limit(self):
+        """Going over the documents limit waits, and records the wait
+        """
+        limited = Throttle('dump', docs_per_sec=1000)
+        self.assertTrue(limited)
+        self.assertFalse(limited.limits_bytes)
+        limited.consume(1000)
+        self.assertEqual(self.waits, [])
+        limited.consume(500)
+        self.assertEqual(len(self.waits), 1)
+        self.assertAlmostEqual(self.waits[0], 0.5, places=2)
+
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot['counters']['throttle.waits'], {'dump': 1})
+        self.assertIn('dump', snapshot['histograms']['throttle.wait_time'])
+
+    def test_bytes_limit(self):
+        """The bytes limit is in megabytes per second
+        """
+        limited = Throttle('tail', mb_per_sec=1)
+        self.assertTrue(limited.limits_bytes)
+        limited.consume(1, 1024 * 1024)
+        self.assertEqual(self.waits, [])
+        limited.consume(1, 2 * 1024 * 1024)
+        self.assertEqual(len(self.waits), 1)
+        self.assertAlmostEqual(self.waits[0], 2, places=2)
+        self.assertEqual(registry.snapshot()['counters']['throttle.waits'],
+                         {'tail': 1})
+
+    def test_set_rates(self):
+        """Limits can be changed or lifted while in use
+        """
+        limited = Throttle('dump', docs_per_sec=10)
+        limited.consume(100)
+        self.assertEqual(len(self.waits), 1)
+        limited.set_rates(docs_per_sec=1000)
+        limited.consume(100)
+        self.assertEqual(len(self.waits), 1)
+        limited.set_rates()
+        self.assertFalse(limited)
+        limited.consume(10 ** 6)
+        self.assertEqual(len(self.waits), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -23,8 +23,20 @@ if sys.version_info[:2] == (2, 6):
     import unittest2 as unittest
 else:
     import unittest
+import bson
+import pymongo
 from bson import timestamp
-from mongo_connector.util import (bson_ts_to_long,
+try:
+    from bson.raw_bson import RawBSONDocument
+except ImportError:
+    RawBSONDocument = None
+from mongo_connector import util
+from mongo_connector.util import (Backoff,
+                                  bson_size,
+                                  bson_ts_to_long,
+                                  buffered_count,
+                                  decode_raw,
+                                  get_database,
                                   long_to_bson_ts,
                                   retry_until_ok)
 
@@ -64,6 +76,67 @@ class UtilTester(unittest.TestCase):
         self.assertTrue(retry_until_ok(err_func))
         self.assertEqual(err_func.counter, 3)
 
+    def test_backoff(self):
+        """Test that Backoff waits exponentially longer, up to a maximum
+        """
+        waits = []
+        sleep = util.time.sleep
+        util.time.sleep = waits.append
+        try:
+            backoff = Backoff(initial=1, maximum=5)
+            for _ in range(5):
+                backoff.sleep()
+            backoff.reset()
+            backoff.sleep()
+        finally:
+            util.time.sleep = sleep
+        self.assertEqual(waits, [1, 2, 4, 5, 5, 1])
+
+    def test_buffered_count(self):
+        """Test counting the documents a cursor received and hasn't returned
+        """
+        self.assertIsNone(buffered_count(object()))
+        if pymongo.version_tuple[0] >= 3:
+            client = pymongo.MongoClient(connect=False)
+            # Nothing is received before the cursor is iterated
+            self.assertEqual(buffered_count(client.test.test.find()), 0)
+
+    def test_decode_raw(self):
+        """Test bson_size and decode_raw with decoded documents
+        """
+        doc = {"_id": 1, "o": {"a": [1, 2]}}
+        self.assertEqual(bson_size(doc), len(bson.BSON.encode(doc)))
+        self.assertIs(decode_raw(doc), doc)
+
+    @unittest.skipIf(RawBSONDocument is None, "Requires PyMongo 3.2+")
+    def test_decode_raw_bson(self):
+        """Test bson_size and decode_raw with raw BSON documents
+        """
+        doc = {"_id": 1, "o": {"a": [1, {"b": 2}]}}
+        raw = RawBSONDocument(bson.BSON.encode(doc))
+        self.assertEqual(bson_size(raw), len(raw.raw))
+        decoded = decode_raw(raw)
+        self.assertEqual(decoded, doc)
+        self.assertIsInstance(decoded["o"]["a"][1], dict)
+
+    @unittest.skipIf(pymongo.version_tuple[0] < 3, "Requires PyMongo 3+")
+    def test_get_database(self):
+        """Test reading a database with a given read preference
+        """
+        from pymongo.read_preferences import ReadPreference
+        client = pymongo.MongoClient(connect=False)
+        self.assertEqual(get_database(client, "test").read_preference,
+                         client.read_preference)
+        database = get_database(client, "test", "secondaryPreferred")
+        self.assertEqual(database.read_preference,
+                         ReadPreference.SECONDARY_PREFERRED)
+        database = get_database(client, "test", "secondary",
+                                [{"use": "analytics"}, {}])
+        self.assertEqual(database.read_preference.mongos_mode, "secondary")
+        self.assertEqual(database.read_preference.tag_sets,
+                         [{"use": "analytics"}, {}])
+        self.assertEqual(database.name, "test")
+
 
 if __name__ == '__main__':
 